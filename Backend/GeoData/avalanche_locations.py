@@ -0,0 +1,103 @@
+###############################################################
+# WGS84 coordinates and terrain heights of past avalanches,
+# which the SAIS records by BNG easting and northing. These are
+# stored with each avalanche record as it is added or amended by
+# the crawler, through CrawlerDB.add_past_avalanches, so that
+# they are not converted and read again on every request. Run
+# from the Backend directory to fill them in for records
+# without them, or for all records with --all, after the height
+# raster changes. This first migrates databases created before
+# the columns were added:
+#   python -m GeoData.avalanche_locations [--all]
+###############################################################
+
+from __future__ import division, print_function
+
+import os
+import sys
+import numpy as np
+
+from GeoData import rasters, bng_to_lonlat
+from GeoData.raster_reader import RasterReader
+from SAISCrawler.script import db_manager, utils
+
+
+class AvalancheLocator:
+    """ Converts the BNG locations of avalanches to WGS84 coordinates and reads
+        their heights from a height raster reader. """
+
+    def __init__(self, height_raster):
+
+        self._height_raster = height_raster
+
+
+    def locate_avalanches(self, locations):
+        """ Return a list of tuples (longitude, latitude, height) for a list of
+            avalanche locations (easting, northing), with None for values that
+            cannot be found: coordinates of invalid locations, and heights outside
+            the raster or without data. """
+
+        valid = []
+        for easting, northing in locations:
+            try:
+                valid.append((int(easting), int(northing)))
+            except (TypeError, ValueError):
+                valid.append(None)
+
+        # Convert and read the heights of all valid locations at once.
+        located = [v for v in valid if v is not None]
+        longitudes, latitudes = bng_to_lonlat.OSGB36toWGS84_array([v[0] for v in located], [v[1] for v in located])
+        heights = self._height_raster.read_points_at(longitudes, latitudes)
+
+        results = []
+        coordinates = iter(zip(longitudes, latitudes, heights))
+        for v in valid:
+            if v is None:
+                results.append((None, None, None))
+            else:
+                longitude, latitude, height = next(coordinates)
+                results.append((float(longitude), float(latitude), None if np.isnan(height) else float(height)))
+
+        return results
+
+
+def open_locator(height_file=rasters.HEIGHT_RASTER):
+    """ Return a locator reading heights from a height raster, or None if the
+        raster is not available. """
+
+    if not os.path.isfile(height_file):
+        return None
+
+    return AvalancheLocator(RasterReader(height_file))
+
+
+def locate_past_avalanches(all_avalanches=False):
+    """ Store the coordinates and heights of past avalanches without them, or of
+        all if all_avalanches. Return a tuple (result, message). """
+
+    locator = open_locator()
+    if locator is None:
+        return False, "Height raster " + rasters.HEIGHT_RASTER + " not found."
+
+    avalanche_dbm = db_manager.CrawlerDB(utils.get_project_full_path() + utils.read_config('dbFile'))
+    if not avalanche_dbm.migrate_past_avalanches():
+        return False, "No past avalanches table found."
+
+    if all_avalanches:
+        avalanches = avalanche_dbm.select_all_past_avalanches()
+    else:
+        avalanches = avalanche_dbm.select_unlocated_past_avalanches()
+
+    locations = locator.locate_avalanches([(avalanche[2], avalanche[3]) for avalanche in avalanches])
+    avalanche_dbm.update_past_avalanche_locations([(avalanche[0],) + location for avalanche, location in zip(avalanches, locations)])
+
+    return True, "Located " + str(len(avalanches)) + " past avalanches."
+
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 2) or ((len(sys.argv) == 2) and (sys.argv[1] != "--all")):
+        sys.exit("Usage: python -m GeoData.avalanche_locations [--all]")
+
+    located, message = locate_past_avalanches(len(sys.argv) == 2)
+    print(message)
+    sys.exit(0 if located else 1)
@@ -0,0 +1,223 @@
+###############################################################
+# Block pipeline for offline whole-raster computations. Output
+# rasters are computed from input rasters of the same size in
+# blocks, each read with a halo of points around it, by a pool
+# of processes, and written to tiled GeoTIFFs as the blocks
+# complete. A checksum of the inputs of each block, halo
+# included, is kept beside the outputs, so that later runs can
+# recompute only blocks whose inputs changed and patch them
+# into the outputs in place.
+###############################################################
+
+from __future__ import division, print_function
+
+import os
+import json
+import hashlib
+import multiprocessing
+import numpy as np
+from osgeo import gdal, osr
+
+from GeoData import raster_reader
+
+BLOCK_SIZE = raster_reader.ITERATION_BLOCK_SIZE
+CHECKSUMS_SUFFIX = ".blocks.json" # Block checksums are kept in the first output file name with this appended.
+OUTPUT_OPTIONS = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=DEFLATE", "PREDICTOR=3", "BIGTIFF=IF_SAFER"]
+CHECK_GEO_TRANSFORM = (-5.2, 0.0001, 0, 56.95, 0, -0.0001) # Where the checks of the computations write their inputs.
+
+# State of each worker process, set by initialise_worker.
+_worker_readers = None
+_worker_function = None
+_worker_halo = 0
+_worker_keywords = {}
+_worker_window = None # Geotransform and no data value of the first input, if blocks are located.
+
+
+def initialise_worker(input_files, block_function, halo, with_window, keywords):
+    """ Open the input rasters in a worker process of the block pipeline. """
+
+    global _worker_readers, _worker_function, _worker_halo, _worker_window, _worker_keywords
+    _worker_readers = [raster_reader.RasterReader(f) for f in input_files]
+    _worker_function = block_function
+    _worker_halo = halo
+    _worker_keywords = keywords
+    _worker_window = (gdal.Open(input_files[0]).GetGeoTransform(), _worker_readers[0].get_no_data_value()) if with_window else None
+
+
+def compute_block(block):
+    """ Compute the outputs of a block (index_x, index_y, size_x, size_y, checksum)
+        in a worker process. Return a tuple (index_x, index_y, checksum, outputs)
+        with the checksum of the inputs read for the block, and None as the outputs
+        if the checksum equals that given, as the block has not changed. """
+
+    index_x, index_y, size_x, size_y, previous_checksum = block
+    inputs = [r.read_block(index_x, index_y, size_x, size_y, _worker_halo) for r in _worker_readers]
+
+    checksum = block_checksum(inputs)
+    if checksum == previous_checksum:
+        return index_x, index_y, checksum, None
+
+    if _worker_window is not None:
+        outputs = _worker_function((index_x, index_y) + _worker_window, *inputs, **_worker_keywords)
+    else:
+        outputs = _worker_function(*inputs, **_worker_keywords)
+    if isinstance(outputs, np.ndarray):
+        outputs = [outputs]
+
+    return index_x, index_y, checksum, outputs
+
+
+def block_checksum(inputs):
+    """ Return a checksum of the blocks of each input read for an output block. """
+
+    digest = hashlib.sha1()
+    for values in inputs:
+        digest.update(str(values.dtype).encode("ascii") + str(values.shape).encode("ascii"))
+        digest.update(np.ascontiguousarray(values).tobytes())
+
+    return digest.hexdigest()
+
+
+def load_checksums(output_files, parameters):
+    """ Return a dictionary of the checksums of the blocks of output rasters by
+        "index_x,index_y", or an empty one if an output or the checksums are
+        missing or were computed with different parameters. """
+
+    checksums_file = output_files[0] + CHECKSUMS_SUFFIX
+    if (not all(os.path.isfile(f) for f in output_files)) or (not os.path.isfile(checksums_file)):
+        return {}
+
+    try:
+        with open(checksums_file, "r") as checksums_json:
+            recorded = json.load(checksums_json)
+    except ValueError:
+        return {}
+
+    if recorded.get('parameters') != parameters:
+        return {}
+
+    return recorded['checksums']
+
+
+def save_checksums(output_files, parameters, checksums):
+    """ Write the checksums of the blocks of output rasters beside the first,
+        replacing the previous ones only once the new file is complete. """
+
+    checksums_file = output_files[0] + CHECKSUMS_SUFFIX
+    recorded = {}
+    recorded['parameters'] = parameters
+    recorded['checksums'] = checksums
+    with open(checksums_file + ".tmp", "w") as checksums_json:
+        json.dump(recorded, checksums_json, indent=0, sort_keys=True)
+    if os.path.isfile(checksums_file):
+        os.remove(checksums_file) # Renaming over a file fails on Windows.
+    os.rename(checksums_file + ".tmp", checksums_file)
+
+
+def create_output_raster(output_file, template_file, no_data_value=None):
+    """ Create a tiled single precision GeoTIFF with the size, geotransform and
+        projection of a template raster. """
+
+    template = gdal.Open(template_file)
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(output_file, template.RasterXSize, template.RasterYSize, 1, gdal.GDT_Float32, OUTPUT_OPTIONS)
+    dataset.SetGeoTransform(template.GetGeoTransform())
+    dataset.SetProjection(template.GetProjection())
+    if no_data_value is not None:
+        dataset.GetRasterBand(1).SetNoDataValue(no_data_value)
+
+    return dataset
+
+
+def write_raster(file_name, values, geo_transform=CHECK_GEO_TRANSFORM, epsg=None, no_data_value=None):
+    """ Write an array as a single band single precision GeoTIFF, for the checks
+        and benchmarks of computations on generated inputs. """
+
+    dataset = gdal.GetDriverByName("GTiff").Create(file_name, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform(geo_transform)
+    if epsg is not None:
+        spatial_reference = osr.SpatialReference()
+        spatial_reference.ImportFromEPSG(epsg)
+        dataset.SetProjection(spatial_reference.ExportToWkt())
+
+    band = dataset.GetRasterBand(1)
+    if no_data_value is not None:
+        band.SetNoDataValue(no_data_value)
+    band.WriteArray(values.astype(np.float32))
+    band.FlushCache()
+    dataset = None # Closes the file.
+
+    return True
+
+
+def run_block_pipeline(input_files, output_files, block_function, halo=0, block_size=BLOCK_SIZE, processes=None, incremental=False, no_data_value=None, with_window=False, keywords=None):
+    """ Compute output rasters block by block from input rasters of the same
+        size. block_function is called with a block of each input, extended by
+        halo points on every side, and returns the block of each output without
+        its halo, as one array if there is one output. If with_window, it is
+        called with a tuple (index_x, index_y, geotransform, no data value) first,
+        locating the block in the first input, and keywords are passed to it as
+        keyword arguments. Blocks are computed in a pool of processes, all cores
+        if processes is None or in this process if 1, and written as they
+        complete. If incremental, existing outputs computed with the same
+        parameters are updated in place, recomputing only blocks whose inputs
+        have changed. """
+
+    sizes = set(raster_reader.RasterReader(f).get_size() for f in input_files)
+    if len(sizes) != 1:
+        return False, "Input rasters differ in size: " + str(sorted(sizes)) + "."
+    size_x, size_y = sizes.pop()
+
+    parameters = {}
+    parameters['function'] = block_function.__module__ + "." + block_function.__name__
+    parameters['inputs'] = [os.path.abspath(f) for f in input_files]
+    parameters['outputs'] = [os.path.abspath(f) for f in output_files]
+    parameters['size'] = [size_x, size_y]
+    parameters['block_size'] = block_size
+    parameters['halo'] = halo
+    if keywords:
+        parameters['keywords'] = keywords
+    checksums = load_checksums(output_files, parameters) if incremental else {}
+
+    blocks = []
+    for index_y in range(0, size_y, block_size):
+        for index_x in range(0, size_x, block_size):
+            key = str(index_x) + "," + str(index_y)
+            blocks.append((index_x, index_y, min(block_size, size_x - index_x), min(block_size, size_y - index_y), checksums.get(key)))
+
+    if checksums:
+        outputs = [gdal.Open(f, gdal.GA_Update) for f in output_files]
+    else:
+        if os.path.isfile(output_files[0] + CHECKSUMS_SUFFIX):
+            os.remove(output_files[0] + CHECKSUMS_SUFFIX) # Stale once the outputs are replaced.
+        outputs = [create_output_raster(f, input_files[0], no_data_value) for f in output_files]
+    bands = [o.GetRasterBand(1) for o in outputs]
+
+    pool = None
+    if processes == 1:
+        initialise_worker(input_files, block_function, halo, with_window, keywords or {})
+        results = (compute_block(b) for b in blocks)
+    else:
+        pool = multiprocessing.Pool(processes, initialise_worker, (input_files, block_function, halo, with_window, keywords or {}))
+        results = pool.imap_unordered(compute_block, blocks)
+
+    computed = 0
+    try:
+        for index_x, index_y, checksum, values in results:
+            checksums[str(index_x) + "," + str(index_y)] = checksum
+            if values is not None:
+                for band, output_values in zip(bands, values):
+                    band.WriteArray(output_values.astype(np.float32), index_x, index_y)
+                computed += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    for band in bands:
+        band.FlushCache()
+    bands = None
+    outputs = None # Closes the files.
+    save_checksums(output_files, parameters, checksums)
+
+    return True, "Computed " + str(computed) + " of " + str(len(blocks)) + " blocks of " + ", ".join(output_files) + "."
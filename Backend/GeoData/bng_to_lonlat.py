@@ -8,6 +8,7 @@
 ########################################################################
 
 from math import *
+import numpy as np
 
 def OSGB36toWGS84(E, N):
 
@@ -103,3 +104,91 @@ def OSGB36toWGS84(E, N):
     lon = lon * 180 / pi
 
     return (lon, lat)
+
+
+def OSGB36toWGS84_array(E, N):
+
+    # The same conversion as OSGB36toWGS84 for arrays of eastings and
+    # northings, returning arrays (lon, lat). Each iteration only updates
+    # the elements not yet converged, so that they stop as in the scalar
+    # version and the results match it.
+    E = np.array(E, dtype=float, ndmin=1)
+    N = np.array(N, dtype=float, ndmin=1)
+
+    a, b = 6377563.396, 6356256.909
+    F0 = 0.9996012717
+    lat0 = 49 * pi / 180
+    lon0 = -2 * pi / 180
+    N0, E0 = -100000, 400000
+    e2 = 1 - (b * b) / (a * a)
+    n = (a - b) / (a + b)
+
+    # Meridional arc, iterated until all elements are accurate to 0.01mm
+    lat = np.full(N.shape, lat0)
+    M = np.zeros(N.shape)
+    active = N - N0 - M >= 0.00001
+    while np.any(active):
+        lat_a = (N[active] - N0 - M[active]) / (a * F0) + lat[active]
+        M1 = (1 + n + (5. / 4) * n**2 + (5. / 4) * n**3) * (lat_a - lat0)
+        M2 = (3 * n + 3 * n**2 + (21. / 8) * n**3) * \
+            np.sin(lat_a - lat0) * np.cos(lat_a + lat0)
+        M3 = ((15. / 8) * n**2 + (15. / 8) * n**3) * \
+            np.sin(2 * (lat_a - lat0)) * np.cos(2 * (lat_a + lat0))
+        M4 = (35. / 24) * n**3 * np.sin(3 * (lat_a - lat0)) * np.cos(3 * (lat_a + lat0))
+        lat[active] = lat_a
+        M[active] = b * F0 * (M1 - M2 + M3 - M4)
+        active[active] = N[active] - N0 - M[active] >= 0.00001
+
+    nu = a * F0 / np.sqrt(1 - e2 * np.sin(lat)**2)
+    rho = a * F0 * (1 - e2) * (1 - e2 * np.sin(lat)**2)**(-1.5)
+    eta2 = nu / rho - 1
+
+    tanLat = np.tan(lat)
+    secLat = 1. / np.cos(lat)
+    VII = tanLat / (2 * rho * nu)
+    VIII = tanLat / (24 * rho * nu**3) * \
+        (5 + 3 * tanLat**2 + eta2 - 9 * tanLat**2 * eta2)
+    IX = tanLat / (720 * rho * nu**5) * \
+        (61 + 90 * tanLat**2 + 45 * tanLat**4)
+    X = secLat / nu
+    XI = secLat / (6 * nu**3) * (nu / rho + 2 * tanLat**2)
+    XII = secLat / (120 * nu**5) * (5 + 28 * tanLat**2 + 24 * tanLat**4)
+    XIIA = secLat / (5040 * nu**7) * (61 + 662 * tanLat **
+                                      2 + 1320 * tanLat**4 + 720 * tanLat**6)
+    dE = E - E0
+
+    # Airy 1830 to cartesian coordinates
+    lat_1 = lat - VII * dE**2 + VIII * dE**4 - IX * dE**6
+    lon_1 = lon0 + X * dE - XI * dE**3 + XII * dE**5 - XIIA * dE**7
+    x_1 = (nu / F0) * np.cos(lat_1) * np.cos(lon_1)
+    y_1 = (nu / F0) * np.cos(lat_1) * np.sin(lon_1)
+    z_1 = ((1 - e2) * nu / F0) * np.sin(lat_1)
+
+    # Helmert transform to GRS80
+    s = -20.4894 * 10**-6
+    tx, ty, tz = 446.448, -125.157, + 542.060
+    rxs, rys, rzs = 0.1502,  0.2470,  0.8421
+    rx, ry, rz = rxs * pi / (180 * 3600.), rys * pi / \
+        (180 * 3600.), rzs * pi / (180 * 3600.)
+    x_2 = tx + (1 + s) * x_1 + (-rz) * y_1 + (ry) * z_1
+    y_2 = ty + (rz) * x_1 + (1 + s) * y_1 + (-rx) * z_1
+    z_2 = tz + (-ry) * x_1 + (rx) * y_1 + (1 + s) * z_1
+
+    # Back to spherical polar coordinates, latitude iterated until all
+    # elements converge
+    a_2, b_2 = 6378137.000, 6356752.3141
+    e2_2 = 1 - (b_2 * b_2) / (a_2 * a_2)
+    p = np.sqrt(x_2**2 + y_2**2)
+
+    lat = np.arctan2(z_2, (p * (1 - e2_2)))
+    latold = np.full(lat.shape, 2 * pi)
+    active = np.abs(lat - latold) > 10**-16
+    while np.any(active):
+        latold[active] = lat[active]
+        nu_2 = a_2 / np.sqrt(1 - e2_2 * np.sin(latold[active])**2)
+        lat[active] = np.arctan2(z_2[active] + e2_2 * nu_2 * np.sin(latold[active]), p[active])
+        active[active] = np.abs(lat[active] - latold[active]) > 10**-16
+
+    lon = np.arctan2(y_2, x_2)
+
+    return (lon * 180 / pi, lat * 180 / pi)
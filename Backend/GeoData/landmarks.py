@@ -0,0 +1,143 @@
+from __future__ import division, print_function
+
+import os
+import sys
+import json
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+LANDMARK_COUNT = 8
+LANDMARKS_FILE = os.path.abspath(os.path.join(__file__, os.pardir)) + "/landmarks.json"
+REGION_GRID_SIZE = 400
+
+# Order of the edge layers in edge grids, shared with path_finder.
+NEIGHBOUR_OFFSETS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+
+def edge_graph(edge_grid):
+    """ Convert an edge grid, with layer k holding the cost from each node to its
+        neighbour at NEIGHBOUR_OFFSETS[k] and NaN for edges leaving the grid, into
+        a sparse graph over nodes numbered row by row. """
+
+    layers, rows, columns = edge_grid.shape
+    node_ids = np.arange(rows * columns).reshape(rows, columns)
+
+    sources = []
+    targets = []
+    weights = []
+    for k, (dx, dy) in enumerate(NEIGHBOUR_OFFSETS):
+        valid = ~np.isnan(edge_grid[k])
+        ys, xs = np.nonzero(valid)
+        sources.append(node_ids[ys, xs])
+        targets.append(node_ids[ys + dy, xs + dx])
+        weights.append(edge_grid[k][valid])
+
+    # Zero-weight edges are kept, as csgraph treats explicit zeros as edges.
+    return csr_matrix((np.concatenate(weights), (np.concatenate(sources), np.concatenate(targets))), shape=(rows * columns, rows * columns))
+
+
+def landmark_distances(edge_grid, landmark_nodes):
+    """ Compute the costs from and to each landmark node (x, y) over an edge grid.
+        Return a tuple (from_landmarks, to_landmarks) of arrays shaped (landmarks,
+        rows, columns). """
+
+    layers, rows, columns = edge_grid.shape
+    graph = edge_graph(edge_grid)
+    indices = [y * columns + x for (x, y) in landmark_nodes]
+
+    from_landmarks = dijkstra(graph, directed=True, indices=indices)
+    to_landmarks = dijkstra(graph.T.tocsr(), directed=True, indices=indices)
+
+    return from_landmarks.reshape(len(indices), rows, columns), to_landmarks.reshape(len(indices), rows, columns)
+
+
+def lower_bounds(from_landmarks, to_landmarks, goal):
+    """ Return an array of lower bounds on the cost from each node to the goal node
+        (x, y), from the triangle inequalities on the landmark costs:
+        d(v, t) >= d(v, L) - d(t, L) and d(v, t) >= d(L, t) - d(L, v). """
+
+    x, y = goal
+    goal_to = to_landmarks[:, y, x].reshape(-1, 1, 1)
+    goal_from = from_landmarks[:, y, x].reshape(-1, 1, 1)
+
+    with np.errstate(invalid='ignore'):
+        bounds = np.maximum(to_landmarks - goal_to, goal_from - from_landmarks)
+    bounds[~np.isfinite(bounds)] = 0
+
+    return np.maximum(np.amax(bounds, axis=0), 0)
+
+
+def select_landmarks(edge_grid, count=LANDMARK_COUNT):
+    """ Select landmark nodes by farthest-point selection: each landmark is the node
+        furthest from all the landmarks before it, starting from the grid centre.
+        Return a list of nodes (x, y). """
+
+    layers, rows, columns = edge_grid.shape
+    graph = edge_graph(edge_grid)
+
+    nearest = dijkstra(graph, directed=True, indices=[(rows // 2) * columns + columns // 2])[0]
+    landmarks = []
+    for n in range(count):
+        node = int(np.argmax(np.where(np.isfinite(nearest), nearest, -1)))
+        landmarks.append((node % columns, node // columns))
+        nearest = np.minimum(nearest, dijkstra(graph, directed=True, indices=[node])[0])
+
+    return landmarks
+
+
+def load_landmarks(landmarks_file=LANDMARKS_FILE):
+    """ Load the landmark coordinates of each region, return an empty dictionary
+        if the landmarks have not been built. """
+
+    if not os.path.isfile(landmarks_file):
+        return {}
+
+    with open(landmarks_file, "r") as region_landmarks:
+        return json.load(region_landmarks)
+
+
+def build_region_landmarks(height_reader, landmarks_file=LANDMARKS_FILE, count=LANDMARK_COUNT):
+    """ Offline step: select landmarks for each SAIS region over a coarse grid of its
+        Naismith distances, and save their coordinates to the landmarks file. """
+
+    import geocoordinate_to_location
+    from GeoData import path_finder
+
+    region_landmarks = {}
+    for region in geocoordinate_to_location.locations:
+        start = geocoordinate_to_location.locations[region]["start"]
+        end = geocoordinate_to_location.locations[region]["end"]
+
+        # Lay a coarse grid over the region, top left corner first.
+        initial = (min(start[0], end[0]), max(start[1], end[1]))
+        final = (max(start[0], end[0]), min(start[1], end[1]))
+        height_grid = height_reader.read_points_resampled(initial[0], initial[1], final[0], final[1], REGION_GRID_SIZE, REGION_GRID_SIZE)
+        if not isinstance(height_grid, np.ndarray):
+            print("Skipping " + region + ", region outside raster.")
+            continue
+
+        cell_long = (final[0] - initial[0]) / REGION_GRID_SIZE
+        cell_lat = (final[1] - initial[1]) / REGION_GRID_SIZE
+        pixel_res_x = abs(cell_long) * path_finder.METRES_PER_DEGREE * np.cos(np.radians((initial[1] + final[1]) / 2))
+        pixel_res_y = abs(cell_lat) * path_finder.METRES_PER_DEGREE
+
+        edge_grid = path_finder.build_naismith_grid(height_grid.astype(np.float64), pixel_res_x, pixel_res_y)
+        landmarks = select_landmarks(edge_grid, count)
+        region_landmarks[region] = [(initial[0] + (x + 0.5) * cell_long, initial[1] + (y + 0.5) * cell_lat) for (x, y) in landmarks]
+        print(region + ": " + str(region_landmarks[region]))
+
+    with open(landmarks_file, "w") as output_file:
+        json.dump(region_landmarks, output_file, indent=2)
+
+    return region_landmarks
+
+
+if __name__ == '__main__':
+    from GeoData import rasters
+    from GeoData.raster_reader import RasterReader
+
+    if len(sys.argv) == 2:
+        build_region_landmarks(RasterReader(rasters.HEIGHT_RASTER), sys.argv[1])
+    else:
+        build_region_landmarks(RasterReader(rasters.HEIGHT_RASTER))
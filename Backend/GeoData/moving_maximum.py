@@ -0,0 +1,184 @@
+###############################################################
+# Moving maximum rasters, holding at each point the maximum of
+# a raster within a square of a radius in points around it, so
+# that "is the highest static risk within this distance above
+# a threshold" is answered with one point read instead of a
+# window read. Rasters are computed for all radii in one pass
+# through block_pipeline, with a halo of the largest radius and
+# a separable maximum filter, each radius growing on the last.
+# Points without data are left out of the maxima. Run from the
+# Backend directory:
+#   python -m GeoData.moving_maximum [raster_file] [radius ...]
+#   python -m GeoData.moving_maximum --check
+###############################################################
+
+from __future__ import division, print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+from osgeo import gdal
+
+from GeoData import block_pipeline, rasters
+from GeoData.raster_reader import RasterReader
+
+MAXIMUM_RADII = [5, 10, 25, 50, 100] # Points, the search distances of the model evaluation.
+NO_DATA_VALUE = -9999
+MAXIMUM_BLOCK_SIZE = 2048 # Larger blocks than usual, as halos are as wide as the largest radius.
+
+CHECK_SIZE = (230, 170) # Points (x, y) of the synthetic raster, not multiples of the block size.
+CHECK_RADII = [1, 3, 10, 40]
+CHECK_BLOCK_SIZE = 48
+CHECK_PROCESSES = 2
+CHECK_POINTS = 500
+CHECK_SEED = 0
+
+
+def maximum_file(raster_file, radius):
+    """ Return the file name of the moving maximum raster of a raster at a radius. """
+
+    return os.path.splitext(raster_file)[0] + "Max" + str(radius) + ".tif"
+
+
+def moving_maximum_block(window, values, radii):
+    """ Return the moving maxima of the points of a block of values with a halo
+        of the largest radius, at each of the radii in ascending order. The square
+        of one radius is that of the last grown by the difference between them. """
+
+    index_x, index_y, geotransform, no_data_value = window
+    halo = radii[-1]
+
+    values = values.astype(np.float64)
+    missing = np.isnan(values)
+    if no_data_value is not None:
+        missing |= (values == no_data_value)
+    values[missing] = -np.inf
+
+    outputs = []
+    previous_radius = 0
+    for radius in radii:
+        size = 2 * (radius - previous_radius) + 1
+        values = maximum_filter1d(maximum_filter1d(values, size, axis=0, mode='nearest'), size, axis=1, mode='nearest')
+        maxima = values[halo:values.shape[0] - halo, halo:values.shape[1] - halo].copy()
+        maxima[np.isinf(maxima)] = NO_DATA_VALUE
+        outputs.append(maxima)
+        previous_radius = radius
+
+    return outputs
+
+
+def compute_moving_maxima(raster_file=rasters.RISK_RASTER, radii=MAXIMUM_RADII, block_size=MAXIMUM_BLOCK_SIZE, processes=None, incremental=True):
+    """ Compute the moving maximum rasters of a raster at each radius in points,
+        recomputing only blocks whose values changed since the last run if incremental. """
+
+    radii = sorted(set(radii))
+    output_files = [maximum_file(raster_file, r) for r in radii]
+
+    return block_pipeline.run_block_pipeline([raster_file], output_files, moving_maximum_block, radii[-1], block_size, processes, incremental, NO_DATA_VALUE, True, {'radii': radii})
+
+
+class MaximumReader:
+    """ Reads the maxima of a raster within radii of points from its moving
+        maximum rasters, one point read each. """
+
+    def __init__(self, raster_file=rasters.RISK_RASTER, radii=MAXIMUM_RADII):
+
+        self._readers = {}
+        for radius in radii:
+            self._readers[radius] = RasterReader(maximum_file(raster_file, radius))
+
+
+    def get_radii(self):
+        """ Return the radii available, in points. """
+
+        return sorted(self._readers)
+
+
+    def read_maximum(self, coord_x, coord_y, radius):
+        """ Return the maximum within radius points of WGS84 coordinates, or False
+            if the radius is not available, the coordinates are outside the raster,
+            or there is no data within the radius. """
+
+        if radius not in self._readers:
+            return False
+
+        maximum = self._readers[radius].read_point(coord_x, coord_y)
+        if (maximum is False) or (maximum == NO_DATA_VALUE):
+            return False
+
+        return maximum
+
+
+    def read_maxima_at(self, coords_x, coords_y, radius):
+        """ Return an array of the maxima within radius points of arrays of WGS84
+            coordinates, NaN where outside the raster or without data within the
+            radius, or False if the radius is not available. """
+
+        if radius not in self._readers:
+            return False
+
+        return self._readers[radius].read_points_at(coords_x, coords_y)
+
+
+def check_moving_maxima():
+    """ Compute moving maxima of a random raster with points without data through
+        the block pipeline, and compare them and point queries through
+        MaximumReader with maxima of windows clipped to the raster. Return a
+        tuple (passed, message). """
+
+    generator = np.random.RandomState(CHECK_SEED)
+    values = generator.rand(CHECK_SIZE[1], CHECK_SIZE[0]).astype(np.float32)
+    values[50:60, 70:120] = NO_DATA_VALUE
+    values[100:102, 10:12] = np.nan
+    missing = np.isnan(values) | (values == NO_DATA_VALUE)
+
+    directory = tempfile.mkdtemp()
+    try:
+        raster_file = os.path.join(directory, "values.tif")
+        block_pipeline.write_raster(raster_file, values, no_data_value=NO_DATA_VALUE)
+        computed, message = compute_moving_maxima(raster_file, CHECK_RADII, CHECK_BLOCK_SIZE, CHECK_PROCESSES, False)
+        if not computed:
+            return False, message
+        outputs = [gdal.Open(maximum_file(raster_file, r)).ReadAsArray() for r in CHECK_RADII]
+
+        reader = MaximumReader(raster_file, CHECK_RADII)
+        points_x = generator.randint(0, CHECK_SIZE[0], CHECK_POINTS)
+        points_y = generator.randint(0, CHECK_SIZE[1], CHECK_POINTS)
+        coords_x, coords_y = RasterReader(raster_file).indices_to_coordinates(points_x, points_y)
+        queried = [reader.read_maxima_at(coords_x, coords_y, r) for r in CHECK_RADII]
+    finally:
+        shutil.rmtree(directory)
+
+    valid_values = np.where(missing, -np.inf, values)
+    for radius, maxima, queried_maxima in zip(CHECK_RADII, outputs, queried):
+        expected = np.empty(values.shape)
+        for y in range(CHECK_SIZE[1]):
+            for x in range(CHECK_SIZE[0]):
+                expected[y, x] = np.amax(valid_values[max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1])
+        expected[np.isinf(expected)] = NO_DATA_VALUE
+        if not np.array_equal(maxima, expected.astype(np.float32)):
+            return False, "Moving maxima at radius " + str(radius) + " differ from window maxima."
+
+        expected_queried = expected[points_y, points_x]
+        expected_queried[expected_queried == NO_DATA_VALUE] = np.nan
+        queried_missing = np.isnan(queried_maxima)
+        if (not np.array_equal(queried_missing, np.isnan(expected_queried))) or (not np.array_equal(queried_maxima[~queried_missing], expected_queried[~queried_missing])):
+            return False, "Queried maxima at radius " + str(radius) + " differ from window maxima."
+
+    return True, "Moving maxima and queries match window maxima at radii " + str(CHECK_RADII) + "."
+
+
+if __name__ == '__main__':
+    if (len(sys.argv) == 2) and (sys.argv[1] == "--check"):
+        passed, message = check_moving_maxima()
+        print(message)
+        sys.exit(0 if passed else 1)
+
+    raster_file = sys.argv[1] if len(sys.argv) > 1 else rasters.RISK_RASTER
+    radii = [int(r) for r in sys.argv[2:]] if len(sys.argv) > 2 else MAXIMUM_RADII
+    computed, message = compute_moving_maxima(raster_file, radii)
+    print(message)
+    sys.exit(0 if computed else 1)
@@ -1,14 +1,20 @@
 from __future__ import division, print_function
-from GeoData import rasters
+from GeoData import rasters, landmarks
 from GeoData.raster_reader import RasterReader
 from SAISCrawler.script import db_manager, utils
 import geocoordinate_to_location
 import utils as base_utils
 
+import os
+import sys
 import heapq
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
 import numpy as np
 from sys import maxsize
-from math import sqrt, floor
+from math import sqrt, floor, cos, radians
 from time import time
 from datetime import datetime
 from skimage.measure import block_reduce
@@ -20,6 +26,142 @@ MAX_BEFORE_DOWNSAMPLING = 100000
 DOWNSAMPLING_TARGET = 50
 MINIMUM_SEARCH_LONG = 0.008
 MINIMUM_SEARCH_LAT = 0.007
+NAISMITH_SPEED = 5000 # Metres per hour on flat ground, by Naismith's rule.
+METRES_PER_DEGREE = 111320
+MAX_REACHABLE_HOURS = 3
+REACHABLE_DOWNSAMPLING_TARGET = 150
+ANYTIME_INFLATIONS = [3.0, 2.0, 1.5, 1.25, 1.0]
+DEADLINE_CHECK_INTERVAL = 256
+HEURISTICS = ['diagonal', 'alt']
+MAX_TRAILHEADS = 10
+LAZY_BLOCK_SIZE = 64
+LAZY_MAX_EXPANSIONS = 100000
+LAZY_NAISMITH_MIN = PIXEL_RES # Flat straight edge.
+LAZY_NAISMITH_MAX = PIXEL_RES_DIAG * (1 + NAISMITH_CONSTANT) # 45 degree diagonal climb.
+LAZY_RISK_MAX = rasters.RISK_RASTER_MAX * 5 # Static risk of the 99 percentile at the highest risk code.
+LAZY_RISK_FLOOR = 0.01
+LANDMARK_CACHE_SIZE = 32 # Raster windows whose landmark distances are kept.
+NEIGHBOUR_OFFSETS = landmarks.NEIGHBOUR_OFFSETS
+CHECK_TERRAIN = 'bowls' # Synthetic terrain of path_finder_benchmark searched by the check.
+CHECK_SIZE = 500
+CHECK_REPEATS = 2 # Concurrent searches of each serial one in the check.
+
+def build_naismith_grid(height_values, pixel_res_x, pixel_res_y):
+    """ Build the Naismith distance of every edge in a grid of heights at once. Layer k
+        of the returned edge grid holds, for each node, the distance to its neighbour at
+        NEIGHBOUR_OFFSETS[k], arranged as:
+        0 1 2
+        3 * 4
+        5 6 7
+        Edges leaving the grid are marked NaN. """
+
+    y_max = len(height_values) - 1
+    x_max = len(height_values[0]) - 1
+    pixel_res_d = sqrt(pixel_res_x ** 2 + pixel_res_y ** 2)
+    padded_heights = np.pad(height_values, 1, mode='edge')
+    naismith_grid = np.empty((len(NEIGHBOUR_OFFSETS),) + height_values.shape)
+
+    for k, (dx, dy) in enumerate(NEIGHBOUR_OFFSETS):
+        if dy == 0:
+            edge_length = pixel_res_x
+        elif dx == 0:
+            edge_length = pixel_res_y
+        else:
+            edge_length = pixel_res_d
+
+        neighbour_heights = padded_heights[1 + dy:1 + dy + y_max + 1, 1 + dx:1 + dx + x_max + 1]
+        naismith_grid[k] = edge_length + NAISMITH_CONSTANT * np.maximum(0, neighbour_heights - height_values)
+
+        if dy < 0:
+            naismith_grid[k, 0, :] = np.nan
+        elif dy > 0:
+            naismith_grid[k, y_max, :] = np.nan
+        if dx < 0:
+            naismith_grid[k, :, 0] = np.nan
+        elif dx > 0:
+            naismith_grid[k, :, x_max] = np.nan
+
+    return naismith_grid
+
+
+class SearchContext:
+    """ State of a single search, so that concurrent searches
+        sharing one PathFinder do not interfere. """
+
+    def __init__(self):
+
+        self.__priority_queue = []
+
+
+    def add_to_queue(self, priority, coordinates):
+        """ Push a coordinate and its priority onto the priority queue. """
+
+        heapq.heappush(self.__priority_queue, (priority, coordinates))
+
+        return True
+
+
+    def pop_from_queue(self):
+        """ Pop the highest priority item from the priority queue, return a tuple
+            (priority, coordinates) if heap is not empty, False otherwise."""
+
+        if len(self.__priority_queue) <= 0:
+            return False
+
+        return heapq.heappop(self.__priority_queue)
+
+
+    def is_queue_empty(self):
+        """ Returns True if the priority queue is empty, False otherwise. """
+
+        if len(self.__priority_queue) <= 0:
+            return True
+        else:
+            return False
+
+
+class LazyGrid:
+    """ Search grid over the full resolution rasters, reading data in
+        blocks only when a search first reaches them. Risks are scaled
+        by fixed bounds rather than by the extremes of the grid, which
+        are not known in advance. """
+
+    def __init__(self, height_map_reader, aspect_map_reader, static_risk_reader, forecasts):
+
+        self._height_map_reader = height_map_reader
+        self._aspect_map_reader = aspect_map_reader
+        self._static_risk_reader = static_risk_reader
+        self._forecasts = forecasts
+        self.size = height_map_reader.get_size()
+        self.blocks = {}
+
+
+    def values(self, x, y):
+        """ Return a tuple (height, scaled risk) of a node, reading its block if needed. """
+
+        block_index = (x // LAZY_BLOCK_SIZE, y // LAZY_BLOCK_SIZE)
+        if block_index not in self.blocks:
+            self.read_block(block_index)
+        heights, risks = self.blocks[block_index]
+
+        return heights[y % LAZY_BLOCK_SIZE][x % LAZY_BLOCK_SIZE], risks[y % LAZY_BLOCK_SIZE][x % LAZY_BLOCK_SIZE]
+
+
+    def read_block(self, block_index):
+        """ Read a block of heights, and of static risks matched to dynamic risks. """
+
+        index_x = block_index[0] * LAZY_BLOCK_SIZE
+        index_y = block_index[1] * LAZY_BLOCK_SIZE
+        height_block = self._height_map_reader.read_window(index_x, index_y, LAZY_BLOCK_SIZE, LAZY_BLOCK_SIZE)
+        aspect_block = self._aspect_map_reader.read_window(index_x, index_y, LAZY_BLOCK_SIZE, LAZY_BLOCK_SIZE)
+        risk_block = self._static_risk_reader.read_window(index_x, index_y, LAZY_BLOCK_SIZE, LAZY_BLOCK_SIZE)
+
+        risk_block = risk_block * base_utils.match_aspects_altitudes_to_forecast(self._forecasts, aspect_block, height_block)
+        risk_block = np.clip(risk_block / LAZY_RISK_MAX, LAZY_RISK_FLOOR, 1)
+        self.blocks[block_index] = (height_block.astype(np.float64).tolist(), risk_block.tolist())
+
+        return True
+
 
 class PathFinder:
     """ Class for pathfinding based on Naismith's distance,
@@ -32,11 +174,52 @@ class PathFinder:
         self._aspect_map_reader = aspect_map_reader
         self._static_risk_reader = static_risk_reader
         self._dynamic_risk_cursor = dynamic_risk_cursor
-        self.__priority_queue = []
+        self._landmarks = landmarks.load_landmarks()
+        self._landmark_distances = OrderedDict()
+        self._landmark_lock = threading.Lock()
 
+        # The database cursor is shared, so forecast lookups are serialised.
+        self._forecast_lock = threading.Lock()
 
-    def find_path(self, longitude_initial, latitude_initial, longitude_final, latitude_final, risk_weighing, custom_date=None):
-        """ Given initial and final coordinates and a risk-to-distance weighing, find a path. """
+
+    def find_path(self, longitude_initial, latitude_initial, longitude_final, latitude_final, risk_weighing, custom_date=None, heuristic='diagonal', stats=None):
+        """ Given initial and final coordinates and a risk-to-distance weighing, find a path.
+            The heuristic is one of HEURISTICS, and search statistics, with the cost and Naismith
+            distance of the path found, are added to the stats dictionary if given. """
+
+        # Time the execution.
+        start_time = time()
+
+        # Sanity checks.
+        if not self.check_weighing(risk_weighing):
+            return False, "Invalid risk weighing."
+
+        if heuristic not in HEURISTICS:
+            return False, "Invalid heuristic."
+
+        grid, message = self.build_grid(longitude_initial, latitude_initial, longitude_final, latitude_final, custom_date)
+        if not grid:
+            return False, message
+
+        path, cost, completed = self.search(grid, risk_weighing, heuristic=heuristic, stats=stats)
+        if (stats is not None) and (path is not None):
+            stats['cost'] = cost
+            stats['distance'] = self.path_totals(grid, path)[0]
+        return_path = self.path_to_coordinates(grid, path)
+
+        self.debug_print("Finished in " + str(time() - start_time) + " seconds.")
+
+        return return_path, "Success."
+
+
+    def find_path_lazy(self, longitude_initial, latitude_initial, longitude_final, latitude_final, risk_weighing, custom_date=None, stats=None):
+        """ Find a path like find_path but at the full raster resolution, computing edge costs
+            only when a node is expanded, and reading raster data in blocks as the search reaches
+            them. Time and memory therefore scale with the area explored rather than the bounding
+            box, but the search gives up after LAZY_MAX_EXPANSIONS expansions. The rasters are
+            read by the indices of the height raster, so all must share its grid. Search statistics,
+            and the cost and Naismith distance of the path found, are added to the stats dictionary
+            if given. """
 
         # Time the execution.
         start_time = time()
@@ -45,36 +228,352 @@ class PathFinder:
         if not all(isinstance(item, float) for item in [longitude_initial, latitude_initial, longitude_final, latitude_final]):
             return False, "Input not float."
 
-        valid_ratio = False
-        if isinstance(risk_weighing, float):
-            if risk_weighing >= 0 and risk_weighing <= 1:
-                valid_ratio = True
+        if not self.check_weighing(risk_weighing):
+            return False, "Invalid risk weighing."
+
+        if not (self._height_map_reader.check_access_window(longitude_initial, latitude_initial) and self._height_map_reader.check_access_window(longitude_final, latitude_final)):
+            return False, "Input out of range."
+
+        if not (self._height_map_reader.shares_grid(self._aspect_map_reader) and self._height_map_reader.shares_grid(self._static_risk_reader)):
+            return False, "Rasters do not share a grid."
+
+        location_forecast_list, location_name, message = self.lookup_forecasts(longitude_initial, latitude_initial, custom_date)
+        if location_forecast_list is False:
+            return False, message
+
+        grid = LazyGrid(self._height_map_reader, self._aspect_map_reader, self._static_risk_reader, location_forecast_list)
+        x_max, y_max = grid.size[0] - 1, grid.size[1] - 1
+        initial_node = self._height_map_reader.coordinate_to_index(longitude_initial, latitude_initial)
+        goal_node = self._height_map_reader.coordinate_to_index(longitude_final, latitude_final)
+        initial_node = (min(initial_node[0], x_max), min(initial_node[1], y_max))
+        goal_node = (min(goal_node[0], x_max), min(goal_node[1], y_max))
+        goal_height = grid.values(goal_node[0], goal_node[1])[0]
+
+        self.debug_print("Starting lazy A* Search...")
+
+        # A* Search, with the edge costs of a node computed as it is expanded.
+        context = SearchContext()
+        context.add_to_queue(0, initial_node)
+        source_index = {}
+        cost_index = {}
+        source_index[initial_node] = None
+        cost_index[initial_node] = 0
+        expansions = 0
+
+        while not context.is_queue_empty():
+            current = context.pop_from_queue()
+            current_node = current[1]
+
+            if current_node == goal_node:
+                break
+
+            expansions += 1
+            if expansions > LAZY_MAX_EXPANSIONS:
+                self.record_expansions(stats, expansions)
+                self.debug_print("Lazy search exceeded " + str(LAZY_MAX_EXPANSIONS) + " expansions, exiting...")
+                return False, "Search too large."
+
+            x, y = current_node
+            height = grid.values(x, y)[0]
+            for (dx, dy) in NEIGHBOUR_OFFSETS:
+                i = x + dx
+                j = y + dy
+                if not ((0 <= i <= x_max) and (0 <= j <= y_max)):
+                    continue
+
+                neighbour_node = (i, j)
+                neighbour_height, neighbour_risk = grid.values(i, j)
+                if (dx == 0) or (dy == 0):
+                    naismith_distance = PIXEL_RES + NAISMITH_CONSTANT * max(0, neighbour_height - height)
+                else:
+                    naismith_distance = PIXEL_RES_DIAG + NAISMITH_CONSTANT * max(0, neighbour_height - height)
+
+                scaled_naismith = (naismith_distance - LAZY_NAISMITH_MIN) / (LAZY_NAISMITH_MAX - LAZY_NAISMITH_MIN)
+                node_risk = neighbour_risk * risk_weighing
+                new_cost = cost_index[current_node] + scaled_naismith * (1 - risk_weighing) + node_risk
+                if (neighbour_node not in cost_index) or (new_cost < cost_index[neighbour_node]):
+                    cost_index[neighbour_node] = new_cost
+                    prio = new_cost + self.heuristic(neighbour_node, goal_node, neighbour_height, goal_height, LAZY_NAISMITH_MAX, LAZY_NAISMITH_MIN, PIXEL_RES, PIXEL_RES, PIXEL_RES_DIAG, node_risk)
+                    context.add_to_queue(prio, neighbour_node)
+                    source_index[neighbour_node] = current_node
+
+        self.record_expansions(stats, expansions)
+        if stats is not None:
+            stats['blocks'] = stats.get('blocks', 0) + len(grid.blocks)
+
+        if goal_node not in source_index:
+            return False, "No path found."
+
+        self.debug_print("Search completed after reading " + str(len(grid.blocks)) + " blocks, rebuilding path...")
+
+        # Reconstruct the path by back-tracing.
+        path = []
+        current_node = goal_node
+        while source_index[current_node] is not None:
+            path = [current_node] + path
+            current_node = source_index[current_node]
+        path = [current_node] + path
+
+        if stats is not None:
+            stats['cost'] = cost_index[goal_node]
+            stats['distance'] = self.lazy_path_distance(grid, path)
+
+        # Convert indices back into coordinates with height attached.
+        return_path = {}
+        longitudes, latitudes = self._height_map_reader.indices_to_coordinates([node[0] for node in path], [node[1] for node in path])
+        for p, (longitude, latitude) in enumerate(zip(longitudes.tolist(), latitudes.tolist())):
+            way_point = {}
+            way_point['long'] = str(longitude)
+            way_point['lat'] = str(latitude)
+            node_height, node_risk = grid.values(path[p][0], path[p][1])
+            way_point['height'] = str(node_height)
+            way_point['risk'] = str(node_risk)
+            return_path[p] = way_point
+
+        self.debug_print("Finished in " + str(time() - start_time) + " seconds.")
+
+        return return_path, "Success."
+
+
+    @staticmethod
+    def lazy_path_distance(grid, path):
+        """ Return the Naismith distance in metres of a path of raster indices over a LazyGrid. """
+
+        total_distance = 0.0
+        for p in range(1, len(path)):
+            x, y = path[p - 1]
+            i, j = path[p]
+            climb = NAISMITH_CONSTANT * max(0, float(grid.values(i, j)[0]) - float(grid.values(x, y)[0]))
+            total_distance += (PIXEL_RES if (i == x) or (j == y) else PIXEL_RES_DIAG) + climb
+
+        return total_distance
+
+
+    def find_path_anytime(self, longitude_initial, latitude_initial, longitude_final, latitude_final, risk_weighing, deadline, custom_date=None, heuristic='alt'):
+        """ Find a path within a deadline in milliseconds, by weighted A* searches with
+            decreasing heuristic inflation, each only looking for paths cheaper than the
+            best found so far. Return a tuple (result, message), with result being a
+            dictionary of the best path found and its suboptimality bound, which is the
+            inflation of the last completed search. The bound only holds for the admissible
+            'alt' heuristic: the 'diagonal' heuristic can overestimate, so its paths have
+            no bound (None) and pruning may miss cheaper ones. The first search always runs
+            to completion, so that a path is always returned. """
 
-        if not valid_ratio:
+        # Time the execution.
+        start_time = time()
+
+        # Sanity checks.
+        if not self.check_weighing(risk_weighing):
             return False, "Invalid risk weighing."
 
-        self.debug_print("Sanity check completed.")
+        if (not isinstance(deadline, (int, float))) or (deadline <= 0):
+            return False, "Invalid deadline."
+
+        if heuristic not in HEURISTICS:
+            return False, "Invalid heuristic."
+        deadline_time = start_time + deadline / 1000
+
+        grid, message = self.build_grid(longitude_initial, latitude_initial, longitude_final, latitude_final, custom_date)
+        if not grid:
+            return False, message
+
+        best_path = None
+        best_cost = None
+        bound = None
+
+        for inflation in ANYTIME_INFLATIONS:
+            if best_path is None:
+                path, cost, completed = self.search(grid, risk_weighing, inflation, heuristic=heuristic)
+            else:
+                path, cost, completed = self.search(grid, risk_weighing, inflation, deadline_time, best_cost, heuristic)
+
+            if not completed:
+                break
+
+            if path is None:
+                # No path cheaper than the best one exists.
+                bound = 1.0
+                break
+
+            best_path = path
+            best_cost = cost
+            bound = inflation
+
+            if time() > deadline_time:
+                break
+
+        if heuristic != 'alt':
+            bound = None
+
+        if best_path is None:
+            return False, "No path found."
+
+        result = {}
+        result['path'] = self.path_to_coordinates(grid, best_path)
+        result['bound'] = bound
+
+        self.debug_print("Best path bound " + str(bound) + ", finished in " + str(time() - start_time) + " seconds.")
+
+        return result, "Success."
 
-        # Process custom date and dynamic risk.
-        location_name = geocoordinate_to_location.get_location_name(longitude_initial, latitude_initial)
-        location_ids = self._dynamic_risk_cursor.select_location_by_name(location_name)
-        if not location_ids:
-            return False, "Invalid location ID."
-        location_id = int(location_ids[0][0])
-        location_forecasts = self._dynamic_risk_cursor.lookup_newest_forecasts_by_location_id(location_id)
-
-        if custom_date is not None:
-            try:
-                datetime.strptime(custom_date, '%Y-%m-%d')
-                forecasts_of_date = self._dynamic_risk_cursor.lookup_forecasts_by_location_id_and_date(location_id, custom_date)
-                if len(forecasts_of_date) > 0: # Just in case the custom date given is invalid, which happens.
-                    location_forecasts = forecasts_of_date
-            except ValueError:
-                return False, "Invalid custom date."
+
+    def find_paths(self, longitude_initial, latitude_initial, longitude_final, latitude_final, risk_weighings, custom_date=None, heuristic='diagonal'):
+        """ Find paths for a list of risk-to-distance weighings from a single grid load. Weighings
+            resulting in an identical path share one route, and each route is annotated with its
+            total Naismith distance and accumulated risk. """
+
+        # Time the execution.
+        start_time = time()
+
+        # Sanity checks.
+        if (len(risk_weighings) <= 0) or (not all(self.check_weighing(w) for w in risk_weighings)):
+            return False, "Invalid risk weighing."
+
+        if heuristic not in HEURISTICS:
+            return False, "Invalid heuristic."
+
+        grid, message = self.build_grid(longitude_initial, latitude_initial, longitude_final, latitude_final, custom_date)
+        if not grid:
+            return False, message
+
+        routes = []
+        found_paths = {}
+        for risk_weighing in risk_weighings:
+            path, cost, completed = self.search(grid, risk_weighing, heuristic=heuristic)
+            path_key = tuple(path)
+
+            # Deduplicate identical routes across weighings.
+            if path_key in found_paths:
+                found_paths[path_key]['risk_weighings'].append(risk_weighing)
+                continue
+
+            route = {}
+            route['risk_weighings'] = [risk_weighing]
+            route['naismith_distance'], route['risk'] = self.path_totals(grid, path)
+            route['path'] = self.path_to_coordinates(grid, path)
+            found_paths[path_key] = route
+            routes.append(route)
+
+        self.debug_print(str(len(routes)) + " distinct routes for " + str(len(risk_weighings)) + " weighings.")
+        self.debug_print("Finished in " + str(time() - start_time) + " seconds.")
+
+        return routes, "Success."
+
+
+    def find_paths_to_goal(self, starts, longitude_final, latitude_final, risk_weighing, custom_date=None):
+        """ Find the best path from each of a list of start coordinates (longitude, latitude)
+            to a single goal, by one reverse Dijkstra search from the goal over a grid shared
+            by all starts. Return a tuple (routes, message), with routes being a list in the
+            order of starts, each route holding its start, search cost, Naismith distance,
+            accumulated risk and path, or None if the start cannot reach the goal. """
+
+        # Time the execution.
+        start_time = time()
+
+        # Sanity checks.
+        if not self.check_weighing(risk_weighing):
+            return False, "Invalid risk weighing."
+
+        if (len(starts) <= 0) or (len(starts) > MAX_TRAILHEADS):
+            return False, "Invalid number of starts."
+
+        # Bound the grid by all starts and the goal, with forecasts of the goal location.
+        longitudes = [start[0] for start in starts] + [longitude_final]
+        latitudes = [start[1] for start in starts] + [latitude_final]
+        grid, message = self.build_grid(min(longitudes), max(latitudes), max(longitudes), min(latitudes), custom_date, location=(longitude_final, latitude_final))
+        if not grid:
+            return False, message
+
+        longitude_initial, latitude_initial, longitude_bound, latitude_bound = grid['bounds']
+        downsample_x_factor, downsample_y_factor = grid['downsample']
+        x_max, y_max = grid['size']
+
+        nodes = []
+        for (longitude, latitude) in starts + [(longitude_final, latitude_final)]:
+            node = self._height_map_reader.locate_index((longitude_initial, latitude_initial), (longitude_bound, latitude_bound), (longitude, latitude))
+            if not node:
+                return False, "Invalid coordinates."
+            nodes.append((min(node[0] // downsample_x_factor, x_max), min(node[1] // downsample_y_factor, y_max)))
+        start_nodes = nodes[:-1]
+        goal_node = nodes[-1]
+
+        costs, next_nodes = self.reverse_expand(grid, goal_node, risk_weighing, set(start_nodes))
+
+        routes = []
+        for n in range(len(starts)):
+            route = {}
+            route['start'] = list(starts[n])
+            if start_nodes[n] not in costs:
+                route['cost'] = None
+                route['path'] = None
+                routes.append(route)
+                continue
+
+            # Follow the next nodes towards the goal.
+            path = [start_nodes[n]]
+            while path[-1] != goal_node:
+                path.append(next_nodes[path[-1]])
+
+            route['cost'] = costs[start_nodes[n]]
+            route['naismith_distance'], route['risk'] = self.path_totals(grid, path)
+            route['path'] = self.path_to_coordinates(grid, path)
+            routes.append(route)
+
+        self.debug_print(str(len(costs)) + " nodes settled for " + str(len(starts)) + " starts.")
+        self.debug_print("Finished in " + str(time() - start_time) + " seconds.")
+
+        return routes, "Success."
+
+
+    def lookup_forecasts(self, longitude, latitude, custom_date=None):
+        """ Look up the forecasts for the location of a coordinate, of the custom date if
+            available or the most recent ones otherwise. Return a tuple (forecasts, location
+            name, message), with forecasts being False if not found. """
+
+        location_name = geocoordinate_to_location.get_location_name(longitude, latitude)
+        with self._forecast_lock:
+            location_ids = self._dynamic_risk_cursor.select_location_by_name(location_name)
+            if not location_ids:
+                return False, location_name, "Invalid location ID."
+            location_id = int(location_ids[0][0])
+            location_forecasts = self._dynamic_risk_cursor.lookup_newest_forecasts_by_location_id(location_id)
+
+            if custom_date is not None:
+                try:
+                    datetime.strptime(custom_date, '%Y-%m-%d')
+                    forecasts_of_date = self._dynamic_risk_cursor.lookup_forecasts_by_location_id_and_date(location_id, custom_date)
+                    if len(forecasts_of_date) > 0: # Just in case the custom date given is invalid, which happens.
+                        location_forecasts = forecasts_of_date
+                except ValueError:
+                    return False, location_name, "Invalid custom date."
 
         if location_forecasts is None:
-            return False, "No forecast found."
-        location_forecast_list = list(location_forecasts)
+            return False, location_name, "No forecast found."
+
+        return list(location_forecasts), location_name, "Success."
+
+
+    def build_grid(self, longitude_initial, latitude_initial, longitude_final, latitude_final, custom_date=None, location=None, downsampling_target=DOWNSAMPLING_TARGET, resampled=False):
+        """ Read and prepare the search grid between the initial and final coordinates, with
+            dynamic risk matched from the forecasts for location (the initial coordinates if
+            not given). Return a tuple (grid, message), with grid being False if the grid
+            cannot be built. The grid does not depend on the risk weighing, so it can be
+            shared between searches. If resampled, downsampled grids are read decimated
+            from the rasters (or their overviews) rather than read in full and reduced by
+            block maxima, bounding the data read for large areas, and the far edges are
+            trimmed to whole downsampled cells. """
+
+        if not all(isinstance(item, float) for item in [longitude_initial, latitude_initial, longitude_final, latitude_final]):
+            return False, "Input not float."
+
+        self.debug_print("Sanity check completed.")
+
+        # Process custom date and dynamic risk.
+        if location is None:
+            location = (longitude_initial, latitude_initial)
+        location_forecast_list, location_name, message = self.lookup_forecasts(location[0], location[1], custom_date)
+        if location_forecast_list is False:
+            return False, message
 
         original_initial = (longitude_initial, latitude_initial)
         original_final = (longitude_final, latitude_final)
@@ -95,11 +594,23 @@ class PathFinder:
                 self.debug_print("Grid enlarged in y direction.")
 
         # Static properties.
-        height_grid = self._height_map_reader.read_points(longitude_initial, latitude_initial, longitude_final, latitude_final)
+        if resampled:
+            # Only the size of the area is needed before reading it decimated.
+            if not (self._height_map_reader.check_access_window(longitude_initial, latitude_initial) and self._height_map_reader.check_access_window(longitude_final, latitude_final)):
+                return False, "Failure reading grid."
+            window_initial = self._height_map_reader.coordinate_to_index(min(longitude_initial, longitude_final), max(latitude_initial, latitude_final))
+            window_final = self._height_map_reader.coordinate_to_index(max(longitude_initial, longitude_final), min(latitude_initial, latitude_final))
+            x_max = window_final[0] - window_initial[0]
+            y_max = window_final[1] - window_initial[1]
+        else:
+            height_grid = self._height_map_reader.read_points(longitude_initial, latitude_initial, longitude_final, latitude_final)
 
-        # Immediately check how large the data is.
-        x_max = len(height_grid[0]) - 1
-        y_max = len(height_grid) - 1
+            if not isinstance(height_grid, np.ndarray):
+                return False, "Failure reading grid."
+
+            # Immediately check how large the data is.
+            x_max = len(height_grid[0]) - 1
+            y_max = len(height_grid) - 1
 
         # Prepare the pixel resolution, since this will change if downsampling happens.
         pixel_res_x = PIXEL_RES
@@ -111,31 +622,46 @@ class PathFinder:
             self.debug_print("Execution size exceeded, exiting...")
             return False, "Input too large."
 
-        if x_max > DOWNSAMPLING_TARGET:
-            downsample_x_factor = x_max // DOWNSAMPLING_TARGET + 1
+        if x_max > downsampling_target:
+            downsample_x_factor = x_max // downsampling_target + 1
             pixel_res_x = pixel_res_x * downsample_x_factor
         else:
             downsample_x_factor = 1
 
-        if y_max > DOWNSAMPLING_TARGET:
-            downsample_y_factor = y_max // DOWNSAMPLING_TARGET + 1
+        if y_max > downsampling_target:
+            downsample_y_factor = y_max // downsampling_target + 1
             pixel_res_y = pixel_res_y * downsample_y_factor
         else:
             downsample_y_factor = 1
 
         pixel_res_d = sqrt(pixel_res_x ** 2 + pixel_res_y ** 2)
 
-        # More static properties
-        risk_grid = self._static_risk_reader.read_points(longitude_initial, latitude_initial, longitude_final, latitude_final)
-        aspect_grid = self._aspect_map_reader.read_points(longitude_initial, latitude_initial, longitude_final, latitude_final)
+        if resampled:
+            # Trim the far edges to whole cells, so that each node spans exactly the downsampling factors.
+            size_x = (x_max + 1) // downsample_x_factor
+            size_y = (y_max + 1) // downsample_y_factor
+            trimmed_final = self._height_map_reader.convert_displacement_to_coordinate(longitude_initial, latitude_initial, longitude_final, latitude_final, size_x * downsample_x_factor - 1, size_y * downsample_y_factor - 1)
+            longitude_initial, latitude_initial = min(longitude_initial, longitude_final), max(latitude_initial, latitude_final)
+            longitude_final, latitude_final = trimmed_final
+
+            height_grid = self._height_map_reader.read_points_resampled(longitude_initial, latitude_initial, longitude_final, latitude_final, size_x, size_y)
+            risk_grid = self._static_risk_reader.read_points_resampled(longitude_initial, latitude_initial, longitude_final, latitude_final, size_x, size_y)
+            aspect_grid = self._aspect_map_reader.read_points_resampled(longitude_initial, latitude_initial, longitude_final, latitude_final, size_x, size_y)
+
+            if not all(isinstance(g, np.ndarray) for g in [height_grid, risk_grid, aspect_grid]):
+                return False, "Failure reading grid."
+        else:
+            # More static properties
+            risk_grid = self._static_risk_reader.read_points(longitude_initial, latitude_initial, longitude_final, latitude_final)
+            aspect_grid = self._aspect_map_reader.read_points(longitude_initial, latitude_initial, longitude_final, latitude_final)
 
-        if (not isinstance(height_grid, np.ndarray)) or (not isinstance(risk_grid, np.ndarray)) or (not isinstance(aspect_grid, np.ndarray)):
-            return False, "Failure reading grid."
+            if (not isinstance(risk_grid, np.ndarray)) or (not isinstance(aspect_grid, np.ndarray)):
+                return False, "Failure reading grid."
 
-        # Downsamplings
-        height_grid = block_reduce(height_grid, block_size=(downsample_y_factor, downsample_x_factor), func=np.max)
-        risk_grid = block_reduce(risk_grid, block_size=(downsample_y_factor, downsample_x_factor), func=np.max)
-        aspect_grid = block_reduce(aspect_grid, block_size=(downsample_y_factor, downsample_x_factor), func=np.mean)
+            # Downsamplings
+            height_grid = block_reduce(height_grid, block_size=(downsample_y_factor, downsample_x_factor), func=np.max)
+            risk_grid = block_reduce(risk_grid, block_size=(downsample_y_factor, downsample_x_factor), func=np.max)
+            aspect_grid = block_reduce(aspect_grid, block_size=(downsample_y_factor, downsample_x_factor), func=np.mean)
 
         # Find maximum sizes again.
         x_max = len(height_grid[0]) - 1
@@ -155,55 +681,19 @@ class PathFinder:
         goal_node = (min(goal_node[0], x_max), min(goal_node[1], y_max))
 
         # Match dynamic risk to the risk grid.
-        for y in range(0, len(risk_grid)):
-            for x in range(0, len(risk_grid[0])):
-                risk_grid[y, x] = risk_grid[y, x] * base_utils.match_aspect_altitude_to_forecast(location_forecast_list, aspect_grid[y, x], height_grid[y, x])
+        risk_grid = risk_grid * base_utils.match_aspects_altitudes_to_forecast(location_forecast_list, aspect_grid, height_grid)
 
         self.debug_print("Successfully loaded all data grids.")
 
-        # Build the grid and a list of vertices.
-        naismith_max = -1
-        naismith_min = maxsize
+        # Scale the risk grid to 0-1.
         risk_grid_max = np.amax(risk_grid)
         risk_grid_min = np.amin(risk_grid)
-        height_grid_max = np.amax(height_grid)
-        height_grid_min = np.amin(height_grid)
-        path_grid = {}
-
-        for y in range(0, y_max + 1):
-            for x in range(0, x_max + 1):
-                # The grid dictionary is indexed by (displacement indices from top left), and contains a height, a 0-1
-                # scaled risk, and the coordinates-indices of its neighbours, arranged with list index as followed:
-                # 2 3 4
-                # 5 * 6
-                # 7 8 9
-                # a Naismith distance is attached to each neighbour.
-                height = height_grid[y, x]
-                scaled_risk = (risk_grid[y, x] - risk_grid_min) / (risk_grid_max - risk_grid_min)
-                risk_grid[y, x] = scaled_risk
-                path_grid[(x, y)] = [height, scaled_risk]
-
-                for j in range(y - 1, y + 2):
-                    for i in range(x - 1, x + 2):
-
-                        if ((i, j) == (x, y)):
-                            continue
-                        elif (0 <= i <= x_max) and (0 <= j <= y_max):
-                            if (abs(i - x) + abs(j - y)) <= 1:
-                                if (j - y) == 0:
-                                    naismith_distance = pixel_res_x + NAISMITH_CONSTANT * max(0, height_grid[j, i] - height_grid[y, x])
-                                else:
-                                    naismith_distance = pixel_res_y + NAISMITH_CONSTANT * max(0, height_grid[j, i] - height_grid[y, x])
-                            else:
-                                naismith_distance = pixel_res_d + NAISMITH_CONSTANT * max(0, height_grid[j, i] - height_grid[y, x])
-
-                            if naismith_distance > naismith_max:
-                                naismith_max = naismith_distance
-                            if naismith_distance < naismith_min:
-                                naismith_min = naismith_distance
-                            path_grid[(x, y)].append((i, j, naismith_distance))
-                        else:
-                            path_grid[(x, y)].append(None)
+        risk_grid = (risk_grid - risk_grid_min) / (risk_grid_max - risk_grid_min)
+
+        # Build the Naismith distance of every edge in the grid.
+        naismith_grid = build_naismith_grid(height_grid.astype(np.float64), pixel_res_x, pixel_res_y)
+        naismith_max = np.nanmax(naismith_grid)
+        naismith_min = np.nanmin(naismith_grid)
 
         # To prevent A* from getting stuck, all risk values below 5 np.percentile
         # will be changed to the 5 np.percentile value.
@@ -211,38 +701,269 @@ class PathFinder:
         risk_5_percentile = np.percentile(non_zeros, 5)
         np.clip(risk_grid, risk_5_percentile, risk_grid_max, out=risk_grid)
 
-        self.debug_print("Successfully built search grid, starting A* Search...")
-        # path_grid is not yet scaled here, but risk_grid is.
+        self.debug_print("Successfully built search grid.")
+
+        grid = {}
+        grid['bounds'] = (longitude_initial, latitude_initial, longitude_final, latitude_final)
+        grid['location'] = location_name
+        grid['downsample'] = (downsample_x_factor, downsample_y_factor)
+        grid['pixel_res'] = (pixel_res_x, pixel_res_y, pixel_res_d)
+        grid['size'] = (x_max, y_max)
+        grid['initial_node'] = initial_node
+        grid['goal_node'] = goal_node
+        grid['height'] = height_grid
+        grid['risk'] = risk_grid
+        grid['naismith'] = naismith_grid
+        grid['naismith_min'] = naismith_min
+        grid['naismith_max'] = naismith_max
+
+        # Plain lists are much faster than arrays for element access in searches.
+        grid['scaled_naismith_values'] = ((naismith_grid - naismith_min) / (naismith_max - naismith_min)).tolist()
+        grid['risk_values'] = risk_grid.tolist()
+
+        return grid, "Success."
+
+
+    def find_reachable(self, longitude, latitude, hours, risk_weighing=0.0, custom_date=None):
+        """ Find the terrain reachable from a coordinate within the given hours of Naismith time,
+            by a single Dijkstra expansion over the same cost model as find_path. Return a
+            tuple (reachability, message), with reachability being a dictionary of the grid
+            bounds, cell size and rows of Naismith hours, risk and accumulated risk exposure
+            for each cell, None for cells not reachable. """
+
+        # Time the execution.
+        start_time = time()
+
+        # Sanity checks.
+        if not self.check_weighing(risk_weighing):
+            return False, "Invalid risk weighing."
+
+        if (not isinstance(hours, float)) or (hours <= 0) or (hours > MAX_REACHABLE_HOURS):
+            return False, "Invalid number of hours."
+
+        # Bound the grid by the furthest point walkable on flat ground.
+        distance_limit = hours * NAISMITH_SPEED
+        latitude_radius = distance_limit / METRES_PER_DEGREE
+        longitude_radius = distance_limit / (METRES_PER_DEGREE * cos(radians(latitude)))
+
+        grid, message = self.build_grid(longitude - longitude_radius, latitude + latitude_radius, longitude + longitude_radius, latitude - latitude_radius, custom_date, location=(longitude, latitude), downsampling_target=REACHABLE_DOWNSAMPLING_TARGET, resampled=True)
+        if not grid:
+            return False, message
+
+        longitude_initial, latitude_initial, longitude_final, latitude_final = grid['bounds']
+        downsample_x_factor, downsample_y_factor = grid['downsample']
+        x_max, y_max = grid['size']
+
+        origin = self._height_map_reader.locate_index((longitude_initial, latitude_initial), (longitude_final, latitude_final), (longitude, latitude))
+        if not origin:
+            return False, "Invalid origin."
+        origin = (min(origin[0] // downsample_x_factor, x_max), min(origin[1] // downsample_y_factor, y_max))
+
+        reached = self.expand(grid, origin, risk_weighing, distance_limit)
+
+        # Lay the reached nodes out as rows of the grid.
+        hours_rows = [[None] * (x_max + 1) for y in range(y_max + 1)]
+        risk_rows = [[None] * (x_max + 1) for y in range(y_max + 1)]
+        exposure_rows = [[None] * (x_max + 1) for y in range(y_max + 1)]
+        for (x, y), (cost, naismith_distance, exposure) in reached.items():
+            hours_rows[y][x] = naismith_distance / NAISMITH_SPEED
+            risk_rows[y][x] = float(grid['risk'][y, x])
+            exposure_rows[y][x] = exposure
+
+        top_left = self._height_map_reader.convert_displacement_to_coordinate(longitude_initial, latitude_initial, longitude_final, latitude_final, 0, 0)
+        next_cell = self._height_map_reader.convert_displacement_to_coordinate(longitude_initial, latitude_initial, longitude_final, latitude_final, downsample_x_factor, downsample_y_factor)
+
+        reachability = {}
+        reachability['long'] = top_left[0]
+        reachability['lat'] = top_left[1]
+        reachability['cell_long'] = next_cell[0] - top_left[0]
+        reachability['cell_lat'] = next_cell[1] - top_left[1]
+        reachability['hours'] = hours_rows
+        reachability['risk'] = risk_rows
+        reachability['exposure'] = exposure_rows
+
+        self.debug_print(str(len(reached)) + " nodes reachable within " + str(hours) + " hours.")
+        self.debug_print("Finished in " + str(time() - start_time) + " seconds.")
+
+        return reachability, "Success."
+
+
+    def expand(self, grid, origin, risk_weighing, distance_limit):
+        """ Run a Dijkstra expansion over a grid built by build_grid from the origin node
+            with the given risk weighing, not expanding beyond distance_limit metres of
+            Naismith distance along the cheapest paths. Return a dictionary of reached nodes
+            to tuples (cost, Naismith distance, accumulated risk). """
+
+        x_max, y_max = grid['size']
+        naismith_grid = grid['naismith'].tolist()
+        scaled_naismith_grid = grid['scaled_naismith_values']
+        risk_values = grid['risk_values']
+
+        context = SearchContext()
+        context.add_to_queue(0, origin)
+        reached = {}
+        reached[origin] = (0, 0.0, 0.0)
+        settled = set()
+
+        while not context.is_queue_empty():
+            current = context.pop_from_queue()
+            current_node = current[1]
+
+            # Skip outdated queue entries of nodes already settled at a lower cost.
+            if current_node in settled:
+                continue
+            settled.add(current_node)
+
+            current_cost, current_distance, current_exposure = reached[current_node]
+            x, y = current_node
+            for k, (dx, dy) in enumerate(NEIGHBOUR_OFFSETS):
+                i = x + dx
+                j = y + dy
+                if not ((0 <= i <= x_max) and (0 <= j <= y_max)):
+                    continue
+
+                new_distance = current_distance + naismith_grid[k][y][x]
+                if new_distance > distance_limit:
+                    continue
+
+                neighbour_node = (i, j)
+                node_risk = risk_values[j][i]
+                new_cost = current_cost + scaled_naismith_grid[k][y][x] * (1 - risk_weighing) + node_risk * risk_weighing
+                if (neighbour_node not in reached) or (new_cost < reached[neighbour_node][0]):
+                    reached[neighbour_node] = (new_cost, new_distance, current_exposure + node_risk)
+                    context.add_to_queue(new_cost, neighbour_node)
+
+        return reached
+
+
+    def reverse_expand(self, grid, goal, risk_weighing, targets):
+        """ Run a Dijkstra expansion backwards over the edges of a grid built by build_grid,
+            from the goal node with the given risk weighing, until all target nodes are settled.
+            Return a tuple (costs, next nodes) of dictionaries from settled nodes to their cost
+            of reaching the goal and the next node on their cheapest path to it. """
+
+        x_max, y_max = grid['size']
+        scaled_naismith_grid = grid['scaled_naismith_values']
+        risk_values = grid['risk_values']
+
+        context = SearchContext()
+        context.add_to_queue(0, goal)
+        cost_index = {}
+        cost_index[goal] = 0
+        next_index = {}
+        next_index[goal] = None
+        costs = {}
+        remaining = set(targets)
+
+        while (not context.is_queue_empty()) and remaining:
+            current = context.pop_from_queue()
+            current_node = current[1]
+
+            # Skip outdated queue entries of nodes already settled at a lower cost.
+            if current_node in costs:
+                continue
+            costs[current_node] = cost_index[current_node]
+            remaining.discard(current_node)
+
+            # Relax the edges entering the current node, whose costs are held by their source nodes.
+            x, y = current_node
+            entry_risk = risk_values[y][x] * risk_weighing
+            for k, (dx, dy) in enumerate(NEIGHBOUR_OFFSETS):
+                i = x - dx
+                j = y - dy
+                if not ((0 <= i <= x_max) and (0 <= j <= y_max)):
+                    continue
+
+                neighbour_node = (i, j)
+                new_cost = cost_index[current_node] + scaled_naismith_grid[k][j][i] * (1 - risk_weighing) + entry_risk
+                if (neighbour_node not in cost_index) or (new_cost < cost_index[neighbour_node]):
+                    cost_index[neighbour_node] = new_cost
+                    next_index[neighbour_node] = current_node
+                    context.add_to_queue(new_cost, neighbour_node)
+
+        return costs, next_index
+
+
+    def search(self, grid, risk_weighing, inflation=1.0, deadline=None, cost_limit=None, heuristic='diagonal', stats=None):
+        """ Run A* search over a grid built by build_grid with the given
+            risk weighing, with the heuristic inflated by the inflation
+            factor for weighted A*. Nodes which cannot lead to a path cheaper
+            than cost_limit are pruned, and the search is abandoned once the
+            deadline (a time() value) passes. Return a tuple (path, cost,
+            completed), with the path as a list of grid indices, or None if
+            no path is found or the search is abandoned (completed False).
+            The number of expanded nodes is added to stats if given. """
+
+        x_max, y_max = grid['size']
+        pixel_res_x, pixel_res_y, pixel_res_d = grid['pixel_res']
+        naismith_min = grid['naismith_min']
+        naismith_max = grid['naismith_max']
+        initial_node = grid['initial_node']
+        goal_node = grid['goal_node']
+        height_grid = grid['height']
+        scaled_naismith_grid = grid['scaled_naismith_values']
+        risk_values = grid['risk_values']
+
+        if heuristic == 'alt':
+            alt_values = self.alt_heuristic(grid, risk_weighing)
+
+        self.debug_print("Starting A* Search with inflation " + str(inflation) + "...")
 
         # A* Search
-        self.add_to_queue(0, initial_node)
+        context = SearchContext()
+        context.add_to_queue(0, initial_node)
         source_index = {}
         cost_index = {}
         source_index[initial_node] = None
         cost_index[initial_node] = 0
         goal_height = height_grid[goal_node[1], goal_node[0]]
+        expansions = 0
 
-        while not self.is_queue_empty():
-            current = self.pop_from_queue()
+        while not context.is_queue_empty():
+            current = context.pop_from_queue()
             current_node = current[1]
 
             if current_node == goal_node:
                 break
 
-            neighbours = [n for n in path_grid[current_node][2:] if (n is not None)]
-            for neighbour in neighbours:
-                neighbour_node = (neighbour[0], neighbour[1])
-                # Scaling height distance values from path_grid now.
-                scaled_naismith = (neighbour[2] - naismith_min) / (naismith_max - naismith_min)
-                node_risk = risk_grid[neighbour[1], neighbour[0]] * risk_weighing
+            # Check the deadline every so often.
+            expansions += 1
+            if (deadline is not None) and (expansions % DEADLINE_CHECK_INTERVAL == 0) and (time() > deadline):
+                self.record_expansions(stats, expansions)
+                self.debug_print("Search abandoned at deadline.")
+                return None, None, False
+
+            x, y = current_node
+            for k, (dx, dy) in enumerate(NEIGHBOUR_OFFSETS):
+                i = x + dx
+                j = y + dy
+                if not ((0 <= i <= x_max) and (0 <= j <= y_max)):
+                    continue
+
+                neighbour_node = (i, j)
+                # Scaling height distance values from the edge grid now.
+                scaled_naismith = scaled_naismith_grid[k][y][x]
+                node_risk = risk_values[j][i] * risk_weighing
                 edge_cost = scaled_naismith * (1 - risk_weighing) + node_risk
                 new_cost = cost_index[current_node] + edge_cost
                 if (neighbour_node not in cost_index) or (new_cost < cost_index[neighbour_node]):
+                    if heuristic == 'alt':
+                        estimate = alt_values[j][i]
+                    else:
+                        estimate = self.heuristic(neighbour_node, goal_node, height_grid[j, i], goal_height, naismith_max, naismith_min, pixel_res_x, pixel_res_y, pixel_res_d, node_risk)
+                    if (cost_limit is not None) and (new_cost + estimate >= cost_limit):
+                        continue
                     cost_index[neighbour_node] = new_cost
-                    prio = new_cost + self.heuristic(neighbour_node, goal_node, height_grid[neighbour[1], neighbour[0]], goal_height, naismith_max, naismith_min, pixel_res_x, pixel_res_y, pixel_res_d, node_risk)
-                    self.add_to_queue(prio, neighbour_node)
+                    prio = new_cost + inflation * estimate
+                    context.add_to_queue(prio, neighbour_node)
                     source_index[neighbour_node] = current_node
 
+        self.record_expansions(stats, expansions)
+
+        if goal_node not in source_index:
+            self.debug_print("Search completed without a path.")
+            return None, None, True
+
         self.debug_print("Search completed, rebuilding path...")
 
         # Reconstruct the path by back-tracing.
@@ -255,57 +976,148 @@ class PathFinder:
 
         self.debug_print("Coordinate path: " + str(path) + ".")
 
-        # Convert indices back into coordinates with height attached.
-        return_path = {}
-        for p in range(len(path)):
-            coords = self._height_map_reader.convert_displacement_to_coordinate(longitude_initial, latitude_initial, longitude_final, latitude_final, path[p][0] * downsample_x_factor, path[p][1] * downsample_y_factor)
-            way_point = {}
-            way_point['long'] = str(coords[0])
-            way_point['lat'] = str(coords[1])
-            way_point['height'] = str(height_grid[path[p][1], path[p][0]])
-            return_path[p] = way_point
+        return path, cost_index[goal_node], True
 
-        self.clean_up_queue()
-        self.debug_print("Finished in " + str(time() - start_time) + " seconds.")
 
-        return return_path, "Success."
+    def alt_heuristic(self, grid, risk_weighing):
+        """ Return rows of ALT (A*, landmarks, triangle inequality) heuristic values for
+            each node of a grid for the given risk weighing. The triangle inequality bounds
+            the scaled Naismith part of the cost, and the risk part is bounded by the lowest
+            node risk times the fewest steps to the goal, so the heuristic is admissible. """
 
+        # Landmark costs depend only on the grid, so they are shared between searches.
+        if 'landmark_bounds' not in grid:
+            from_landmarks, to_landmarks = self.grid_landmark_distances(grid)
+            grid['landmark_bounds'] = landmarks.lower_bounds(from_landmarks, to_landmarks, grid['goal_node'])
 
-    def add_to_queue(self, priority, coordinates):
-        """ Push a coordinate and its priority onto the priority queue. """
+            x_max, y_max = grid['size']
+            ys, xs = np.mgrid[0:y_max + 1, 0:x_max + 1]
+            grid['goal_steps'] = np.maximum(abs(xs - grid['goal_node'][0]), abs(ys - grid['goal_node'][1]))
 
-        heapq.heappush(self.__priority_queue, (priority, coordinates))
+        alt_grid = grid['landmark_bounds'] * (1 - risk_weighing) + grid['goal_steps'] * (np.amin(grid['risk']) * risk_weighing)
 
-        return True
+        return alt_grid.tolist()
 
 
-    def pop_from_queue(self):
-        """ Pop the highest priority item from the priority queue, return a tuple
-            (priority, coordinates) if heap is not empty, False otherwise."""
+    def grid_landmark_distances(self, grid):
+        """ Return a tuple (from_landmarks, to_landmarks) of the scaled Naismith costs
+            from and to the landmark nodes of a grid, as landmarks.landmark_distances.
+            These depend only on the raster window and region of the grid, not on its
+            goal, forecasts or risk weighing, so the most recently used are cached by
+            window for later requests over the same area. """
 
-        if len(self.__priority_queue) <= 0:
-            return False
+        longitude_initial, latitude_initial, longitude_final, latitude_final = grid['bounds']
+        window_initial = self._height_map_reader.coordinate_to_index(min(longitude_initial, longitude_final), max(latitude_initial, latitude_final))
+        window_final = self._height_map_reader.coordinate_to_index(max(longitude_initial, longitude_final), min(latitude_initial, latitude_final))
+        cache_key = (grid['location'],) + window_initial + window_final
 
-        return heapq.heappop(self.__priority_queue)
+        with self._landmark_lock:
+            if cache_key in self._landmark_distances:
+                self._landmark_distances[cache_key] = self._landmark_distances.pop(cache_key)
+                return self._landmark_distances[cache_key]
 
+        landmark_nodes = self.grid_landmarks(grid)
+        scaled_naismith_grid = (grid['naismith'] - grid['naismith_min']) / (grid['naismith_max'] - grid['naismith_min'])
+        distances = landmarks.landmark_distances(scaled_naismith_grid, landmark_nodes)
 
-    def is_queue_empty(self):
-        """ Returns True if the priority queue is empty, False otherwise. """
+        with self._landmark_lock:
+            self._landmark_distances[cache_key] = distances
+            while len(self._landmark_distances) > LANDMARK_CACHE_SIZE:
+                self._landmark_distances.popitem(last=False)
 
-        if len(self.__priority_queue) <= 0:
-            return True
-        else:
-            return False
+        return distances
 
 
-    def clean_up_queue(self):
-        """ Clear the priority queue to prepare for the next lookup. """
+    def grid_landmarks(self, grid):
+        """ Return the landmark nodes of a grid: the landmarks of its region moved onto
+            the nearest grid node, or its corners and edge midpoints if the region has
+            no landmarks built. """
+
+        x_max, y_max = grid['size']
+        longitude_initial, latitude_initial, longitude_final, latitude_final = grid['bounds']
+        downsample_x_factor, downsample_y_factor = grid['downsample']
+
+        if grid['location'] not in self._landmarks:
+            return [(0, 0), (x_max // 2, 0), (x_max, 0), (0, y_max // 2), (x_max, y_max // 2), (0, y_max), (x_max // 2, y_max), (x_max, y_max)]
+
+        init_x, init_y = self._height_map_reader.coordinate_to_index(min(longitude_initial, longitude_final), max(latitude_initial, latitude_final))
+        landmark_nodes = []
+        for landmark in self._landmarks[grid['location']]:
+            index_x, index_y = self._height_map_reader.coordinate_to_index(landmark[0], landmark[1])
+            node = (min(max((index_x - init_x) // downsample_x_factor, 0), x_max), min(max((index_y - init_y) // downsample_y_factor, 0), y_max))
+            if node not in landmark_nodes:
+                landmark_nodes.append(node)
+
+        return landmark_nodes
 
-        self.__priority_queue = []
+
+    def path_to_coordinates(self, grid, path):
+        """ Convert a path of grid indices back into coordinates with height and scaled risk attached,
+            return a dictionary of way points keyed by their order in the path. """
+
+        longitude_initial, latitude_initial, longitude_final, latitude_final = grid['bounds']
+        downsample_x_factor, downsample_y_factor = grid['downsample']
+        height_grid = grid['height']
+        risk_grid = grid['risk']
+
+        path_x = np.array([node[0] for node in path])
+        path_y = np.array([node[1] for node in path])
+        longitudes, latitudes = self._height_map_reader.convert_displacements_to_coordinates(longitude_initial, latitude_initial, longitude_final, latitude_final, path_x * downsample_x_factor, path_y * downsample_y_factor)
+        heights = height_grid[path_y, path_x]
+        risks = risk_grid[path_y, path_x]
+
+        return_path = {}
+        for p, (longitude, latitude) in enumerate(zip(longitudes.tolist(), latitudes.tolist())):
+            way_point = {}
+            way_point['long'] = str(longitude)
+            way_point['lat'] = str(latitude)
+            way_point['height'] = str(heights[p])
+            way_point['risk'] = str(risks[p])
+            return_path[p] = way_point
+
+        return return_path
+
+
+    @staticmethod
+    def path_totals(grid, path):
+        """ Return a tuple (Naismith distance, accumulated risk) of a path of grid
+            indices, with risk being the sum of the scaled risk of nodes entered. """
+
+        naismith_grid = grid['naismith']
+        risk_grid = grid['risk']
+
+        total_distance = 0.0
+        total_risk = 0.0
+        for p in range(1, len(path)):
+            x, y = path[p - 1]
+            i, j = path[p]
+            total_distance += float(naismith_grid[NEIGHBOUR_OFFSETS.index((i - x, j - y)), y, x])
+            total_risk += float(risk_grid[j, i])
+
+        return total_distance, total_risk
+
+
+    @staticmethod
+    def record_expansions(stats, expansions):
+        """ Add a number of expanded nodes to a search statistics dictionary, if given. """
+
+        if stats is not None:
+            stats['expansions'] = stats.get('expansions', 0) + expansions
 
         return True
 
 
+    @staticmethod
+    def check_weighing(risk_weighing):
+        """ Return True if the risk weighing is a float between 0 and 1, False otherwise. """
+
+        if isinstance(risk_weighing, float):
+            if risk_weighing >= 0 and risk_weighing <= 1:
+                return True
+
+        return False
+
+
     def heuristic(self, current, goal, node_height, goal_height, naismith_max, naismith_min, pixel_res_x, pixel_res_y, pixel_res_d, node_risk):
         """ A diagonal heuristics function for A* search. """
 
@@ -337,13 +1149,70 @@ class PathFinder:
             print(message)
 
 
+def check_concurrent_searches():
+    """ Search the routes of path_finder_benchmark over its synthetic terrain one at a
+        time, then CHECK_REPEATS times over from a thread each, all sharing one PathFinder,
+        with each heuristic and the lazy search. Return a tuple (passed, message), passing
+        if every concurrent result is identical to the serial one. """
+
+    from GeoData import path_finder_benchmark
+
+    directory = tempfile.mkdtemp()
+    try:
+        files = path_finder_benchmark.write_terrain(directory, CHECK_TERRAIN, CHECK_SIZE)
+        db_file = os.path.join(directory, "forecast.db")
+        path_finder_benchmark.write_forecast_db(db_file)
+        finder = PathFinder(RasterReader(files['height']), RasterReader(files['aspect']), RasterReader(files['risk']), db_manager.CrawlerDB(db_file))
+
+        searches = []
+        for route in path_finder_benchmark.ROUTES:
+            coordinates = tuple(path_finder_benchmark.route_coordinates(route, CHECK_SIZE))
+            for weighing in path_finder_benchmark.WEIGHINGS:
+                for heuristic in HEURISTICS:
+                    searches.append((finder.find_path, coordinates + (weighing, path_finder_benchmark.FORECAST_DATE, heuristic)))
+                searches.append((finder.find_path_lazy, coordinates + (weighing, path_finder_benchmark.FORECAST_DATE)))
+
+        # Lazy searches may give up on the longer routes, but must do so every time.
+        serial_results = [method(*arguments) for method, arguments in searches]
+        failures = [result[1] for (method, arguments), result in zip(searches, serial_results) if (method == finder.find_path) and (not result[0])]
+        if failures:
+            return False, "Serial searches failed: " + str(failures) + "."
+
+        concurrent_results = [None] * (len(searches) * CHECK_REPEATS)
+        def search_concurrently(n):
+            method, arguments = searches[n % len(searches)]
+            concurrent_results[n] = method(*arguments)
+
+        threads = [threading.Thread(target=search_concurrently, args=(n,)) for n in range(len(concurrent_results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        shutil.rmtree(directory)
+
+    mismatches = [n for n in range(len(concurrent_results)) if concurrent_results[n] != serial_results[n % len(searches)]]
+    if mismatches:
+        return False, str(len(mismatches)) + " of " + str(len(concurrent_results)) + " concurrent searches differ from the serial ones."
+
+    return True, "All " + str(len(concurrent_results)) + " concurrent searches over " + str(len(threads)) + " threads match the serial ones."
+
+
 if __name__ == '__main__':
+    if (len(sys.argv) == 2) and (sys.argv[1] == "--check"):
+        passed, message = check_concurrent_searches()
+        print(message)
+        sys.exit(0 if passed else 1)
+
     dbFile = utils.get_project_full_path() + utils.read_config('dbFile')
     risk_cursor = db_manager.CrawlerDB(dbFile)
     finder = PathFinder(RasterReader(rasters.HEIGHT_RASTER), RasterReader(rasters.ASPECT_RASTER), RasterReader(rasters.RISK_RASTER), risk_cursor)
-    print(finder.find_path(-5.05173828125, 56.8129075187, -4.959765625, 56.7008783123, 0.5, '2017-02-20'))
-    print(finder.find_path(-5.009765624999997, 56.790878312330426, -5.008765624999997, 56.79190751870019, 0.5))
-    print(finder.find_path(-5.03173828125, 56.8008783123, -5.030765625, 56.8008452452, 0.5))
-    print(finder.find_path(-4.99795838, 56.79702667, -4.99198645, 56.8079062, 0.5))
-    print(finder.find_path(-5.0142724850797435, 56.7887604182850, -5.002987990273577, 56.80017695374134, 0.5))
-    print(finder.find_path(-5.01481615318695, 56.79864610013431, -5.013048501000368, 56.80018630991712, 1.0))
+    routes = [
+        (-5.05173828125, 56.8129075187, -4.959765625, 56.7008783123, 0.5, '2017-02-20'),
+        (-5.009765624999997, 56.790878312330426, -5.008765624999997, 56.79190751870019, 0.5, None),
+        (-5.03173828125, 56.8008783123, -5.030765625, 56.8008452452, 0.5, None),
+        (-4.99795838, 56.79702667, -4.99198645, 56.8079062, 0.5, None),
+        (-5.0142724850797435, 56.7887604182850, -5.002987990273577, 56.80017695374134, 0.5, None),
+        (-5.01481615318695, 56.79864610013431, -5.013048501000368, 56.80018630991712, 1.0, None)]
+    for route in routes:
+        print(finder.find_path(*route))
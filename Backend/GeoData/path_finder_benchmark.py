@@ -0,0 +1,363 @@
+###############################################################
+# Benchmark suite for the path finder on synthetic terrain.
+# Rasters of ridges, bowls, cliffs and plateaus are written as
+# GeoTIFFs with a synthetic forecast database, and fixed route
+# sets are searched at several sizes and risk weighings, each
+# case in its own process to measure its peak memory. The ALT
+# heuristic is compared with the diagonal one, counting the
+# landmark distances computed for each grid, and once more with
+# those of the area already cached by an earlier search. Run from
+# the Backend directory:
+#   python -m GeoData.path_finder_benchmark results.json [baseline.json]
+# With a baseline, regressions are listed and the exit status
+# is 1 if any are found.
+###############################################################
+
+from __future__ import division, print_function
+
+import os
+import sys
+import json
+import shutil
+import resource
+import platform
+import tempfile
+import multiprocessing
+import numpy as np
+from time import time
+from math import cos, radians
+from osgeo import gdal
+
+from GeoData import block_pipeline, rasters, path_finder
+from GeoData.raster_reader import RasterReader
+from SAISCrawler.script import db_manager
+
+TERRAINS = ['ridges', 'bowls', 'cliffs', 'plateaus']
+SIZES = [500, 1500] # Raster pixels in each direction.
+WEIGHINGS = [0.0, 0.5, 1.0]
+METHODS = ['diagonal', 'alt', 'alt_cached', 'lazy']
+ROUTES = [ # Start and goal as fractions of the raster size.
+    (0.10, 0.10, 0.90, 0.90),
+    (0.20, 0.80, 0.70, 0.30),
+    (0.40, 0.40, 0.45, 0.42)]
+TERRAIN_SEED = 0
+NODATA = -9999
+
+# Top left corner, inside the Lochaber forecast region.
+ORIGIN = (-5.2, 56.95)
+LOCATION_NAME = "Lochaber"
+CELL_LAT = path_finder.PIXEL_RES / path_finder.METRES_PER_DEGREE
+CELL_LONG = path_finder.PIXEL_RES / (path_finder.METRES_PER_DEGREE * cos(radians(ORIGIN[1])))
+
+# Forecast boundaries and risk codes ((lower primary, lower secondary), (upper primary, upper secondary)) by direction.
+FORECAST_DATE = "2017-02-20"
+FORECAST_BOUNDARIES = (300, 600, 1000)
+FORECAST_DATASET = [((1, 0), (3, 2)), ((2, 1), (4, 3)), ((1, 0), (2, 0)), ((1, 0), (1, 0)),
+    ((1, 0), (2, 1)), ((2, 0), (3, 0)), ((2, 1), (3, 2)), ((1, 0), (3, 0))]
+
+# Allowed increases over a baseline before a case counts as a regression.
+TIME_TOLERANCE = 0.25
+EXPANSION_TOLERANCE = 0.05
+COST_TOLERANCE = 1e-6
+CASE_TIMEOUT = 600 # Seconds a case may run before it counts as failed.
+
+
+def make_heights(terrain, size, seed=TERRAIN_SEED):
+    """ Return a size by size array of heights in metres for a type of terrain. """
+
+    generator = np.random.RandomState(seed)
+    ys, xs = np.mgrid[0:size, 0:size] / size
+
+    if terrain == 'ridges':
+        # Parallel ridges running diagonally, rising towards one corner.
+        heights = 500 + 250 * np.sin((xs + 0.6 * ys) * 6 * np.pi) + 300 * (xs + ys)
+    elif terrain == 'bowls':
+        # Corries with steep back walls and flat floors.
+        heights = np.full((size, size), 900.0)
+        for centre_x, centre_y in generator.uniform(0.15, 0.85, (4, 2)):
+            distance = np.sqrt((xs - centre_x) ** 2 + (ys - centre_y) ** 2)
+            heights = np.minimum(heights, 300 + 600 * np.clip(distance / 0.25, 0, 1) ** 2)
+    elif terrain == 'cliffs':
+        # Terraces separated by near-vertical steps.
+        heights = 200 + 120 * np.floor(6 * (0.6 * xs + 0.4 * ys + 0.05 * np.sin(ys * 8 * np.pi)))
+    elif terrain == 'plateaus':
+        # Flat summit plateau falling away steeply at its edges.
+        distance = np.maximum(abs(xs - 0.5), abs(ys - 0.5))
+        heights = 400 + 500 / (1 + np.exp((distance - 0.3) * 60))
+    else:
+        raise ValueError("Unknown terrain " + terrain + ".")
+
+    return heights + generator.normal(0, 0.5, (size, size))
+
+
+def make_aspects_and_risks(heights):
+    """ Return a tuple (aspects, static risks) of arrays for an array of heights,
+        with aspects clockwise from north in degrees as in the ArcGIS convention,
+        -1 on flat ground, and static risks peaking on 38 degree slopes. """
+
+    # Rows run southwards, so the northward gradient is the negative row gradient.
+    gradient_rows, gradient_columns = np.gradient(heights, path_finder.PIXEL_RES)
+    gradient_north = -gradient_rows
+    gradient_east = gradient_columns
+
+    aspects = np.degrees(np.arctan2(-gradient_east, -gradient_north)) % 360
+    slopes = np.degrees(np.arctan(np.sqrt(gradient_north ** 2 + gradient_east ** 2)))
+    aspects[slopes < 1] = -1
+
+    risks = rasters.RISK_RASTER_MAX * np.exp(-((slopes - 38) / 8) ** 2)
+
+    return aspects, risks
+
+
+def write_forecast_db(file_name):
+    """ Create a forecast database with the crawler schema, holding one
+        forecast for the benchmark location. """
+
+    forecast_dbm = db_manager.CrawlerDB(file_name)
+    forecast_dbm.create_tables()
+    location_id = forecast_dbm.add_location(LOCATION_NAME, "http://www.sais.gov.uk/lochaber/")
+    forecast_dbm.add_forecast(location_id, FORECAST_DATE, FORECAST_BOUNDARIES, FORECAST_DATASET)
+
+    return True
+
+
+def write_terrain(directory, terrain, size):
+    """ Write the height, aspect and static risk rasters of a terrain, return
+        a dictionary of their file names. """
+
+    heights = make_heights(terrain, size)
+    aspects, risks = make_aspects_and_risks(heights)
+
+    files = {}
+    for raster_type, values in [('height', heights), ('aspect', aspects), ('risk', risks)]:
+        files[raster_type] = os.path.join(directory, terrain + "_" + str(size) + "_" + raster_type + ".tif")
+        block_pipeline.write_raster(files[raster_type], values, (ORIGIN[0], CELL_LONG, 0, ORIGIN[1], 0, -CELL_LAT), 4326, NODATA)
+
+    return files
+
+
+def route_coordinates(route, size):
+    """ Return the start and goal coordinates of a route at the centres of their cells. """
+
+    coordinates = []
+    for fraction_x, fraction_y in [route[0:2], route[2:4]]:
+        coordinates.append(ORIGIN[0] + (int(fraction_x * (size - 1)) + 0.5) * CELL_LONG)
+        coordinates.append(ORIGIN[1] - (int(fraction_y * (size - 1)) + 0.5) * CELL_LAT)
+
+    return coordinates
+
+
+def run_case(case, files, db_file, connection):
+    """ Run a benchmark case in a worker process, sending back its measurements. """
+
+    finder = path_finder.PathFinder(RasterReader(files['height']), RasterReader(files['aspect']), RasterReader(files['risk']), db_manager.CrawlerDB(db_file))
+    longitude_initial, latitude_initial, longitude_final, latitude_final = route_coordinates(ROUTES[case['route']], case['size'])
+    baseline_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    result = dict(case)
+    stats = {}
+    start_time = time()
+
+    if case['method'] == 'lazy':
+        path, message = finder.find_path_lazy(longitude_initial, latitude_initial, longitude_final, latitude_final, case['weighing'], FORECAST_DATE, stats)
+        result['search_ms'] = (time() - start_time) * 1000
+        result['build_ms'] = 0
+        result['cost'] = stats.get('cost')
+        result['path_length'] = len(path) if path else None
+    else:
+        heuristic = 'alt' if case['method'] == 'alt_cached' else case['method']
+        if case['method'] == 'alt_cached':
+            # Search the area once untimed, as an earlier request would, caching its landmark distances.
+            grid, message = finder.build_grid(longitude_initial, latitude_initial, longitude_final, latitude_final, FORECAST_DATE)
+            if grid:
+                finder.search(grid, case['weighing'], heuristic=heuristic)
+            start_time = time()
+
+        grid, message = finder.build_grid(longitude_initial, latitude_initial, longitude_final, latitude_final, FORECAST_DATE)
+        result['build_ms'] = (time() - start_time) * 1000
+
+        # Landmark distances are set up for the grid before searching, so that their cost shows apart.
+        landmark_start_time = time()
+        if grid and (heuristic == 'alt'):
+            finder.alt_heuristic(grid, case['weighing'])
+        result['landmark_ms'] = (time() - landmark_start_time) * 1000
+
+        search_start_time = time()
+        path, cost, completed = finder.search(grid, case['weighing'], heuristic=heuristic, stats=stats) if grid else (None, None, False)
+        result['search_ms'] = (time() - search_start_time) * 1000
+        result['cost'] = cost
+        result['path_length'] = len(path) if path else None
+
+    result['total_ms'] = (time() - start_time) * 1000
+    result['expansions'] = stats.get('expansions', 0)
+    result['peak_memory_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['search_memory_kb'] = result['peak_memory_kb'] - baseline_memory
+    result['message'] = message
+
+    connection.send(result)
+    connection.close()
+
+
+def run_case_process(case, files, db_file):
+    """ Run a benchmark case in a fresh process, so that its peak memory is its
+        own. Return its result, or None if the process died or timed out. """
+
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_case, args=(case, files, db_file, child_connection))
+    process.start()
+    child_connection.close() # Only the case process holds it now, so its death ends the pipe.
+
+    result = None
+    try:
+        if parent_connection.poll(CASE_TIMEOUT):
+            result = parent_connection.recv()
+    except EOFError:
+        pass
+
+    process.join(CASE_TIMEOUT if result is not None else 0)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+
+    return result
+
+
+def run_benchmarks(directory):
+    """ Write the synthetic data into the directory and run every benchmark case,
+        return a list of result dictionaries. """
+
+    db_file = os.path.join(directory, "forecast.db")
+    write_forecast_db(db_file)
+
+    results = []
+    for terrain in TERRAINS:
+        for size in SIZES:
+            files = write_terrain(directory, terrain, size)
+            for method in METHODS:
+                for weighing in WEIGHINGS:
+                    for route in range(len(ROUTES)):
+                        case = {'terrain': terrain, 'size': size, 'method': method, 'weighing': weighing, 'route': route}
+
+                        result = run_case_process(case, files, db_file)
+                        if result is None:
+                            result = dict(case)
+                            result['failed'] = True
+                            print(case_key(result) + ": failed, the case process died or timed out.")
+                        else:
+                            print(case_key(result) + ": " + str(round(result['total_ms'], 1)) + "ms, " + str(result['expansions']) + " expansions, cost " + str(result['cost']) + ".")
+                        results.append(result)
+
+    return results
+
+
+def case_key(result):
+    """ Return a string identifying the case of a result. """
+
+    return "/".join(str(result[k]) for k in ['terrain', 'size', 'method', 'weighing', 'route'])
+
+
+def compare_results(results, baseline_results):
+    """ Return a list of messages describing regressions of the results against
+        baseline results: slower searches, more expansions or changed costs. """
+
+    baseline = dict((case_key(result), result) for result in baseline_results)
+    regressions = []
+
+    for result in results:
+        key = case_key(result)
+        if key not in baseline:
+            continue
+        previous = baseline[key]
+
+        if result.get('failed'):
+            regressions.append(key + ": case failed.")
+            continue
+        if previous.get('failed'):
+            continue
+
+        if result['total_ms'] > previous['total_ms'] * (1 + TIME_TOLERANCE):
+            regressions.append(key + ": time " + str(round(previous['total_ms'], 1)) + "ms to " + str(round(result['total_ms'], 1)) + "ms.")
+        if result['expansions'] > previous['expansions'] * (1 + EXPANSION_TOLERANCE):
+            regressions.append(key + ": expansions " + str(previous['expansions']) + " to " + str(result['expansions']) + ".")
+        if (result['cost'] is None) != (previous['cost'] is None):
+            regressions.append(key + ": path found changed from " + str(previous['path_length']) + " to " + str(result['path_length']) + " nodes.")
+        elif (result['cost'] is not None) and (abs(result['cost'] - previous['cost']) > COST_TOLERANCE * max(abs(previous['cost']), 1)):
+            regressions.append(key + ": cost " + str(previous['cost']) + " to " + str(result['cost']) + ".")
+
+    # The net time of ALT searches relative to diagonal ones, landmark setup included.
+    for method in ['alt', 'alt_cached']:
+        ratio = heuristic_time_ratio(results, method)
+        previous_ratio = heuristic_time_ratio(baseline_results, method)
+        if (ratio is not None) and (previous_ratio is not None) and (ratio > previous_ratio * (1 + TIME_TOLERANCE)):
+            regressions.append(method + ": time relative to diagonal " + str(round(previous_ratio, 3)) + " to " + str(round(ratio, 3)) + ".")
+
+    return regressions
+
+
+def heuristic_time_ratio(results, method):
+    """ Return the total time of the cases of an ALT method over that of the same
+        cases with the diagonal heuristic, or None if there are no such cases. """
+
+    diagonal = dict((case_key(dict(result, method=method)), result) for result in results if (result['method'] == 'diagonal') and (not result.get('failed')))
+    pairs = [(result, diagonal[case_key(result)]) for result in results if (result['method'] == method) and (not result.get('failed')) and (case_key(result) in diagonal)]
+    if not pairs:
+        return None
+
+    return sum(p[0]['total_ms'] for p in pairs) / sum(p[1]['total_ms'] for p in pairs)
+
+
+def compare_heuristics(results):
+    """ Return a list of lines comparing each ALT case with the same case searched with
+        the diagonal heuristic, by expansions and time, and the net time ratios. """
+
+    diagonal = dict((case_key(dict(result, method='alt')), result) for result in results if (result['method'] == 'diagonal') and (not result.get('failed')))
+    cached = dict((case_key(dict(result, method='alt')), result) for result in results if (result['method'] == 'alt_cached') and (not result.get('failed')))
+
+    lines = []
+    for result in results:
+        key = case_key(result)
+        if (result['method'] != 'alt') or result.get('failed') or (key not in diagonal):
+            continue
+        line = key + ": expansions " + str(diagonal[key]['expansions']) + " diagonal, " + str(result['expansions']) + " ALT; time " \
+            + str(round(diagonal[key]['total_ms'], 1)) + "ms diagonal, " + str(round(result['total_ms'], 1)) + "ms ALT with " + str(round(result['landmark_ms'], 1)) + "ms landmark setup"
+        if key in cached:
+            line += ", " + str(round(cached[key]['total_ms'], 1)) + "ms ALT cached"
+        lines.append(line + ".")
+
+    for method in ['alt', 'alt_cached']:
+        ratio = heuristic_time_ratio(results, method)
+        if ratio is not None:
+            lines.append("Net time of " + method + " relative to diagonal: " + str(round(ratio, 3)) + ".")
+
+    return lines
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [2, 3]:
+        sys.exit("Usage: python -m GeoData.path_finder_benchmark {results_file} [baseline_file]")
+
+    directory = tempfile.mkdtemp()
+    try:
+        results = run_benchmarks(directory)
+    finally:
+        shutil.rmtree(directory)
+
+    for line in compare_heuristics(results):
+        print(line)
+
+    output = {}
+    output['python'] = platform.python_version()
+    output['numpy'] = np.__version__
+    output['gdal'] = gdal.__version__
+    output['results'] = results
+    with open(sys.argv[1], "w") as output_file:
+        json.dump(output, output_file, indent=2)
+
+    if len(sys.argv) == 3:
+        with open(sys.argv[2], "r") as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file)['results'])
+        for regression in regressions:
+            print("Regression in " + regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
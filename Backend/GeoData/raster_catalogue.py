@@ -0,0 +1,333 @@
+###############################################################
+# Raster reader over a catalogue of tile files, indexed by their
+# bounding boxes in an R-tree. Tiles must share one resolution
+# and pixel grid, and together form a virtual mosaic read with
+# the same interface as raster_reader.RasterReader, so that it
+# can be swapped in as the SPATIAL_READER of the API server.
+# Tile files are opened lazily, keeping at most MAX_OPEN_TILES
+# open. To build a catalogue of tile files:
+#   python -m GeoData.raster_catalogue CATALOGUE_FILE TILE_FILE...
+###############################################################
+
+from __future__ import division, print_function
+
+import os
+import sys
+import json
+import numpy as np
+from math import ceil, sqrt
+from collections import OrderedDict
+from osgeo import gdal
+
+from GeoData import raster_reader
+
+MAX_OPEN_TILES = 16
+NODE_CAPACITY = 16
+ALIGNMENT_TOLERANCE = 0.01 # Fraction of a pixel by which tile edges may be off the grid.
+
+
+class TileIndex:
+    """ Static R-tree of items by bounding boxes (min x, min y, max x, max y),
+        packed by Sort-Tile-Recursive, as the tiles of a catalogue do not
+        change once loaded. """
+
+    def __init__(self, entries, node_capacity=NODE_CAPACITY):
+
+        self._root = None
+        if len(entries) == 0:
+            return
+
+        # Nodes are tuples (bounds, children, is leaf), with entries as the children of leaves.
+        nodes = [(self.union([e[0] for e in group]), group, True) for group in self.pack(entries, node_capacity)]
+        while len(nodes) > 1:
+            nodes = [(self.union([n[0] for n in group]), group, False) for group in self.pack(nodes, node_capacity)]
+
+        self._root = nodes[0]
+
+
+    def query(self, min_x, min_y, max_x, max_y):
+        """ Return the items with bounding boxes intersecting the given box,
+            edges excluded. """
+
+        if self._root is None:
+            return []
+
+        items = []
+        stack = [self._root]
+        while stack:
+            bounds, children, is_leaf = stack.pop()
+            if not self.intersects(bounds, (min_x, min_y, max_x, max_y)):
+                continue
+
+            if is_leaf:
+                items.extend(child[1] for child in children if self.intersects(child[0], (min_x, min_y, max_x, max_y)))
+            else:
+                stack.extend(children)
+
+        return items
+
+
+    @staticmethod
+    def pack(nodes, node_capacity):
+        """ Group nodes into groups of up to node_capacity: sort by x centres into
+            vertical slices, then by y centres within each slice. """
+
+        slice_count = int(ceil(sqrt(ceil(len(nodes) / node_capacity))))
+        slice_size = int(ceil(len(nodes) / max(slice_count, 1)))
+
+        nodes = sorted(nodes, key=lambda n: n[0][0] + n[0][2])
+        groups = []
+        for s in range(0, len(nodes), slice_size):
+            vertical_slice = sorted(nodes[s:s + slice_size], key=lambda n: n[0][1] + n[0][3])
+            for g in range(0, len(vertical_slice), node_capacity):
+                groups.append(vertical_slice[g:g + node_capacity])
+
+        return groups
+
+
+    @staticmethod
+    def union(boxes):
+        """ Return the bounding box of a list of boxes. """
+
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+    @staticmethod
+    def intersects(a, b):
+        """ Return True if two boxes overlap by more than their edges. """
+
+        return (a[0] < b[2]) and (b[0] < a[2]) and (a[1] < b[3]) and (b[1] < a[3])
+
+
+class MosaicBand:
+    """ The single band of a tile mosaic, for the band methods used by readers. """
+
+    def __init__(self, mosaic):
+
+        self._mosaic = mosaic
+
+
+    def GetNoDataValue(self):
+        """ Return the no data value of the mosaic, also filling gaps between tiles. """
+
+        return self._mosaic.no_data_value
+
+
+    def ReadAsArray(self, xoff=0, yoff=0, win_xsize=None, win_ysize=None, buf_xsize=None, buf_ysize=None):
+        """ Read a window of the mosaic, as the dataset does. """
+
+        return self._mosaic.ReadAsArray(xoff, yoff, win_xsize, win_ysize, buf_xsize, buf_ysize)
+
+
+class TileMosaic:
+    """ Virtual single band dataset over the tiles of a catalogue, providing
+        the dataset methods used by RasterReader. Windows spanning several
+        tiles are stitched from reads of each, and gaps between tiles are
+        filled with the no data value. """
+
+    def __init__(self, catalogue):
+
+        self._directory = catalogue['directory']
+        self._tiles = catalogue['tiles']
+        self._open_tiles = OrderedDict()
+        self._geotransform = tuple(catalogue['geotransform'])
+        self.no_data_value = catalogue['nodata']
+        self.dtype = np.dtype(catalogue['dtype'])
+
+        # Tile offsets and sizes in points of the mosaic.
+        pixel_x = self._geotransform[1]
+        pixel_y = self._geotransform[5]
+        self.RasterXSize = 0
+        self.RasterYSize = 0
+        entries = []
+        for tile_number, tile in enumerate(self._tiles):
+            tile['offset'] = (int(round((tile['origin'][0] - self._geotransform[0]) / pixel_x)), int(round((tile['origin'][1] - self._geotransform[3]) / pixel_y)))
+            tile_box = (tile['offset'][0], tile['offset'][1], tile['offset'][0] + tile['size'][0], tile['offset'][1] + tile['size'][1])
+            entries.append((tile_box, tile_number))
+            self.RasterXSize = max(self.RasterXSize, tile_box[2])
+            self.RasterYSize = max(self.RasterYSize, tile_box[3])
+
+        self._index = TileIndex(entries)
+
+
+    def GetGeoTransform(self):
+        """ Return the geotransform of the mosaic. """
+
+        return self._geotransform
+
+
+    def GetRasterBand(self, band_number):
+        """ Return the band of the mosaic, which only has one. """
+
+        return MosaicBand(self)
+
+
+    def ReadRaster(self, xoff, yoff, xsize, ysize, buf_type=gdal.GDT_Float32):
+        """ Read a window of the mosaic as a string of packed floats, or None if the
+            window is outside the mosaic. Only float reads are supported. """
+
+        data = self.ReadAsArray(xoff, yoff, xsize, ysize)
+        if data is None:
+            return None
+
+        return data.astype(np.float32).tobytes()
+
+
+    def ReadAsArray(self, xoff=0, yoff=0, win_xsize=None, win_ysize=None, buf_xsize=None, buf_ysize=None):
+        """ Read a window of the mosaic as an array, resampled to buf_xsize by buf_ysize
+            points by nearest neighbour if given. Return None if the window is outside
+            the mosaic. """
+
+        if win_xsize is None:
+            win_xsize = self.RasterXSize - xoff
+        if win_ysize is None:
+            win_ysize = self.RasterYSize - yoff
+        if (xoff < 0) or (yoff < 0) or (win_xsize <= 0) or (win_ysize <= 0) or (xoff + win_xsize > self.RasterXSize) or (yoff + win_ysize > self.RasterYSize):
+            return None
+
+        if buf_xsize is None:
+            buf_xsize = win_xsize
+        if buf_ysize is None:
+            buf_ysize = win_ysize
+
+        # Source points of each buffer column and row, as sampled by GDAL.
+        columns = xoff + (np.arange(buf_xsize) + 0.5) * win_xsize // buf_xsize
+        rows = yoff + (np.arange(buf_ysize) + 0.5) * win_ysize // buf_ysize
+        columns = columns.astype(int)
+        rows = rows.astype(int)
+
+        data = np.full((buf_ysize, buf_xsize), self.no_data_value if self.no_data_value is not None else 0, dtype=self.dtype)
+        for tile_number in self._index.query(xoff, yoff, xoff + win_xsize, yoff + win_ysize):
+            tile = self._tiles[tile_number]
+            tile_x, tile_y = tile['offset']
+            in_columns = np.nonzero((columns >= tile_x) & (columns < tile_x + tile['size'][0]))[0]
+            in_rows = np.nonzero((rows >= tile_y) & (rows < tile_y + tile['size'][1]))[0]
+            if (len(in_columns) == 0) or (len(in_rows) == 0):
+                continue
+
+            # Read the span of the tile covering its buffer points.
+            dataset = self.open_tile(tile_number)
+            x1 = int(columns[in_columns[0]] - tile_x)
+            xn = int(columns[in_columns[-1]] - tile_x)
+            y1 = int(rows[in_rows[0]] - tile_y)
+            yn = int(rows[in_rows[-1]] - tile_y)
+            if (buf_xsize == win_xsize) and (buf_ysize == win_ysize):
+                data[in_rows[0]:in_rows[-1] + 1, in_columns[0]:in_columns[-1] + 1] = dataset.ReadAsArray(x1, y1, xn - x1 + 1, yn - y1 + 1)
+                continue
+
+            # Resampled reads of each tile would sample points off the grid of the whole
+            # window, so the sampled rows are read one at a time and sampled exactly.
+            tile_columns = columns[in_columns] - tile_x - x1
+            for r in in_rows:
+                data[r, in_columns[0]:in_columns[-1] + 1] = dataset.ReadAsArray(x1, int(rows[r] - tile_y), xn - x1 + 1, 1)[0, tile_columns]
+
+        return data
+
+
+    def open_tile(self, tile_number):
+        """ Return the opened dataset of a tile, opening it if needed and closing the
+            least recently used tile if MAX_OPEN_TILES would be exceeded. """
+
+        if tile_number in self._open_tiles:
+            dataset = self._open_tiles.pop(tile_number)
+        else:
+            dataset = gdal.Open(os.path.join(self._directory, self._tiles[tile_number]['file']))
+            if len(self._open_tiles) >= MAX_OPEN_TILES:
+                self._open_tiles.popitem(last=False)
+
+        self._open_tiles[tile_number] = dataset
+
+        return dataset
+
+
+class RasterReader(raster_reader.RasterReader):
+    """ Interface for access of raster tiles listed in a catalogue file
+        built by build_catalogue, with the interface of a single raster
+        file reader. A raster file not ending in .json is read as a
+        catalogue of one tile. """
+
+    def __init__(self, raster_file=raster_reader.DEFAULT_RASTER):
+
+        if raster_file.endswith(".json"):
+            try:
+                with open(raster_file, "r") as catalogue_file:
+                    catalogue = json.load(catalogue_file)
+            except (IOError, ValueError):
+                self.log_error("Error, catalogue " + raster_file + " is not valid.")
+                sys.exit()
+            catalogue['directory'] = os.path.dirname(os.path.abspath(raster_file))
+        else:
+            catalogue = build_catalogue([raster_file])
+
+        if catalogue is None:
+            self.log_error("Error, raster data from " + raster_file + " is not valid.")
+            sys.exit()
+
+        self._raster = TileMosaic(catalogue)
+        self.initialise_raster(raster_file)
+
+
+def build_catalogue(tile_files, catalogue_file=None):
+    """ Build the catalogue of a list of tile files, which must share one resolution
+        and pixel grid, and save it to the catalogue file if given, with tile paths
+        relative to it. Return the catalogue, or None if a tile is invalid or off the
+        pixel grid of the first tile. """
+
+    if catalogue_file is not None:
+        directory = os.path.dirname(os.path.abspath(catalogue_file))
+    else:
+        directory = os.path.dirname(os.path.abspath(tile_files[0]))
+
+    tiles = []
+    geotransform = None
+    for tile_file in tile_files:
+        dataset = gdal.Open(tile_file)
+        if type(dataset) is not gdal.Dataset:
+            return None
+        tile_transform = dataset.GetGeoTransform()
+
+        if geotransform is None:
+            geotransform = list(tile_transform)
+            no_data_value = dataset.GetRasterBand(1).GetNoDataValue()
+            dtype = dataset.ReadAsArray(0, 0, 1, 1).dtype.name
+        elif (tile_transform[1] != geotransform[1]) or (tile_transform[5] != geotransform[5]):
+            return None
+
+        # Tiles must lie on the same pixel grid.
+        for axis, pixel in [(0, 1), (3, 5)]:
+            offset = (tile_transform[axis] - geotransform[axis]) / geotransform[pixel]
+            if abs(offset - round(offset)) > ALIGNMENT_TOLERANCE:
+                return None
+
+        tile = {}
+        tile['file'] = os.path.relpath(os.path.abspath(tile_file), directory)
+        tile['origin'] = [tile_transform[0], tile_transform[3]]
+        tile['size'] = [dataset.RasterXSize, dataset.RasterYSize]
+        tiles.append(tile)
+
+    # The mosaic starts at the top left corner of all tiles.
+    geotransform[0] = min(tile['origin'][0] for tile in tiles)
+    geotransform[3] = max(tile['origin'][1] for tile in tiles)
+
+    catalogue = {}
+    catalogue['geotransform'] = geotransform
+    catalogue['nodata'] = no_data_value
+    catalogue['dtype'] = dtype
+    catalogue['tiles'] = tiles
+
+    if catalogue_file is not None:
+        with open(catalogue_file, "w") as output_file:
+            json.dump(catalogue, output_file, indent=2)
+
+    catalogue['directory'] = directory
+
+    return catalogue
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit("Usage: python -m GeoData.raster_catalogue CATALOGUE_FILE TILE_FILE...")
+
+    if build_catalogue(sys.argv[2:], sys.argv[1]) is None:
+        sys.exit("Tiles not valid or not on one pixel grid.")
+    print("Catalogue of " + str(len(sys.argv) - 2) + " tiles written to " + sys.argv[1] + ".")
@@ -2,9 +2,13 @@ from __future__ import division, print_function
 
 import struct
 import sys
+import threading
+import numpy as np
 from osgeo import gdal
 
 DEFAULT_RASTER = "/mnt/Shared/OS5/Full/WGS.tif"
+POINT_BATCH_WINDOW = 256 # Points are read in windows within tiles of this many points square.
+ITERATION_BLOCK_SIZE = 1024
 
 class RasterReader:
     """ Interface for GDAL access of external
@@ -20,12 +24,22 @@ class RasterReader:
             self.log_error("Error, raster data from " + self.__raster_file + " is not valid.")
             sys.exit()
 
+        self.initialise_raster(self.__raster_file)
+
+
+    def initialise_raster(self, raster_file):
+        """ Check the opened raster and compute its corners and transforms, which
+            only need its size, geotransform and reads. """
+
         # Try to read the upper left corners to make sure that the rasters are not empty.
         test_read = self._raster.ReadRaster(0,0,1,1,buf_type=gdal.GDT_Float32)
         if (not self.validate_read(test_read)):
-            self.log_error("Error, the " + self.__raster_file + " raster is empty, cannot use that.")
+            self.log_error("Error, the " + raster_file + " raster is empty, cannot use that.")
             sys.exit()
 
+        # GDAL datasets are not thread-safe, so reads on a shared reader are serialised.
+        self._lock = threading.Lock()
+
         # Compute the corners of the raster.
         self.__corners = {}
         for raster_map in [self._raster]:
@@ -46,6 +60,15 @@ class RasterReader:
             self.__corners[object_id]['lower_right_corner'] = [corner_info[0] + raster_map.RasterXSize * corner_info[1], corner_info[3] + raster_map.RasterYSize * corner_info[5]]
             self.__corners[object_id]['center'] = [sum(e)/len(e) for e in zip(*[self.__corners[object_id]['upper_left_corner'], self.__corners[object_id]['lower_right_corner']])]
 
+        # Cache the geotransform and limits as attributes, saving lookups in transforms.
+        self._origin_x, self._pixel_x, _, self._origin_y, _, self._pixel_y = self._raster.GetGeoTransform()
+        self._size_x = self._raster.RasterXSize
+        self._size_y = self._raster.RasterYSize
+        self._min_x = self._origin_x
+        self._max_x = self._origin_x + self._size_x * self._pixel_x
+        self._max_y = self._origin_y
+        self._min_y = self._origin_y + self._size_y * self._pixel_y
+
 
     def read_point(self, coord_x, coord_y):
         """ Get data of a single point from the raster,
@@ -55,7 +78,8 @@ class RasterReader:
             return False
 
         index_x, index_y = self.coordinate_to_index(coord_x, coord_y)
-        data = self._raster.ReadRaster(index_x, index_y, 1, 1, buf_type=gdal.GDT_Float32)
+        with self._lock:
+            data = self._raster.ReadRaster(index_x, index_y, 1, 1, buf_type=gdal.GDT_Float32)
 
         if (self.validate_read(data)):
             return struct.unpack('f', data)[0]
@@ -95,36 +119,196 @@ class RasterReader:
         if (Nx > 9999) or (Ny > 9999):
             return []
 
-        data = self._raster.ReadAsArray(x1, y1, Nx, Ny)
+        with self._lock:
+            data = self._raster.ReadAsArray(x1, y1, Nx, Ny)
 
         return data # Two-dimensional array, rows of data.
 
 
+    def read_points_at(self, coords_x, coords_y):
+        """ Read the data of many single points at once, given arrays of their
+            coordinates. Points are grouped by the tiles of POINT_BATCH_WINDOW
+            points square they fall in, and read with one window per tile.
+            Return an array of floats, NaN for points outside the raster or
+            holding no data. """
+
+        coords_x = np.asarray(coords_x, dtype=float)
+        coords_y = np.asarray(coords_y, dtype=float)
+        data = np.full(coords_x.shape, np.nan)
+
+        indices_x, indices_y = self.coordinates_to_indices(coords_x, coords_y)
+
+        # Rounding can reach one past the far edges, as with single reads.
+        valid = self.check_access_windows(coords_x, coords_y) & (indices_x < self._size_x) & (indices_y < self._size_y)
+
+        points = np.nonzero(valid)
+        indices_x = indices_x[points]
+        indices_y = indices_y[points]
+
+        # Read the window spanning the points of each tile.
+        tiles = (indices_y // POINT_BATCH_WINDOW) * (self._size_x // POINT_BATCH_WINDOW + 1) + indices_x // POINT_BATCH_WINDOW
+        no_data_value = self.get_no_data_value()
+        values = np.empty(len(tiles))
+        for tile in np.unique(tiles):
+            in_tile = np.nonzero(tiles == tile)[0]
+            x1, y1 = np.amin(indices_x[in_tile]), np.amin(indices_y[in_tile])
+            xn, yn = np.amax(indices_x[in_tile]), np.amax(indices_y[in_tile])
+            with self._lock:
+                window = self._raster.ReadAsArray(int(x1), int(y1), int(xn - x1 + 1), int(yn - y1 + 1))
+            values[in_tile] = window[indices_y[in_tile] - y1, indices_x[in_tile] - x1]
+
+        if no_data_value is not None:
+            values[values == no_data_value] = np.nan
+        data[points] = values
+
+        return data
+
+
+    def read_points_resampled(self, initial_x, initial_y, end_x, end_y, size_x, size_y):
+        """ Read an area of the raster like read_points, resampled to size_x by size_y
+            points, for coarse views of areas too large to read in full. Return False
+            if request invalid. """
+
+        if not self.check_access_window(initial_x, initial_y):
+            return False
+
+        if not self.check_access_window(end_x, end_y):
+            return False
+
+        # Swap directions if necessary.
+        if initial_x > end_x:
+            initial_x, end_x = end_x, initial_x
+        if initial_y < end_y:
+            initial_y, end_y = end_y, initial_y
+
+        x1, y1 = self.coordinate_to_index(initial_x, initial_y)
+        xn, yn = self.coordinate_to_index(end_x, end_y)
+
+        if (not yn >= y1) or (not xn >= x1):
+            return False
+
+        with self._lock:
+            data = self._raster.ReadAsArray(x1, y1, xn - x1 + 1, yn - y1 + 1, buf_xsize=size_x, buf_ysize=size_y)
+
+        return data # Two-dimensional array, rows of data.
+
+
+    def read_window(self, index_x, index_y, size_x, size_y):
+        """ Read a window of the raster by indices of its top left corner, clipped
+            to the raster edges. Return False if the corner is outside the raster. """
+
+        if not ((0 <= index_x < self._raster.RasterXSize) and (0 <= index_y < self._raster.RasterYSize)):
+            return False
+
+        size_x = min(size_x, self._raster.RasterXSize - index_x)
+        size_y = min(size_y, self._raster.RasterYSize - index_y)
+
+        with self._lock:
+            data = self._raster.ReadAsArray(index_x, index_y, size_x, size_y)
+
+        return data # Two-dimensional array, rows of data.
+
+
+    def get_size(self):
+        """ Return the size (x, y) of the raster in points. """
+
+        return self._raster.RasterXSize, self._raster.RasterYSize
+
+
+    def shares_grid(self, other_reader):
+        """ Return True if another reader's raster has the same size and geotransform,
+            so that raster indices refer to the same points in both. """
+
+        return (self.get_size() == other_reader.get_size()) and (tuple(self._raster.GetGeoTransform()) == tuple(other_reader._raster.GetGeoTransform()))
+
+
     def read_full_raster(self):
         """ Read the entire raster. NOT TO BE USED LIVE, FOR STATIC COMPUTATION
             PURPOSES ONLY. """
 
-        data = self._raster.ReadAsArray(0, 0, self._raster.RasterXSize, self._raster.RasterYSize)
+        with self._lock:
+            data = self._raster.ReadAsArray(0, 0, self._raster.RasterXSize, self._raster.RasterYSize)
 
         return data
 
+
+    def iterate_blocks(self, block_size=ITERATION_BLOCK_SIZE, halo=0):
+        """ Generator over the whole raster in blocks of block_size points square,
+            aligned to multiples of block_size and clipped at the far edges, for
+            offline computations in constant memory. Each block is extended by halo
+            points on every side for neighbourhood operations, replicating the edge
+            points of the raster where the halo falls outside it. Yield tuples
+            (index_x, index_y, block) with the indices of the top left point of the
+            block without its halo. """
+
+        for index_y in range(0, self._size_y, block_size):
+            for index_x in range(0, self._size_x, block_size):
+                size_x = min(block_size, self._size_x - index_x)
+                size_y = min(block_size, self._size_y - index_y)
+                yield index_x, index_y, self.read_block(index_x, index_y, size_x, size_y, halo)
+
+
+    def read_block(self, index_x, index_y, size_x, size_y, halo=0):
+        """ Read a block of size_x by size_y points from indices (index_x, index_y)
+            within the raster, extended by halo points on every side replicating
+            the edge points of the raster where the halo falls outside it. """
+
+        # Read the block with as much of its halo as lies in the raster.
+        x1 = max(index_x - halo, 0)
+        y1 = max(index_y - halo, 0)
+        xn = min(index_x + size_x + halo, self._size_x)
+        yn = min(index_y + size_y + halo, self._size_y)
+        with self._lock:
+            block = self._raster.ReadAsArray(x1, y1, xn - x1, yn - y1)
+
+        if halo > 0:
+            block = np.pad(block, ((y1 - (index_y - halo), index_y + size_y + halo - yn), (x1 - (index_x - halo), index_x + size_x + halo - xn)), mode='edge')
+
+        return block
+
+
+    def get_no_data_value(self):
+        """ Return the value marking points without data, or None if not set. """
+
+        return self._raster.GetRasterBand(1).GetNoDataValue()
+
         
     def coordinate_to_index(self, coord_x, coord_y):
         """ Convert WGS84 coordinates into raster indices. """
 
-        transform_info = self.__corners[id(self._raster)]['corner_info']
-        x = int(round((coord_x - transform_info[0]) / transform_info[1]))
-        y = int(round((coord_y - transform_info[3]) / transform_info[5]))
+        x = int(round((coord_x - self._origin_x) / self._pixel_x))
+        y = int(round((coord_y - self._origin_y) / self._pixel_y))
 
         return x, y
 
 
+    def coordinates_to_indices(self, coords_x, coords_y):
+        """ Array version of coordinate_to_index, return a tuple (x, y) of
+            integer arrays of raster indices. """
+
+        with np.errstate(invalid='ignore'):
+            x = np.floor((np.asarray(coords_x, dtype=float) - self._origin_x) / self._pixel_x + 0.5)
+            y = np.floor((np.asarray(coords_y, dtype=float) - self._origin_y) / self._pixel_y + 0.5)
+
+        # Invalid coordinates become out of range indices rather than undefined ones.
+        return np.where(np.isfinite(x), x, -1).astype(int), np.where(np.isfinite(y), y, -1).astype(int)
+
+
     def index_to_coordinate(self, index_x, index_y):
         """ Convert raster indices into WGS84 coordinates. """
 
-        transform_info = self.__corners[id(self._raster)]['corner_info']
-        x = index_x * transform_info[1] + transform_info[0]
-        y = index_y * transform_info[5] + transform_info[3]
+        x = index_x * self._pixel_x + self._origin_x
+        y = index_y * self._pixel_y + self._origin_y
+
+        return x, y
+
+
+    def indices_to_coordinates(self, indices_x, indices_y):
+        """ Array version of index_to_coordinate, return a tuple (x, y) of
+            arrays of WGS84 coordinates. """
+
+        x = np.asarray(indices_x) * self._pixel_x + self._origin_x
+        y = np.asarray(indices_y) * self._pixel_y + self._origin_y
 
         return x, y
 
@@ -134,18 +318,24 @@ class RasterReader:
             access window, if not, return False; else, return
             True. """
 
-        try:
-            # If coordinate outside boundary, return False.
-            # Note that latitude is larger for smaller y's, and longitude is large for larger x's.
-            if (coord_x < self.__corners[id(self._raster)]['upper_left_corner'][0]) or (coord_x > self.__corners[id(self._raster)]['upper_right_corner'][0]):
-                return False
-            if (coord_y > self.__corners[id(self._raster)]['upper_left_corner'][1]) or (coord_y < self.__corners[id(self._raster)]['lower_left_corner'][1]):
-                return False
+        # If coordinate outside boundary, return False.
+        # Note that latitude is larger for smaller y's, and longitude is large for larger x's.
+        if (coord_x < self._min_x) or (coord_x > self._max_x):
+            return False
+        if (coord_y > self._max_y) or (coord_y < self._min_y):
+            return False
 
-            return True
+        return True
+
+
+    def check_access_windows(self, coords_x, coords_y):
+        """ Array version of check_access_window, return an array of booleans. """
 
-        except KeyError:
-            return False # The raster_id may not be valid.
+        coords_x = np.asarray(coords_x, dtype=float)
+        coords_y = np.asarray(coords_y, dtype=float)
+
+        with np.errstate(invalid='ignore'):
+            return (coords_x >= self._min_x) & (coords_x <= self._max_x) & (coords_y <= self._max_y) & (coords_y >= self._min_y)
 
 
     def get_limits(self, raster_id):
@@ -182,15 +372,29 @@ class RasterReader:
         """ Given a displacement of x and y number of points in the two directions,
             return a calculated coordinate. """
 
-        corner_info = self.__corners[id(self._raster)]['corner_info']
         if isinstance(x, int) and isinstance(y, int):
-            if (0 <= x < self._raster.RasterXSize) and (0 <= y < self._raster.RasterYSize):
-                return ((float(min(x_init, x_final) + x * corner_info[1]),
-                        float(max(y_init, y_final) + y * corner_info[5])))
+            if (0 <= x < self._size_x) and (0 <= y < self._size_y):
+                return ((float(min(x_init, x_final) + x * self._pixel_x),
+                        float(max(y_init, y_final) + y * self._pixel_y)))
 
         return (-1, -1)
 
 
+    def convert_displacements_to_coordinates(self, x_init, y_init, x_final, y_final, xs, ys):
+        """ Array version of convert_displacement_to_coordinate for integer arrays of
+            displacements, return a tuple (x, y) of arrays of coordinates, with -1 for
+            displacements outside the raster. """
+
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        valid = (xs >= 0) & (xs < self._size_x) & (ys >= 0) & (ys < self._size_y)
+
+        x = np.where(valid, min(x_init, x_final) + xs * self._pixel_x, -1)
+        y = np.where(valid, max(y_init, y_final) + ys * self._pixel_y, -1)
+
+        return x, y
+
+
     @classmethod
     def validate_read(self, data):
         """ Check if a returned data (type str) is valid, as GDAL does
@@ -226,6 +430,7 @@ if __name__ == "__main__":
         # Simple tests.
     print(reader.read_point(-4.0385629, 57.1513943))
     print(reader.read_point(-5.0135939038, 56.7982407347))
+    print(reader.read_points_at([-4.0385629, -5.0135939038, 0.0], [57.1513943, 56.7982407347, 0.0]))
     print(reader.read_points(-4.0385629, 57.1513943, -3.9985629, 57.1213943))
     print(reader.read_points(-3.9985629, 57.1213943, -4.0385629, 57.1513943))
     print(reader.locate_index((-3.9985629, 57.1213943), (-4.0385629, 57.1513943), (-4.01, 57.13)))
@@ -0,0 +1,322 @@
+###############################################################
+# Streaming statistics over whole rasters, reading them block
+# by block with RasterReader.iterate_blocks so that memory use
+# does not grow with the raster. Points holding the no data
+# value or NaN are left out of all statistics. Percentiles can
+# be stored beside a raster, for rasters.load_raster_percentiles
+# to load at startup instead of reading the raster again:
+#   python -m GeoData.raster_statistics [raster_file] [--store]
+###############################################################
+
+from __future__ import division, print_function
+
+import os
+import sys
+import json
+import numpy as np
+
+from GeoData import raster_reader, rasters
+
+STATISTICS_BLOCK_SIZE = raster_reader.ITERATION_BLOCK_SIZE
+APPROXIMATE_BINS = 65536
+REFINEMENT_BINS = 4096
+COLLECT_LIMIT = 1000000 # Largest number of values collected in memory to pick an exact percentile.
+SKETCH_SIZE = 16384 # Values kept at the top level of a quantile sketch, for rank errors around 0.01%.
+SKETCH_SEED = 0
+STORED_PERCENTILES = list(range(70, 100)) + [99.5, 99.9] # Model evaluation thresholds, and the risk normalisation bound.
+
+
+def iterate_values(reader, block_size=STATISTICS_BLOCK_SIZE):
+    """ Generator over the valid values of a raster, as a flat array for each block. """
+
+    no_data_value = reader.get_no_data_value()
+    for index_x, index_y, block in reader.iterate_blocks(block_size):
+        values = block.ravel()
+        valid = ~np.isnan(values)
+        if no_data_value is not None:
+            valid &= (values != no_data_value)
+        yield values[valid]
+
+
+def raster_count_min_max(reader, block_size=STATISTICS_BLOCK_SIZE):
+    """ Return a tuple (count, minimum, maximum) of the valid values of a raster,
+        with None as the minimum and maximum if there are none. """
+
+    count = 0
+    minimum = None
+    maximum = None
+    for values in iterate_values(reader, block_size):
+        if len(values) == 0:
+            continue
+        count += len(values)
+        minimum = np.amin(values) if minimum is None else min(minimum, np.amin(values))
+        maximum = np.amax(values) if maximum is None else max(maximum, np.amax(values))
+
+    return count, minimum, maximum
+
+
+def raster_histogram(reader, bins, value_range=None, block_size=STATISTICS_BLOCK_SIZE):
+    """ Return a tuple (counts, bin edges) of a histogram of the values of a raster
+        as np.histogram would, with value_range (minimum, maximum) found in an extra
+        pass over the raster if not given. """
+
+    if value_range is None:
+        count, minimum, maximum = raster_count_min_max(reader, block_size)
+        value_range = (minimum, maximum) if count > 0 else (0, 1)
+
+    counts = np.zeros(bins, dtype=np.int64)
+    for values in iterate_values(reader, block_size):
+        counts += np.histogram(values, bins, range=value_range)[0]
+
+    return counts, np.linspace(value_range[0], value_range[1], bins + 1)
+
+
+def raster_percentiles(reader, percentiles, exact=True, block_size=STATISTICS_BLOCK_SIZE):
+    """ Return a list of percentiles of the values of a raster. Exact percentiles
+        equal those of np.percentile on all values, and take several passes: one for
+        the value range, then histograms narrowing down the values at the ranks
+        needed until few enough of them remain to be collected and sorted. Otherwise
+        percentiles are interpolated within the bins of one fine histogram. Return
+        None if the raster has no valid values. """
+
+    count, minimum, maximum = raster_count_min_max(reader, block_size)
+    if count == 0:
+        return None
+
+    if not exact:
+        counts, edges = raster_histogram(reader, APPROXIMATE_BINS, (minimum, maximum), block_size)
+        return [interpolate_histogram(counts, edges, p / 100 * count) for p in percentiles]
+
+    # Interpolate between the values at the ranks either side, as np.percentile does.
+    positions = [p / 100 * (count - 1) for p in percentiles]
+    ranks = sorted(set([int(np.floor(p)) for p in positions] + [int(np.ceil(p)) for p in positions]))
+    rank_values = find_rank_values(reader, ranks, minimum, maximum, block_size)
+
+    results = []
+    for position in positions:
+        lower = rank_values[int(np.floor(position))]
+        upper = rank_values[int(np.ceil(position))]
+        results.append(lower + (upper - lower) * (position - np.floor(position)))
+
+    return results
+
+
+def find_rank_values(reader, ranks, minimum, maximum, block_size=STATISTICS_BLOCK_SIZE):
+    """ Return a dictionary of the values at ranks in the sorted values of a raster.
+        Each rank is tracked by an interval [low, high) of values holding it, closed
+        if high is the maximum, and the number of values below the interval, which
+        is narrowed with a histogram pass until it can be collected. """
+
+    intervals = dict((rank, (minimum, maximum, True, 0)) for rank in ranks)
+    rank_values = {}
+
+    while intervals:
+        # Narrow down intervals holding too many values to collect.
+        counts = dict((rank, 0) for rank in intervals)
+        histograms = dict((rank, np.zeros(REFINEMENT_BINS, dtype=np.int64)) for rank in intervals)
+        edges = dict((rank, np.linspace(intervals[rank][0], intervals[rank][1], REFINEMENT_BINS + 1)) for rank in intervals)
+        for values in iterate_values(reader, block_size):
+            for rank in intervals:
+                in_interval = values[interval_mask(values, intervals[rank])]
+                counts[rank] += len(in_interval)
+                bin_indices = np.minimum(np.searchsorted(edges[rank], in_interval, side='right') - 1, REFINEMENT_BINS - 1)
+                histograms[rank] += np.bincount(bin_indices, minlength=REFINEMENT_BINS)
+
+        collect = {}
+        for rank in list(intervals):
+            low, high, closed, below = intervals[rank]
+            if (counts[rank] <= COLLECT_LIMIT) or (low == high):
+                collect[rank] = intervals.pop(rank)
+                continue
+
+            # Move into the bin holding the rank, unless the bins can no longer be split.
+            bin_index = int(np.searchsorted(np.cumsum(histograms[rank]), rank - below, side='right'))
+            bin_low = edges[rank][bin_index]
+            bin_high = edges[rank][bin_index + 1]
+            if (bin_low >= bin_high) or ((bin_low == low) and (bin_high == high)):
+                collect[rank] = intervals.pop(rank)
+                continue
+            intervals[rank] = (bin_low, bin_high, closed and (bin_index == REFINEMENT_BINS - 1), below + int(np.sum(histograms[rank][:bin_index])))
+
+        # Collect the distinct values of small intervals and their counts to pick their ranks.
+        # Intervals which could not be split further hold few distinct values, however many.
+        if collect:
+            collected = dict((rank, ([], [])) for rank in collect)
+            for values in iterate_values(reader, block_size):
+                for rank in collect:
+                    distinct_values, distinct_counts = np.unique(values[interval_mask(values, collect[rank])], return_counts=True)
+                    collected[rank][0].append(distinct_values)
+                    collected[rank][1].append(distinct_counts)
+            for rank in collect:
+                distinct_values, inverse = np.unique(np.concatenate(collected[rank][0]), return_inverse=True)
+                if len(distinct_values) == 0:
+                    rank_values[rank] = collect[rank][0]
+                    continue
+                cumulative = np.cumsum(np.bincount(inverse, weights=np.concatenate(collected[rank][1])))
+                rank_values[rank] = distinct_values[min(int(np.searchsorted(cumulative, rank - collect[rank][3], side='right')), len(distinct_values) - 1)]
+
+    return rank_values
+
+
+def raster_sketch_percentiles(reader, percentiles, size=SKETCH_SIZE, block_size=STATISTICS_BLOCK_SIZE):
+    """ Return a list of percentiles of the values of a raster estimated by a
+        quantile sketch in one pass, or None if it has no valid values. """
+
+    sketch = QuantileSketch(size)
+    for values in iterate_values(reader, block_size):
+        sketch.update(values)
+
+    if sketch.count() == 0:
+        return None
+
+    return sketch.quantiles([p / 100 for p in percentiles])
+
+
+def store_percentiles(raster_file, percentiles, exact=False, block_size=STATISTICS_BLOCK_SIZE):
+    """ Compute percentiles of a raster, with a quantile sketch unless exact, and
+        store them beside it with those already stored for the same raster file.
+        Return a tuple (result, message). """
+
+    reader = raster_reader.RasterReader(raster_file)
+    if exact:
+        values = raster_percentiles(reader, percentiles, True, block_size)
+    else:
+        values = raster_sketch_percentiles(reader, percentiles, block_size=block_size)
+    if values is None:
+        return False, "Raster " + raster_file + " has no valid values."
+
+    stored = rasters.load_raster_percentiles(raster_file)
+    stored.update(zip([float(p) for p in percentiles], [float(v) for v in values]))
+
+    statistics = {}
+    statistics['raster_size'] = os.path.getsize(raster_file)
+    statistics['raster_modified'] = os.path.getmtime(raster_file)
+    statistics['method'] = "exact" if exact else "sketch"
+    statistics['percentiles'] = dict(("%g" % p, v) for p, v in stored.items())
+    with open(raster_file + rasters.STATISTICS_SUFFIX, "w") as statistics_json:
+        json.dump(statistics, statistics_json, indent=2, sort_keys=True)
+
+    return True, "Stored " + str(len(percentiles)) + " percentiles of " + raster_file + "."
+
+
+def load_percentiles(raster_file, percentiles):
+    """ Return a list of percentiles of a raster as stored beside it, computing
+        and storing any missing first. """
+
+    stored = rasters.load_raster_percentiles(raster_file)
+    missing = [p for p in percentiles if float(p) not in stored]
+    if missing:
+        stored_missing, message = store_percentiles(raster_file, missing)
+        if not stored_missing:
+            return None
+        stored = rasters.load_raster_percentiles(raster_file)
+
+    return [stored[float(p)] for p in percentiles]
+
+
+class QuantileSketch:
+    """ Streaming quantile sketch of Karnin, Lang and Liberty (2016). Values
+        are kept in levels, each value at level h standing for 2^h of those
+        added. A level over its capacity is sorted and every other value, from
+        a random first, is moved up a level, so memory stays bounded by a few
+        times size, while ranks are estimated to within about 1/size of the
+        count. Capacities shrink by 2/3 a level down from the top. """
+
+    def __init__(self, size=SKETCH_SIZE, seed=SKETCH_SEED):
+
+        self._size = size
+        self._levels = [np.empty(0)]
+        self._count = 0
+        self._random = np.random.RandomState(seed)
+
+
+    def update(self, values):
+        """ Add an array of values to the sketch. """
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self._count += len(values)
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self.compress()
+
+
+    def compress(self):
+        """ Compact levels over their capacity, from the bottom up. """
+
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            if len(items) > self.capacity(level):
+                if level == len(self._levels) - 1:
+                    self._levels.append(np.empty(0))
+                items = np.sort(items)
+                kept = len(items) % 2 # An odd value out stays on this level.
+                self._levels[level + 1] = np.concatenate([self._levels[level + 1], items[kept + self._random.randint(2)::2]])
+                self._levels[level] = items[:kept]
+            level += 1
+
+
+    def capacity(self, level):
+        """ Return the number of values a level holds before it is compacted. """
+
+        return max(int(np.ceil(self._size * (2 / 3) ** (len(self._levels) - 1 - level))), 2)
+
+
+    def count(self):
+        """ Return the number of values added to the sketch. """
+
+        return self._count
+
+
+    def quantiles(self, fractions):
+        """ Return a list of the estimated values at fractions (0 to 1) of the
+            sorted values added, or None if there are none. """
+
+        if self._count == 0:
+            return None
+
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level, dtype=np.float64) for level, items in enumerate(self._levels)])
+        order = np.argsort(values, kind='mergesort')
+        values = values[order]
+        cumulative = np.cumsum(weights[order])
+
+        indices = np.searchsorted(cumulative, np.asarray(fractions, dtype=np.float64) * cumulative[-1], side='left')
+
+        return [float(v) for v in values[np.minimum(indices, len(values) - 1)]]
+
+
+def interval_mask(values, interval):
+    """ Return a mask of the values in an interval (low, high, closed, below). """
+
+    low, high, closed, below = interval
+    if closed:
+        return (values >= low) & (values <= high)
+
+    return (values >= low) & (values < high)
+
+
+def interpolate_histogram(counts, edges, rank):
+    """ Return the value at a rank in a histogram, assuming the values are spread
+        evenly within each bin. """
+
+    cumulative = np.cumsum(counts)
+    bin_index = min(int(np.searchsorted(cumulative, rank, side='right')), len(counts) - 1)
+    below = cumulative[bin_index - 1] if bin_index > 0 else 0
+    fraction = (rank - below) / counts[bin_index] if counts[bin_index] > 0 else 0
+
+    return edges[bin_index] + (edges[bin_index + 1] - edges[bin_index]) * min(fraction, 1)
+
+
+if __name__ == '__main__':
+    arguments = [a for a in sys.argv[1:] if a != "--store"]
+    raster_file = arguments[0] if arguments else rasters.RISK_RASTER
+    if "--store" in sys.argv:
+        stored, message = store_percentiles(raster_file, STORED_PERCENTILES)
+        print(message)
+        sys.exit(0 if stored else 1)
+
+    reader = raster_reader.RasterReader(raster_file)
+    print("Count, minimum, maximum: " + str(raster_count_min_max(reader)))
+    print("Percentiles 70, 95, 99, 99.9: " + str(raster_percentiles(reader, [70, 95, 99, 99.9])))
+    print("Approximate percentiles 70, 95, 99, 99.9: " + str(raster_percentiles(reader, [70, 95, 99, 99.9], exact=False)))
+    print("Sketched percentiles 70, 95, 99, 99.9: " + str(raster_sketch_percentiles(reader, [70, 95, 99, 99.9])))
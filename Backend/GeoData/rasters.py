@@ -1,6 +1,37 @@
+import os
+import json
+
 HEIGHT_RASTER = "/mnt/Shared/OS5/Full/WGS.tif"
 ASPECT_RASTER = "/mnt/Shared/OS5/Full/WGSAspects.tif"
+SLOPE_RASTER = "/mnt/Shared/OS5/Full/WGSSlope.tif"
+CURVATURE_RASTER = "/mnt/Shared/OS5/Full/WGSCurvature.tif"
 CONTOUR_RASTER = "/mnt/Shared/OS5/Full/WGS_Map.tif"
 RISK_RASTER = "/mnt/Shared/OS5/Full/WGSStaticRisk.tif"
+ROUGHNESS_RASTER = "/mnt/Shared/OS5/Full/WGSRoughness.tif"
+STATISTICS_SUFFIX = ".stats.json" # Percentiles of a raster are stored in its file name with this appended.
+RISK_RASTER_MAX_PERCENTILE = 99
+
+
+def load_raster_percentiles(raster_file):
+    """ Return a dictionary of the percentiles of a raster stored beside it by
+        raster_statistics.store_percentiles, by percentile, or an empty one if
+        none are stored or the raster has changed since. """
+
+    statistics_file = raster_file + STATISTICS_SUFFIX
+    if (not os.path.isfile(raster_file)) or (not os.path.isfile(statistics_file)):
+        return {}
+
+    try:
+        with open(statistics_file, "r") as statistics_json:
+            statistics = json.load(statistics_json)
+    except ValueError:
+        return {}
+
+    if (statistics.get('raster_size') != os.path.getsize(raster_file)) or (statistics.get('raster_modified') != os.path.getmtime(raster_file)):
+        return {}
+
+    return dict((float(p), v) for p, v in statistics['percentiles'].items())
+
+
 RISK_RASTER_MIN = 0
-RISK_RASTER_MAX = 0.0913755 # 99 percentile for the current raster.
+RISK_RASTER_MAX = load_raster_percentiles(RISK_RASTER).get(RISK_RASTER_MAX_PERCENTILE, 0.0913755) # Stored 99 percentile of the current raster, or the last one found by hand.
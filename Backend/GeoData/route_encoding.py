@@ -0,0 +1,175 @@
+###############################################################
+# Compact encodings of paths returned by the path finder, with
+# optional Douglas-Peucker simplification in metres. Paths are
+# dictionaries of way points keyed by their order in the path,
+# holding long, lat, height and risk as strings.
+###############################################################
+
+from __future__ import division
+
+from math import cos, radians, sqrt
+
+ROUTE_FORMATS = ['dict', 'compact', 'polyline']
+POLYLINE_PRECISION = 5 # Decimal places of coordinates, 5 being about 1 metre.
+COMPACT_PRECISION = 6
+HEIGHT_PRECISION = 1
+RISK_PRECISION = 4
+METRES_PER_DEGREE = 111320
+
+
+def path_to_lists(path):
+    """ Convert a path dictionary into a tuple of lists (longitudes, latitudes,
+        heights, risks) as numbers, in path order. Risks are None for paths
+        without risk attached. """
+
+    way_points = [path[p] for p in sorted(path.keys(), key=int)]
+
+    longitudes = [float(w['long']) for w in way_points]
+    latitudes = [float(w['lat']) for w in way_points]
+    heights = [float(w['height']) for w in way_points]
+    risks = [float(w['risk']) if 'risk' in w else None for w in way_points]
+
+    return longitudes, latitudes, heights, risks
+
+
+def simplify(longitudes, latitudes, tolerance):
+    """ Douglas-Peucker simplification of a line, keeping every point further
+        than tolerance metres from the simplified line. Coordinates are projected
+        onto a local flat plane, which is accurate enough at path scales. Return
+        the sorted indices of the points kept. """
+
+    count = len(longitudes)
+    if (count <= 2) or (tolerance <= 0):
+        return range(count)
+
+    scale_x = METRES_PER_DEGREE * cos(radians(sum(latitudes) / count))
+    xs = [l * scale_x for l in longitudes]
+    ys = [l * METRES_PER_DEGREE for l in latitudes]
+
+    keep = [False] * count
+    keep[0] = True
+    keep[-1] = True
+
+    # Iterate with a stack, as long paths would exceed the recursion limit.
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        dx = xs[last] - xs[first]
+        dy = ys[last] - ys[first]
+        length = sqrt(dx ** 2 + dy ** 2)
+
+        furthest = None
+        furthest_distance = tolerance
+        for i in range(first + 1, last):
+            if length > 0:
+                distance = abs(dy * (xs[i] - xs[first]) - dx * (ys[i] - ys[first])) / length
+            else:
+                distance = sqrt((xs[i] - xs[first]) ** 2 + (ys[i] - ys[first]) ** 2)
+            if distance > furthest_distance:
+                furthest = i
+                furthest_distance = distance
+
+        if furthest is not None:
+            keep[furthest] = True
+            stack.append((first, furthest))
+            stack.append((furthest, last))
+
+    return [i for i in range(count) if keep[i]]
+
+
+def encode_polyline(longitudes, latitudes, precision=POLYLINE_PRECISION):
+    """ Encode coordinates with the Google encoded polyline algorithm, which
+        stores the differences between successive points as variable length
+        integers in printable characters, latitude first. """
+
+    factor = 10 ** precision
+    encoded = []
+    previous_lat = 0
+    previous_long = 0
+
+    for p in range(len(longitudes)):
+        lat = int(round(latitudes[p] * factor))
+        lng = int(round(longitudes[p] * factor))
+
+        for delta in (lat - previous_lat, lng - previous_long):
+            value = ~(delta << 1) if delta < 0 else (delta << 1)
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+
+        previous_lat = lat
+        previous_long = lng
+
+    return "".join(encoded)
+
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    """ Decode an encoded polyline, return a tuple of lists (longitudes, latitudes). """
+
+    factor = 10 ** precision
+    values = []
+    index = 0
+
+    while index < len(encoded):
+        result = 0
+        shift = 0
+        while True:
+            byte = ord(encoded[index]) - 63
+            index += 1
+            result |= (byte & 0x1f) << shift
+            shift += 5
+            if byte < 0x20:
+                break
+        values.append(~(result >> 1) if result & 1 else (result >> 1))
+
+    latitudes = []
+    longitudes = []
+    lat = 0
+    lng = 0
+    for p in range(0, len(values), 2):
+        lat += values[p]
+        lng += values[p + 1]
+        latitudes.append(lat / factor)
+        longitudes.append(lng / factor)
+
+    return longitudes, latitudes
+
+
+def encode_path(path, route_format='dict', tolerance=0):
+    """ Encode a path dictionary in one of ROUTE_FORMATS after simplifying it with
+        a tolerance in metres. The dict format keeps the path dictionary, while the
+        compact format holds a flat [long, lat, long, lat, ...] list and the polyline
+        format an encoded polyline, both with lists of heights and risks as numbers.
+        Return None for an unknown format. """
+
+    if route_format not in ROUTE_FORMATS:
+        return None
+
+    longitudes, latitudes, heights, risks = path_to_lists(path)
+    kept = simplify(longitudes, latitudes, tolerance)
+
+    if route_format == 'dict':
+        keys = sorted(path.keys(), key=int)
+        return_path = {}
+        for p in range(len(kept)):
+            return_path[p] = path[keys[kept[p]]]
+        return return_path
+
+    encoded = {}
+    encoded['format'] = route_format
+    encoded['count'] = len(kept)
+    encoded['height'] = [round(heights[i], HEIGHT_PRECISION) for i in kept]
+    encoded['risk'] = [round(risks[i], RISK_PRECISION) if risks[i] is not None else None for i in kept]
+
+    if route_format == 'compact':
+        coordinates = []
+        for i in kept:
+            coordinates.append(round(longitudes[i], COMPACT_PRECISION))
+            coordinates.append(round(latitudes[i], COMPACT_PRECISION))
+        encoded['coordinates'] = coordinates
+    else:
+        encoded['polyline'] = encode_polyline([longitudes[i] for i in kept], [latitudes[i] for i in kept])
+        encoded['precision'] = POLYLINE_PRECISION
+
+    return encoded
@@ -0,0 +1,288 @@
+###############################################################
+# Static risk computation over whole rasters, replacing the
+# row by row loop of Computations/static_risk.m. The slope,
+# aspect and curvature rasters are read in blocks with a halo
+# of one point, the slope, curvature and roughness risks are
+# computed with array operations on each block in a pool of
+# processes, and written to a tiled GeoTIFF by block_pipeline.
+# The roughness is the intended 3x3 Veitinger roughness. The
+# loop of static_risk.m never advances current_position, so the
+# shipped RISK_RASTER took the roughness of the (x+1, y+1)
+# neighbour's normal and eight vertical ones. Rasters computed
+# here therefore differ from it, and its stored percentiles and
+# the model thresholds must be regenerated with them. With
+# --matlab-compatible, that roughness is reproduced instead.
+# Run from the Backend directory:
+#   python -m GeoData.static_risk {output_file} [processes] [--full] [--matlab-compatible]
+#   python -m GeoData.static_risk --check
+# A checksum of the inputs of each block, halo included, is
+# kept beside the output, and on later runs only blocks whose
+# inputs changed are recomputed and patched into the output,
+# unless --full is given. Percentiles of the output are then
+# stored beside it. The check compares the output on
+# synthetic terrain against a direct transcription of the
+# MATLAB formulas, before and after changing a patch of it, and
+# in the compatible mode against a transcription of its loop.
+###############################################################
+
+from __future__ import division, print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from math import cos, sin, sqrt, radians
+from osgeo import gdal
+
+from GeoData import block_pipeline, raster_statistics, rasters
+
+# Model parameters, as in Computations/*_risk.m.
+SLOPE_RISK_CENTRE = 42.5
+SLOPE_RISK_WIDTH = 8
+SLOPE_RISK_POWER = 6
+SLOPE_RISK_INTEGRAL = 16.7546
+CURVATURE_RISK_OFFSET = 0.5
+CURVATURE_RISK_SCALE = 1
+ROUGHNESS_RISK_OFFSET = 0.005
+ROUGHNESS_RISK_WIDTH = 0.01
+ROUGHNESS_RISK_POWER = 4
+ROUGHNESS_RISK_INTEGRAL = 0.0062
+ROUGHNESS_WINDOW = 9 # Points in the 3x3 neighbourhood of each point.
+
+CHECK_SIZE = (300, 220) # Points (x, y) of the synthetic terrain, not multiples of the block size.
+CHECK_BLOCK_SIZE = 64
+CHECK_PROCESSES = 2
+CHECK_TOLERANCE = 1e-5 # Relative, the output is single precision.
+CHECK_SEED = 0
+CHECK_CHANGE = (slice(100, 110), slice(120, 128)) # Rows and columns changed between check runs, next to a block edge.
+
+
+def slope_risk(slopes, centre=SLOPE_RISK_CENTRE, width=SLOPE_RISK_WIDTH, power=SLOPE_RISK_POWER):
+    """ Return the risk of an array of slopes in degrees. """
+
+    return 1 / (1 + ((slopes - centre) / width) ** power) / SLOPE_RISK_INTEGRAL
+
+
+def curvature_risk(curvatures, offset=CURVATURE_RISK_OFFSET, scale=CURVATURE_RISK_SCALE):
+    """ Return the risk of an array of curvatures, with NaN counted as flat. """
+
+    curvatures = np.where(np.isnan(curvatures), 0, curvatures)
+
+    return np.clip(scale * curvatures ** 3 + offset, 0, 1)
+
+
+def roughness_risk(roughnesses, offset=ROUGHNESS_RISK_OFFSET, width=ROUGHNESS_RISK_WIDTH, power=ROUGHNESS_RISK_POWER):
+    """ Return the risk of an array of roughnesses. """
+
+    return 1 / (1 + ((roughnesses + offset) / width) ** power) / ROUGHNESS_RISK_INTEGRAL
+
+
+def roughness(slopes, aspects, matlab_compatible=False):
+    """ Return the roughness (Veitinger and Sovilla, 2016) of the points of
+        blocks of slopes and aspects in degrees with a halo of one point, from the
+        vector sum of the normals in the 3x3 neighbourhood of each point. If
+        matlab_compatible, the neighbourhood is the (x+1, y+1) neighbour and eight
+        vertical normals instead, as static_risk.m computed it. """
+
+    slopes = np.radians(np.where(slopes < 0, 0, slopes))
+    aspects = np.radians(np.where(aspects < 0, 0, aspects))
+    normals = [np.sin(slopes) * np.cos(aspects), np.sin(slopes) * np.sin(aspects), np.cos(slopes)]
+
+    size_y = slopes.shape[0] - 2
+    size_x = slopes.shape[1] - 2
+    squared_sum = np.zeros((size_y, size_x))
+    for n, normal in enumerate(normals):
+        if matlab_compatible:
+            total = normal[2:, 2:] + (ROUGHNESS_WINDOW - 1 if n == 2 else 0)
+        else:
+            total = np.zeros((size_y, size_x))
+            for offset_y in range(3):
+                for offset_x in range(3):
+                    total += normal[offset_y:offset_y + size_y, offset_x:offset_x + size_x]
+        squared_sum += total ** 2
+
+    return 1 - np.sqrt(squared_sum) / ROUGHNESS_WINDOW
+
+
+def static_risk_block(slopes, aspects, curvatures, matlab_compatible=False):
+    """ Return the static risk of the points of blocks of slopes, aspects and
+        curvatures with a halo of one point, as the product of their risks. """
+
+    slopes = slopes.astype(np.float64)
+    aspects = aspects.astype(np.float64)
+    curvatures = curvatures.astype(np.float64)
+
+    return slope_risk(slopes[1:-1, 1:-1]) * curvature_risk(curvatures[1:-1, 1:-1]) * roughness_risk(roughness(slopes, aspects, matlab_compatible))
+
+
+def roughness_block(slopes, aspects, matlab_compatible=False):
+    """ Return the roughness of the points of blocks of slopes and aspects with a
+        halo of one point, the only factor of the model needing neighbours. """
+
+    return roughness(slopes.astype(np.float64), aspects.astype(np.float64), matlab_compatible)
+
+
+def roughness_keywords(matlab_compatible):
+    """ Return the keywords of the block functions for a roughness mode, none for
+        the default so that the checksums of earlier outputs still apply. """
+
+    return {'matlab_compatible': True} if matlab_compatible else None
+
+
+def compute_static_risk(output_file=rasters.RISK_RASTER, slope_file=rasters.SLOPE_RASTER, aspect_file=rasters.ASPECT_RASTER, curvature_file=rasters.CURVATURE_RASTER, block_size=block_pipeline.BLOCK_SIZE, processes=None, incremental=True, matlab_compatible=False):
+    """ Compute the static risk raster from the slope, aspect and curvature rasters,
+        recomputing only blocks whose inputs changed since the last run if incremental.
+        If matlab_compatible, the roughness is computed as static_risk.m did. """
+
+    return block_pipeline.run_block_pipeline([slope_file, aspect_file, curvature_file], [output_file], static_risk_block, 1, block_size, processes, incremental, keywords=roughness_keywords(matlab_compatible))
+
+
+def compute_roughness(output_file=rasters.ROUGHNESS_RASTER, slope_file=rasters.SLOPE_RASTER, aspect_file=rasters.ASPECT_RASTER, block_size=block_pipeline.BLOCK_SIZE, processes=None, incremental=True, matlab_compatible=False):
+    """ Compute the roughness raster from the slope and aspect rasters, for
+        evaluating the static risk point by point with other parameters. """
+
+    return block_pipeline.run_block_pipeline([slope_file, aspect_file], [output_file], roughness_block, 1, block_size, processes, incremental, keywords=roughness_keywords(matlab_compatible))
+
+
+def reference_static_risk(slopes, aspects, curvatures, matlab_compatible=False):
+    """ Compute the static risk of whole arrays point by point with the formulas of
+        the *_risk.m files, over the intended 3x3 neighbourhoods. If matlab_compatible,
+        transcribe the loops of Computations/static_risk.m instead, which fill only the
+        first of the nine neighbour slots. """
+
+    size_y, size_x = slopes.shape
+    risks = np.zeros((size_y, size_x))
+    for y in range(size_y):
+        for x in range(size_x):
+            slope = float(slopes[y, x])
+            slope_value = 1 / (1 + ((slope - 42.5) / 8) ** 6) / 16.7546
+
+            curvature = 0 if np.isnan(curvatures[y, x]) else float(curvatures[y, x])
+            curvature_value = min(max(curvature ** 3 + 0.5, 0), 1)
+
+            # Repeat sides when getting neighbours.
+            neighbours = [(0.0, 0.0)] * ROUGHNESS_WINDOW
+            current_position = 0
+            for i in range(x - 1, x + 2):
+                for j in range(y - 1, y + 2):
+                    ix = min(max(i, 0), size_x - 1)
+                    iy = min(max(j, 0), size_y - 1)
+                    neighbours[current_position] = (float(slopes[iy, ix]), float(aspects[iy, ix]))
+                    if not matlab_compatible:
+                        current_position += 1
+
+            sum_x = sum_y = sum_z = 0
+            for neighbour_slope, neighbour_aspect in neighbours:
+                neighbour_slope = radians(max(neighbour_slope, 0))
+                neighbour_aspect = radians(max(neighbour_aspect, 0))
+                sum_x += sin(neighbour_slope) * cos(neighbour_aspect)
+                sum_y += sin(neighbour_slope) * sin(neighbour_aspect)
+                sum_z += cos(neighbour_slope)
+            roughness = 1 - sqrt(sum_x ** 2 + sum_y ** 2 + sum_z ** 2) / 9
+            roughness_value = 1 / (1 + ((roughness + 0.005) / 0.01) ** 4) / 0.0062
+
+            risks[y, x] = slope_value * curvature_value * roughness_value
+
+    return risks
+
+
+def compare_with_reference(output, slopes, aspects, curvatures, matlab_compatible=False):
+    """ Compare an output with the reference on the single precision inputs written.
+        Return a tuple (passed, message). """
+
+    reference = reference_static_risk(slopes.astype(np.float32), aspects.astype(np.float32), curvatures.astype(np.float32), matlab_compatible)
+    if not np.array_equal(np.isnan(output), np.isnan(reference)):
+        return False, "Output differs from the reference in points without a risk."
+    difference = np.nanmax(np.abs(output - reference) / np.maximum(np.abs(reference), 1e-12))
+    if difference > CHECK_TOLERANCE:
+        return False, "Output differs from the reference by up to " + str(difference) + " relative."
+
+    return True, "Output matches the reference within " + str(difference) + " relative."
+
+
+def check_against_reference():
+    """ Compute the static risk of synthetic terrain through the block pipeline
+        and compare it with the reference, then change a patch of the slopes and
+        check that only the blocks reading it are recomputed, and the output still
+        matches. Return a tuple (passed, message). """
+
+    generator = np.random.RandomState(CHECK_SEED)
+    grid_y, grid_x = np.mgrid[0:CHECK_SIZE[1], 0:CHECK_SIZE[0]]
+    slopes = 40 + 20 * np.sin(grid_x / 17.0) * np.cos(grid_y / 23.0) + generator.normal(0, 4, grid_x.shape)
+    aspects = (np.degrees(np.arctan2(np.sin(grid_y / 31.0), np.cos(grid_x / 29.0))) + generator.normal(0, 10, grid_x.shape)) % 360
+    curvatures = generator.normal(0, 0.6, grid_x.shape)
+    slopes[:5, :] = -1 # Edges without data, as in the slope rasters.
+    aspects[:, :5] = -1
+    curvatures[100:120, 50:90] = np.nan
+
+    directory = tempfile.mkdtemp()
+    try:
+        files = [os.path.join(directory, n + ".tif") for n in ["slope", "aspect", "curvature"]]
+        for file_name, values in zip(files, [slopes, aspects, curvatures]):
+            block_pipeline.write_raster(file_name, values)
+        output_file = os.path.join(directory, "risk.tif")
+
+        computed, message = compute_static_risk(output_file, files[0], files[1], files[2], CHECK_BLOCK_SIZE, CHECK_PROCESSES)
+        if not computed:
+            return False, message
+        passed, message = compare_with_reference(gdal.Open(output_file).ReadAsArray(), slopes, aspects, curvatures)
+        if not passed:
+            return False, message
+
+        # Change a patch of slopes, which blocks read if it lies within their halo.
+        slopes[CHECK_CHANGE] += 5
+        block_pipeline.write_raster(files[0], slopes)
+        rows = range(CHECK_SIZE[1])[CHECK_CHANGE[0]]
+        columns = range(CHECK_SIZE[0])[CHECK_CHANGE[1]]
+        changed_y = set(y // CHECK_BLOCK_SIZE for r in rows for y in [r - 1, r, r + 1] if 0 <= y < CHECK_SIZE[1])
+        changed_x = set(x // CHECK_BLOCK_SIZE for c in columns for x in [c - 1, c, c + 1] if 0 <= x < CHECK_SIZE[0])
+        expected = len(changed_x) * len(changed_y)
+
+        computed, message = compute_static_risk(output_file, files[0], files[1], files[2], CHECK_BLOCK_SIZE, CHECK_PROCESSES)
+        if not computed:
+            return False, message
+        if not message.startswith("Computed " + str(expected) + " of "):
+            return False, "Expected " + str(expected) + " blocks to be recomputed. " + message
+        passed, message = compare_with_reference(gdal.Open(output_file).ReadAsArray(), slopes, aspects, curvatures)
+        if not passed:
+            return False, "After recomputing changed blocks: " + message
+        output = gdal.Open(output_file).ReadAsArray()
+        reference_message = message
+
+        # The compatible roughness is a different parameter, so every block is recomputed.
+        computed, message = compute_static_risk(output_file, files[0], files[1], files[2], CHECK_BLOCK_SIZE, CHECK_PROCESSES, matlab_compatible=True)
+        if not computed:
+            return False, message
+        compatible_output = gdal.Open(output_file).ReadAsArray()
+        passed, compatible_message = compare_with_reference(compatible_output, slopes, aspects, curvatures, True)
+    finally:
+        shutil.rmtree(directory)
+
+    if not passed:
+        return False, "In the MATLAB compatible mode: " + compatible_message
+    if np.allclose(output, compatible_output, equal_nan=True):
+        return False, "The MATLAB compatible mode does not change the output."
+
+    return True, reference_message + " Recomputed " + str(expected) + " changed blocks. MATLAB compatible mode: " + compatible_message
+
+
+if __name__ == '__main__':
+    if (len(sys.argv) == 2) and (sys.argv[1] == "--check"):
+        passed, message = check_against_reference()
+        print(message)
+        sys.exit(0 if passed else 1)
+
+    arguments = [a for a in sys.argv[1:] if a not in ["--full", "--matlab-compatible"]]
+    if len(arguments) not in [1, 2]:
+        sys.exit("Usage: python -m GeoData.static_risk {output_file} [processes] [--full] [--matlab-compatible]\n       python -m GeoData.static_risk --check")
+
+    computed, message = compute_static_risk(arguments[0], processes=int(arguments[1]) if len(arguments) == 2 else None, incremental=("--full" not in sys.argv), matlab_compatible=("--matlab-compatible" in sys.argv))
+    print(message)
+    if not computed:
+        sys.exit(1)
+
+    # Percentiles stored for the previous raster are stale now.
+    stored, message = raster_statistics.store_percentiles(arguments[0], raster_statistics.STORED_PERCENTILES)
+    print(message)
+    sys.exit(0 if stored else 1)
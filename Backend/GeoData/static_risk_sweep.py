@@ -0,0 +1,188 @@
+###############################################################
+# Parameter sweep for the static risk model. Instead of
+# recomputing the static risk raster for each setting of the
+# slope, curvature and roughness curves, the model factors are
+# sampled once: the slope, curvature and cached roughness in a
+# window around each past avalanche, and at random background
+# points across the raster. Each setting is then scored on the
+# samples alone, in a pool of processes: thresholds are the
+# background percentiles of its risk, and recall is the share
+# of avalanches with a risk above them within each distance,
+# as in Scripts/evaluate_model.py. Results are written as a
+# CSV table ranked by mean recall. Run from the Backend
+# directory:
+#   python -m GeoData.static_risk_sweep {results_csv} [processes]
+###############################################################
+
+from __future__ import division, print_function
+
+import sys
+import csv
+import itertools
+import multiprocessing
+import numpy as np
+
+from GeoData import rasters, bng_to_lonlat, static_risk
+from GeoData.raster_reader import RasterReader
+from SAISCrawler.script import db_manager, utils
+
+# Values swept for each parameter of static_risk.slope_risk, curvature_risk and roughness_risk.
+SWEEP_PARAMETERS = [
+    ('slope_centre', [37.5, 40, 42.5, 45]),
+    ('slope_width', [6, 8, 10]),
+    ('slope_power', [4, 6]),
+    ('curvature_scale', [0.5, 1, 2]),
+    ('roughness_width', [0.005, 0.01, 0.02])]
+SWEEP_DISTANCES = [5, 10, 25] # Points either side of each avalanche.
+SWEEP_PERCENTILES = [90, 95, 99, 99.5]
+BACKGROUND_SAMPLES = 200000
+SAMPLE_SEED = 0
+RASTER_RESOLUTION = 5
+
+# Samples shared by the processes of the sweep, set by initialise_worker.
+_worker_windows = None
+_worker_background = None
+
+
+def model_defaults():
+    """ Return a dictionary of the current value of each swept parameter. """
+
+    defaults = {}
+    defaults['slope_centre'] = static_risk.SLOPE_RISK_CENTRE
+    defaults['slope_width'] = static_risk.SLOPE_RISK_WIDTH
+    defaults['slope_power'] = static_risk.SLOPE_RISK_POWER
+    defaults['curvature_offset'] = static_risk.CURVATURE_RISK_OFFSET
+    defaults['curvature_scale'] = static_risk.CURVATURE_RISK_SCALE
+    defaults['roughness_offset'] = static_risk.ROUGHNESS_RISK_OFFSET
+    defaults['roughness_width'] = static_risk.ROUGHNESS_RISK_WIDTH
+    defaults['roughness_power'] = static_risk.ROUGHNESS_RISK_POWER
+
+    return defaults
+
+
+def model_risk(slopes, curvatures, roughnesses, setting):
+    """ Return the static risk of arrays of the model factors with the parameters
+        of a setting, as static_risk.static_risk_block computes it. """
+
+    slope_values = static_risk.slope_risk(slopes, setting['slope_centre'], setting['slope_width'], setting['slope_power'])
+    curvature_values = static_risk.curvature_risk(curvatures, setting['curvature_offset'], setting['curvature_scale'])
+    roughness_values = static_risk.roughness_risk(roughnesses, setting['roughness_offset'], setting['roughness_width'], setting['roughness_power'])
+
+    return slope_values * curvature_values * roughness_values
+
+
+def sample_factors(readers, locations, generator):
+    """ Sample the model factors from readers of the slope, curvature and roughness
+        rasters. Return a tuple (windows, background): an array of the windows of
+        each factor around each avalanche location (easting, northing) in the
+        raster, and an array of each factor at random points. """
+
+    largest = max(SWEEP_DISTANCES)
+    size_x, size_y = readers[0].get_size()
+
+    # Windows around avalanches, with edge points repeated beyond the raster edges.
+    windows = []
+    coords_x, coords_y = bng_to_lonlat.OSGB36toWGS84_array([l[0] for l in locations], [l[1] for l in locations])
+    for x, y in zip(coords_x, coords_y):
+        index_x, index_y = readers[0].coordinate_to_index(x, y)
+        if (0 <= index_x < size_x) and (0 <= index_y < size_y):
+            windows.append([r.read_block(index_x, index_y, 1, 1, largest) for r in readers])
+
+    # Background points, dropping any without data.
+    coords_x, coords_y = readers[0].indices_to_coordinates(generator.randint(0, size_x, BACKGROUND_SAMPLES), generator.randint(0, size_y, BACKGROUND_SAMPLES))
+    background = np.array([r.read_points_at(coords_x, coords_y) for r in readers])
+    background = background[:, ~np.any(np.isnan(background), axis=0)]
+
+    return np.array(windows, dtype=np.float64), background
+
+
+def initialise_worker(windows, background):
+    """ Keep the samples in each process of the sweep. """
+
+    global _worker_windows, _worker_background
+    _worker_windows = windows
+    _worker_background = background
+
+
+def evaluate_setting(setting):
+    """ Return a tuple (setting, recalls) with an array of the recall of the
+        avalanches sampled for a setting, with a row for each distance and a
+        column for each percentile threshold. """
+
+    thresholds = np.percentile(model_risk(_worker_background[0], _worker_background[1], _worker_background[2], setting), SWEEP_PERCENTILES)
+
+    risks = model_risk(_worker_windows[:, 0], _worker_windows[:, 1], _worker_windows[:, 2], setting)
+    risks[np.isnan(risks)] = -np.inf
+    centre = max(SWEEP_DISTANCES)
+
+    recalls = np.zeros((len(SWEEP_DISTANCES), len(SWEEP_PERCENTILES)))
+    for d in range(len(SWEEP_DISTANCES)):
+        distance = SWEEP_DISTANCES[d]
+        maxima = np.amax(np.amax(risks[:, centre - distance:centre + distance + 1, centre - distance:centre + distance + 1], axis=2), axis=1)
+        thresholds_hit = np.searchsorted(thresholds, maxima, side='right')
+        hits = np.cumsum(np.bincount(thresholds_hit, minlength=len(thresholds) + 1)[::-1])[::-1][1:]
+        recalls[d] = hits / len(maxima)
+
+    return setting, recalls
+
+
+def sweep_settings():
+    """ Return a list of settings, dictionaries of the parameters of the model,
+        for each combination of the values swept. """
+
+    names = [p[0] for p in SWEEP_PARAMETERS]
+    settings = []
+    for values in itertools.product(*[p[1] for p in SWEEP_PARAMETERS]):
+        setting = model_defaults()
+        setting.update(zip(names, values))
+        settings.append(setting)
+
+    return settings
+
+
+def run_sweep(results_file, processes=None):
+    """ Sample the model factors, score every setting swept and write the ranked
+        results. Return a tuple (result, message). """
+
+    # Roughness is the one factor over neighbourhoods, cached as a raster and only recomputed where slopes or aspects changed.
+    computed, message = static_risk.compute_roughness(processes=processes)
+    if not computed:
+        return False, message
+
+    readers = [RasterReader(rasters.SLOPE_RASTER), RasterReader(rasters.CURVATURE_RASTER), RasterReader(rasters.ROUGHNESS_RASTER)]
+    avalanche_dbm = db_manager.CrawlerDB(utils.get_project_full_path() + utils.read_config('dbFile'))
+    locations = [(avalanche[2], avalanche[3]) for avalanche in avalanche_dbm.select_all_past_avalanches()]
+    windows, background = sample_factors(readers, locations, np.random.RandomState(SAMPLE_SEED))
+    if (len(windows) == 0) or (background.shape[1] == 0):
+        return False, "No avalanches or background points could be sampled."
+
+    settings = sweep_settings()
+    pool = multiprocessing.Pool(processes, initialise_worker, (windows, background))
+    try:
+        results = pool.map(evaluate_setting, settings)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    # Rank by mean recall over all distances and thresholds.
+    results.sort(key=lambda r: np.mean(r[1]), reverse=True)
+    defaults = model_defaults()
+    names = [p[0] for p in SWEEP_PARAMETERS]
+    with open(results_file, "w") as results_csv:
+        writer = csv.writer(results_csv)
+        writer.writerow(['rank'] + names + ['current', 'mean_recall'] + ["recall_{}m_{}pct".format(d * RASTER_RESOLUTION, p) for d in SWEEP_DISTANCES for p in SWEEP_PERCENTILES])
+        for rank in range(len(results)):
+            setting, recalls = results[rank]
+            current = all(setting[n] == defaults[n] for n in names)
+            writer.writerow([rank + 1] + [setting[n] for n in names] + [int(current), "%.4f" % np.mean(recalls)] + ["%.4f" % r for r in recalls.ravel()])
+
+    return True, "Ranked " + str(len(results)) + " settings on " + str(len(windows)) + " avalanches and " + str(background.shape[1]) + " background points in " + results_file + "."
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [2, 3]:
+        sys.exit("Usage: python -m GeoData.static_risk_sweep {results_csv} [processes]")
+
+    swept, message = run_sweep(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else None)
+    print(message)
+    sys.exit(0 if swept else 1)
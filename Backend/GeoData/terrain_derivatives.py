@@ -0,0 +1,209 @@
+###############################################################
+# Slope, aspect and curvature rasters derived from the height
+# raster, as inputs of the static risk model, computed block by
+# block with a halo of one point through block_pipeline. Slope
+# and aspect use the third order finite differences of Horn
+# (1981) and curvature the surface fit of Zevenbergen and Thorne
+# (1987), with the conventions of ArcGIS: aspect in degrees
+# clockwise from north, -1 on flat ground, and curvature in
+# hundredths of a unit, positive where the surface is convex.
+# Points next to heights without data are left without data.
+# Run from the Backend directory:
+#   python -m GeoData.terrain_derivatives [processes] [--full]
+#   python -m GeoData.terrain_derivatives --check
+###############################################################
+
+from __future__ import division, print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from osgeo import gdal, osr
+
+from GeoData import block_pipeline, rasters
+
+METRES_PER_DEGREE = 111320
+NO_DATA_VALUE = -9999
+FLAT_ASPECT = -1
+CURVATURE_SCALE = 100
+
+CHECK_SIZE = (150, 130) # Points (x, y) of the synthetic terrain, not multiples of the block size.
+CHECK_BLOCK_SIZE = 32
+CHECK_PROCESSES = 2
+CHECK_CELL_SIZE = 5 # Metres.
+CHECK_GEO_TRANSFORM = (200000, CHECK_CELL_SIZE, 0, 800000, 0, -CHECK_CELL_SIZE)
+CHECK_EPSG = 27700 # British National Grid.
+CHECK_TOLERANCE = 1e-3 # Degrees, or relative for curvatures, the heights are single precision.
+CHECK_HOLE = (slice(60, 63), slice(40, 45)) # Rows and columns of heights without data.
+
+
+def terrain_derivatives(heights, cell_x, cell_y, no_data_value=None):
+    """ Return the slopes, aspects and curvatures of the points of a block of
+        heights with a halo of one point, with cell_x and cell_y the distances
+        between points in the units of the heights, as numbers or columns of one
+        per row. """
+
+    heights = heights.astype(np.float64)
+    if no_data_value is not None:
+        heights[heights == no_data_value] = np.nan
+
+    # Neighbourhood of each point, labelled as in the ArcGIS documentation:
+    #   a b c
+    #   d e f
+    #   g h i
+    a = heights[:-2, :-2]
+    b = heights[:-2, 1:-1]
+    c = heights[:-2, 2:]
+    d = heights[1:-1, :-2]
+    e = heights[1:-1, 1:-1]
+    f = heights[1:-1, 2:]
+    g = heights[2:, :-2]
+    h = heights[2:, 1:-1]
+    i = heights[2:, 2:]
+
+    # Rates of change east and south.
+    dz_dx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * cell_x)
+    dz_dy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * cell_y)
+
+    slopes = np.degrees(np.arctan(np.sqrt(dz_dx ** 2 + dz_dy ** 2)))
+
+    aspects = np.degrees(np.arctan2(dz_dy, -dz_dx))
+    aspects = np.where(aspects > 90, 450 - aspects, 90 - aspects)
+    aspects[(dz_dx == 0) & (dz_dy == 0)] = FLAT_ASPECT
+
+    curvature_x = ((d + f) / 2 - e) / cell_x ** 2
+    curvature_y = ((b + h) / 2 - e) / cell_y ** 2
+    curvatures = -2 * (curvature_x + curvature_y) * CURVATURE_SCALE
+
+    # Horn's differences skip e and the curvature skips the corners, between them covering all nine.
+    outputs = [slopes, aspects, curvatures]
+    missing = np.isnan(slopes) | np.isnan(curvatures)
+    for values in outputs:
+        values[missing] = NO_DATA_VALUE
+
+    return outputs
+
+
+def geographic_derivatives_block(window, heights):
+    """ Return the derivatives of a block of heights in metres on a grid of
+        degrees, with the distance between columns varying with latitude. """
+
+    index_x, index_y, geotransform, no_data_value = window
+    rows = np.arange(index_y, index_y + heights.shape[0] - 2)
+    latitudes = geotransform[3] + (rows + 0.5) * geotransform[5]
+    cell_x = abs(geotransform[1]) * METRES_PER_DEGREE * np.cos(np.radians(latitudes))[:, np.newaxis]
+    cell_y = abs(geotransform[5]) * METRES_PER_DEGREE
+
+    return terrain_derivatives(heights, cell_x, cell_y, no_data_value)
+
+
+def projected_derivatives_block(window, heights):
+    """ Return the derivatives of a block of heights on a grid in the units of
+        the heights. """
+
+    index_x, index_y, geotransform, no_data_value = window
+
+    return terrain_derivatives(heights, abs(geotransform[1]), abs(geotransform[5]), no_data_value)
+
+
+def is_geographic(raster_file):
+    """ Return whether a raster is on a grid of degrees, as the rasters in rasters.py are. """
+
+    projection = gdal.Open(raster_file).GetProjection()
+    if not projection:
+        return False
+
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromWkt(projection)
+
+    return bool(spatial_reference.IsGeographic())
+
+
+def compute_terrain_derivatives(height_file=rasters.HEIGHT_RASTER, slope_file=rasters.SLOPE_RASTER, aspect_file=rasters.ASPECT_RASTER, curvature_file=rasters.CURVATURE_RASTER, block_size=block_pipeline.BLOCK_SIZE, processes=None, incremental=True):
+    """ Compute the slope, aspect and curvature rasters from the height raster,
+        recomputing only blocks whose heights changed since the last run if incremental. """
+
+    block_function = geographic_derivatives_block if is_geographic(height_file) else projected_derivatives_block
+
+    return block_pipeline.run_block_pipeline([height_file], [slope_file, aspect_file, curvature_file], block_function, 1, block_size, processes, incremental, NO_DATA_VALUE, True)
+
+
+def check_derivatives():
+    """ Compute the derivatives of synthetic terrain through the block pipeline
+        and check them against the slopes and aspects of planes facing each way,
+        the curvature of a paraboloid, and a computation of the whole raster as
+        one block, with a hole of heights without data. Return a tuple (passed,
+        message). """
+
+    grid_y, grid_x = np.mgrid[0:CHECK_SIZE[1], 0:CHECK_SIZE[0]] * CHECK_CELL_SIZE
+    directory = tempfile.mkdtemp()
+    try:
+        height_file = os.path.join(directory, "heights.tif")
+        output_files = [os.path.join(directory, n + ".tif") for n in ["slope", "aspect", "curvature"]]
+
+        # Planes falling towards each aspect, with y increasing southwards.
+        for facing in range(0, 360, 45):
+            gradient = 0.5
+            heights = 1000 - gradient * (np.sin(np.radians(facing)) * grid_x - np.cos(np.radians(facing)) * grid_y)
+            block_pipeline.write_raster(height_file, heights, CHECK_GEO_TRANSFORM, CHECK_EPSG, NO_DATA_VALUE)
+            computed, message = compute_terrain_derivatives(height_file, output_files[0], output_files[1], output_files[2], CHECK_BLOCK_SIZE, CHECK_PROCESSES, False)
+            if not computed:
+                return False, message
+            slopes, aspects = [gdal.Open(f).ReadAsArray()[1:-1, 1:-1] for f in output_files[:2]]
+            if np.amax(np.abs(slopes - np.degrees(np.arctan(gradient)))) > CHECK_TOLERANCE:
+                return False, "Slopes of a plane facing " + str(facing) + " degrees are wrong."
+            if np.amax(np.abs((aspects - facing + 180) % 360 - 180)) > CHECK_TOLERANCE:
+                return False, "Aspects of a plane facing " + str(facing) + " degrees are wrong."
+
+        # A dome, convex with a curvature of -2 * (2 * -k) * 100 everywhere.
+        k = 0.01
+        heights = 1000 - k * ((grid_x - grid_x.mean()) ** 2 + (grid_y - grid_y.mean()) ** 2)
+        heights[CHECK_HOLE] = NO_DATA_VALUE
+        block_pipeline.write_raster(height_file, heights, CHECK_GEO_TRANSFORM, CHECK_EPSG, NO_DATA_VALUE)
+        computed, message = compute_terrain_derivatives(height_file, output_files[0], output_files[1], output_files[2], CHECK_BLOCK_SIZE, CHECK_PROCESSES, False)
+        if not computed:
+            return False, message
+        outputs = [gdal.Open(f).ReadAsArray() for f in output_files]
+
+        # The same heights as a single block, in this process.
+        single_files = [os.path.join(directory, n + "_single.tif") for n in ["slope", "aspect", "curvature"]]
+        computed, message = compute_terrain_derivatives(height_file, single_files[0], single_files[1], single_files[2], max(CHECK_SIZE), 1, False)
+        if not computed:
+            return False, message
+        single_outputs = [gdal.Open(f).ReadAsArray() for f in single_files]
+    finally:
+        shutil.rmtree(directory)
+
+    for values, single_values in zip(outputs, single_outputs):
+        if not np.array_equal(values, single_values):
+            return False, "Blocks differ from the whole raster computed as one block."
+
+    # Points next to the hole have no data, and others the curvature of the dome.
+    near_hole = np.zeros(heights.shape, dtype=bool)
+    near_hole[CHECK_HOLE[0].start - 1:CHECK_HOLE[0].stop + 1, CHECK_HOLE[1].start - 1:CHECK_HOLE[1].stop + 1] = True
+    for values in outputs:
+        if not np.all(values[near_hole] == NO_DATA_VALUE):
+            return False, "Points next to heights without data have derivatives."
+    curvatures = outputs[2]
+    interior = ~near_hole[1:-1, 1:-1]
+    if np.amax(np.abs(curvatures[1:-1, 1:-1][interior] / (4 * k * CURVATURE_SCALE) - 1)) > CHECK_TOLERANCE:
+        return False, "Curvatures of a dome are wrong."
+
+    return True, "Derivatives match planes facing 8 ways, a dome, and the whole raster as one block."
+
+
+if __name__ == '__main__':
+    if (len(sys.argv) == 2) and (sys.argv[1] == "--check"):
+        passed, message = check_derivatives()
+        print(message)
+        sys.exit(0 if passed else 1)
+
+    arguments = [a for a in sys.argv[1:] if a != "--full"]
+    if len(arguments) > 1:
+        sys.exit("Usage: python -m GeoData.terrain_derivatives [processes] [--full]\n       python -m GeoData.terrain_derivatives --check")
+
+    computed, message = compute_terrain_derivatives(processes=int(arguments[0]) if arguments else None, incremental=("--full" not in sys.argv))
+    print(message)
+    sys.exit(0 if computed else 1)
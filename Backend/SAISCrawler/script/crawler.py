@@ -14,6 +14,13 @@ from time import sleep
 import db_manager
 import utils
 
+# Past avalanches are located as they are added if the backend raster modules can be loaded, otherwise later by GeoData.avalanche_locations.
+sys.path.append(os.path.dirname(utils.get_project_full_path()))
+try:
+    from GeoData import avalanche_locations
+except ImportError:
+    avalanche_locations = None
+
 
 class Crawler:
     """ The main class generating crawler instances to crawl the SAIS website. """
@@ -42,6 +49,8 @@ class Crawler:
         #Configure the DB interface.
         dbFile = utils.get_project_full_path() + utils.read_config('dbFile')
         self._DBManager = db_manager.CrawlerDB(dbFile)
+        self._DBManager.migrate_past_avalanches()
+        self._avalancheLocator = avalanche_locations.open_locator() if avalanche_locations is not None else None
 
 
     def quit(self):
@@ -222,7 +231,7 @@ class Crawler:
             except KeyError:
                 raise Exception("SAISCrawler has failed to read the marker JSON in " + str(year) + ", exiting.")
 
-            new, amended_count = self._DBManager.add_past_avalanches(avalanche_records)
+            new, amended_count = self._DBManager.add_past_avalanches(avalanche_records, self._avalancheLocator.locate_avalanches if self._avalancheLocator is not None else None)
 
             print("SAISCrawler: added {} new, amended {} for record year {}.".format(new, amended_count, year))
 
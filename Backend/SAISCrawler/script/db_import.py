@@ -8,6 +8,8 @@ import sys
 import csv
 import sqlite3
 
+import db_manager
+
 if len(sys.argv) != 2:
     sys.exit("Usage: python db_import.py {source_csv_file}")
 
@@ -29,38 +31,7 @@ with open(sys.argv[1], 'r') as csvfile:
         dbImportDataset.append((line[0].strip(), line[1].strip()[1:-1]))
 
 # Create tables.
-dbImportConnectionCursor.execute("""
-        CREATE TABLE IF NOT EXISTS locations
-        (location_id INTEGER PRIMARY KEY,
-        location_name TEXT,
-        location_forecast_url TEXT
-        )"""
-    )
-dbImportConnectionCursor.execute("""
-        CREATE TABLE IF NOT EXISTS forecasts
-        (forecast_id INTEGER PRIMARY KEY,
-        location_id INTEGER REFERENCES locations(location_id) ON DELETE CASCADE,
-        forecast_date TEXT,
-        direction TEXT,
-        lower_boundary INTEGER,
-        middle_boundary INTEGER,
-        upper_boundary INTEGER,
-        lower_primary_colour INTEGER,
-        lower_secondary_colour INTEGER,
-        upper_primary_colour INTEGER,
-        upper_secondary_colour INTEGER
-        )"""
-    )
-dbImportConnectionCursor.execute("""
-        CREATE TABLE IF NOT EXISTS past_avalanches
-        (avalanche_internal_id INTEGER PRIMARY KEY,
-        avalanche_id INTEGER,
-        easting INTEGER,
-        norting INTEGER,
-        avalanche_time TEXT,
-        avalanche_comment TEXT
-        )"""
-    )
+db_manager.CrawlerDB(dbImportDatabase).create_tables()
 
 # Insert set of locations from the file.
 dbImportConnectionCursor.executemany(\
@@ -69,3 +40,6 @@ dbImportConnectionCursor.executemany(\
 # Commit changes and close connection.
 dbImportConnection.commit()
 dbImportConnection.close()
+
+# Add the indices of past avalanches.
+db_manager.CrawlerDB(dbImportDatabase).migrate_past_avalanches()
@@ -17,6 +17,126 @@ class CrawlerDB:
         self.__CrawlerDBCursor = self.__CrawlerDBConnection.cursor()
 
 
+    def create_tables(self):
+        """ Create the tables of a new database, if they do not exist yet. """
+
+        self.__CrawlerDBCursor.execute("""
+            CREATE TABLE IF NOT EXISTS locations
+            (location_id INTEGER PRIMARY KEY,
+            location_name TEXT,
+            location_forecast_url TEXT
+            )""")
+        self.__CrawlerDBCursor.execute("""
+            CREATE TABLE IF NOT EXISTS forecasts
+            (forecast_id INTEGER PRIMARY KEY,
+            location_id INTEGER REFERENCES locations(location_id) ON DELETE CASCADE,
+            forecast_date TEXT,
+            direction TEXT,
+            lower_boundary INTEGER,
+            middle_boundary INTEGER,
+            upper_boundary INTEGER,
+            lower_primary_colour INTEGER,
+            lower_secondary_colour INTEGER,
+            upper_primary_colour INTEGER,
+            upper_secondary_colour INTEGER
+            )""")
+        self.__CrawlerDBCursor.execute("""
+            CREATE TABLE IF NOT EXISTS past_avalanches
+            (avalanche_internal_id INTEGER PRIMARY KEY,
+            avalanche_id INTEGER,
+            easting INTEGER,
+            norting INTEGER,
+            avalanche_time TEXT,
+            avalanche_comment TEXT,
+            longitude REAL,
+            latitude REAL,
+            height REAL
+            )""")
+        self.__CrawlerDBConnection.commit()
+
+        return True
+
+
+    def migrate_past_avalanches(self):
+        """ Bring the past avalanches table of a database created by an earlier
+            version up to date. Run by db_import.py, the crawler and the
+            GeoData.avalanche_locations backfill rather than on every connection,
+            in one transaction holding the write lock, so that processes
+            migrating at once wait for each other. Return False if there is no
+            table yet. """
+
+        connection = self.__CrawlerDBConnection
+        connection.commit()
+        isolation_level = connection.isolation_level
+        connection.isolation_level = None # Manual transactions, as the sqlite3 module would otherwise commit before schema changes.
+
+        try:
+            self.__CrawlerDBCursor.execute("BEGIN IMMEDIATE")
+            try:
+                self.__CrawlerDBCursor.execute("PRAGMA table_info(past_avalanches)")
+                columns = [i[1] for i in self.__CrawlerDBCursor.fetchall()]
+                if len(columns) > 0:
+                    self.add_past_avalanche_location_columns(columns)
+                    self.add_past_avalanche_indices()
+                self.__CrawlerDBCursor.execute("COMMIT")
+            except sqlite3.Error:
+                self.__CrawlerDBCursor.execute("ROLLBACK")
+                raise
+        finally:
+            connection.isolation_level = isolation_level
+
+        return len(columns) > 0
+
+
+    def add_past_avalanche_location_columns(self, columns):
+        """ Add the longitude, latitude and height columns to a past avalanches
+            table with the given columns if it was created without them, left
+            empty until filled in. Run within migrate_past_avalanches. """
+
+        if 'longitude' in columns: # Already added.
+            return False
+
+        for column in ['longitude', 'latitude', 'height']:
+            self.__CrawlerDBCursor.execute("ALTER TABLE past_avalanches ADD COLUMN " + column + " REAL")
+
+        return True
+
+
+    def add_past_avalanche_indices(self):
+        """ Index past avalanches by time, and by position in an R*Tree kept in
+            step with the longitude and latitude columns by triggers, filling the
+            R*Tree when it is created. Run within migrate_past_avalanches. """
+
+        positions_indexed = self.has_past_avalanche_positions()
+
+        self.__CrawlerDBCursor.execute("CREATE INDEX IF NOT EXISTS\
+            past_avalanches_by_time ON past_avalanches (avalanche_time)")
+        self.__CrawlerDBCursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS past_avalanche_positions\
+            USING rtree(avalanche_internal_id, min_longitude, max_longitude,\
+            min_latitude, max_latitude)")
+        if not positions_indexed:
+            self.__CrawlerDBCursor.execute("INSERT INTO past_avalanche_positions\
+                SELECT avalanche_internal_id, longitude, longitude, latitude, latitude\
+                FROM past_avalanches WHERE longitude IS NOT NULL AND latitude IS NOT NULL")
+
+        self.__CrawlerDBCursor.execute("CREATE TRIGGER IF NOT EXISTS past_avalanche_positions_insert\
+            AFTER INSERT ON past_avalanches\
+            WHEN new.longitude IS NOT NULL AND new.latitude IS NOT NULL BEGIN\
+            INSERT INTO past_avalanche_positions VALUES (new.avalanche_internal_id,\
+            new.longitude, new.longitude, new.latitude, new.latitude); END")
+        self.__CrawlerDBCursor.execute("CREATE TRIGGER IF NOT EXISTS past_avalanche_positions_update\
+            AFTER UPDATE OF longitude, latitude ON past_avalanches BEGIN\
+            DELETE FROM past_avalanche_positions WHERE avalanche_internal_id = old.avalanche_internal_id;\
+            INSERT INTO past_avalanche_positions SELECT new.avalanche_internal_id,\
+            new.longitude, new.longitude, new.latitude, new.latitude\
+            WHERE new.longitude IS NOT NULL AND new.latitude IS NOT NULL; END")
+        self.__CrawlerDBCursor.execute("CREATE TRIGGER IF NOT EXISTS past_avalanche_positions_delete\
+            AFTER DELETE ON past_avalanches BEGIN\
+            DELETE FROM past_avalanche_positions WHERE avalanche_internal_id = old.avalanche_internal_id; END")
+
+        return not positions_indexed
+
+
     def select_location_by_id(self, locationID):
         """ Returns a single tuple containing the information for a location
             of the given ID: (ID, Name, ForecastURL)."""
@@ -306,12 +426,17 @@ class CrawlerDB:
         return True
 
 
-    def add_past_avalanches(self, past_avalanches):
-        """ Add a list of past avalanches to the list. Return the number of
+    def add_past_avalanches(self, past_avalanches, locator=None):
+        """ Add a list of past avalanches to the list. If given, locator is
+            called with a list of locations (easting, northing) and returns a
+            list of tuples (longitude, latitude, height) for them, stored with new
+            avalanches and those moved, otherwise left empty to be filled in by
+            GeoData.avalanche_locations. Return the number of
             successfully added/amended avalanche records. """
 
         new_count = 0
         amended_count = 0
+        located_avalanches = []
 
         for avalanche in past_avalanches:
 
@@ -326,15 +451,16 @@ class CrawlerDB:
                 valid_avalanche = False
 
             if valid_avalanche:
-                self.__CrawlerDBCursor.execute("SELECT avalanche_internal_id FROM\
-                    past_avalanches WHERE avalanche_id = ?",
+                self.__CrawlerDBCursor.execute("SELECT avalanche_internal_id, easting,\
+                    norting, longitude FROM past_avalanches WHERE avalanche_id = ?",
                     (avalanche[0],)) # Check identical avalanches.
                 same_ids = self.__CrawlerDBCursor.fetchall()
                 if len(same_ids) <= 0: # If a new one add it.
                     self.__CrawlerDBCursor.execute("INSERT INTO past_avalanches\
-                        VALUES (NULL, ?, ?, ?, ?, ?)",
+                        VALUES (NULL, ?, ?, ?, ?, ?, NULL, NULL, NULL)",
                         (avalanche[0], avalanche[1], avalanche[2],
                         converted_time, avalanche[4],))
+                    located_avalanches.append((self.__CrawlerDBCursor.lastrowid, avalanche[1], avalanche[2]))
                     new_count += 1
                 else: # Amend existing record.
                     self.__CrawlerDBCursor.execute("UPDATE past_avalanches SET \
@@ -343,8 +469,20 @@ class CrawlerDB:
                         avalanche_internal_id = ?",
                         (avalanche[0], avalanche[1], avalanche[2],
                         converted_time, avalanche[4], same_ids[0][0],))
+                    if (same_ids[0][1] != avalanche[1]) or (same_ids[0][2] != avalanche[2]) or (same_ids[0][3] is None):
+                        located_avalanches.append((same_ids[0][0], avalanche[1], avalanche[2]))
                     amended_count += 1
 
+        # Locate new and moved avalanches all at once, clearing the locations of those moved if no locator.
+        if len(located_avalanches) > 0:
+            if locator is not None:
+                locations = locator([(i[1], i[2]) for i in located_avalanches])
+            else:
+                locations = [(None, None, None)] * len(located_avalanches)
+            self.__CrawlerDBCursor.executemany("UPDATE past_avalanches SET\
+                longitude = ?, latitude = ?, height = ? WHERE avalanche_internal_id = ?",
+                [location + (avalanche[0],) for avalanche, location in zip(located_avalanches, locations)])
+
         self.__CrawlerDBConnection.commit()
 
         return new_count, amended_count
@@ -368,6 +506,41 @@ class CrawlerDB:
         return avalanches
 
 
+    def has_past_avalanche_positions(self):
+        """ Return True if past avalanches are indexed by position, which
+            migrate_past_avalanches adds to databases created by earlier versions. """
+
+        self.__CrawlerDBCursor.execute("SELECT name FROM sqlite_master WHERE\
+            name = 'past_avalanche_positions'")
+
+        return self.__CrawlerDBCursor.fetchone() is not None
+
+
+    def select_past_avalanches_by_area(self, start_date, end_date, min_longitude, min_latitude, max_longitude, max_latitude):
+        """ Retrieve located past avalanches that happened between start_date
+            and end_date within a box of WGS84 coordinates, through the R*Tree
+            of their positions, once added by migrate_past_avalanches. """
+
+        start_date = self.convert_time_string(start_date.replace('\\', ''))
+        end_date = self.convert_time_string(end_date.replace('\\', ''))
+
+        if (not start_date) or (not end_date):
+            return False
+
+        # The R*Tree holds single precision boxes rounded outwards, so positions are checked again.
+        self.__CrawlerDBCursor.execute("SELECT past_avalanches.* FROM\
+            past_avalanche_positions JOIN past_avalanches USING (avalanche_internal_id) WHERE\
+            max_longitude >= ? AND min_longitude <= ? AND max_latitude >= ? AND min_latitude <= ? AND\
+            longitude BETWEEN ? AND ? AND latitude BETWEEN ? AND ? AND\
+            avalanche_time >= Datetime(?) AND avalanche_time <= Datetime(?)",
+            (min_longitude, max_longitude, min_latitude, max_latitude,
+            min_longitude, max_longitude, min_latitude, max_latitude,
+            start_date, end_date))
+        avalanches = self.__CrawlerDBCursor.fetchall()
+
+        return avalanches
+
+
     def select_all_past_avalanches(self):
         """ Retrieve all recorded past avalanches, very slow, for use in evaluation
             script only. """
@@ -378,6 +551,29 @@ class CrawlerDB:
         return avalanches
 
 
+    def select_unlocated_past_avalanches(self):
+        """ Retrieve past avalanches without stored coordinates, added before
+            they were stored or without a locator. """
+
+        self.__CrawlerDBCursor.execute("SELECT * FROM past_avalanches WHERE\
+            longitude IS NULL")
+        avalanches = self.__CrawlerDBCursor.fetchall()
+
+        return avalanches
+
+
+    def update_past_avalanche_locations(self, locations):
+        """ Store the coordinates and heights of past avalanches from a list of
+            tuples (avalanche_internal_id, longitude, latitude, height). """
+
+        self.__CrawlerDBCursor.executemany("UPDATE past_avalanches SET\
+            longitude = ?, latitude = ?, height = ? WHERE avalanche_internal_id = ?",
+            [(i[1], i[2], i[3], i[0]) for i in locations])
+        self.__CrawlerDBConnection.commit()
+
+        return True
+
+
     def delete_past_avalanches_by_date_range(self, start_date, end_date):
         """ Delete past avalanches that happened between start_date and
             end_date. """
@@ -7,14 +7,18 @@ from flask import Flask, send_file, abort, jsonify, request
 from PIL import Image
 
 import utils
+import route_jobs
 import geocoordinate_to_location
 from SAISCrawler.script import db_manager as forecast_db
 from SAISCrawler.script import utils as forecast_utils
-from GeoData import raster_reader, rasters, path_finder
+from GeoData import raster_reader, rasters, path_finder, route_encoding, avalanche_locations
 
 API_LOG = os.path.abspath(os.path.join(__file__, os.pardir)) + "/api.log"
 LOG_REQUESTS = True
 SPATIAL_READER = raster_reader
+MAX_SWEEP_WEIGHINGS = 11
+MAX_CLUSTER_ZOOM = 20 # Past avalanches are clustered at web map zoom levels up to this.
+MIGRATION_MESSAGE = "Past avalanches are not indexed by position, run python -m GeoData.avalanche_locations to migrate the database."
 
 # Main API app.
 app = Flask(__name__)
@@ -27,6 +31,34 @@ with app.app_context():
     contour_raster = SPATIAL_READER.RasterReader(rasters.CONTOUR_RASTER)
     static_risk_raster = SPATIAL_READER.RasterReader(rasters.RISK_RASTER)
     path_reader = path_finder.PathFinder(height_raster, aspect_raster, static_risk_raster, forecast_dbm)
+    avalanche_locator = avalanche_locations.AvalancheLocator(height_raster)
+
+
+def build_path_finder():
+    """ Build a path finder with its own raster readers and database connection,
+        for use in the worker processes of the route job service. """
+
+    return path_finder.PathFinder(SPATIAL_READER.RasterReader(rasters.HEIGHT_RASTER),
+        SPATIAL_READER.RasterReader(rasters.ASPECT_RASTER),
+        SPATIAL_READER.RasterReader(rasters.RISK_RASTER),
+        forecast_db.CrawlerDB(forecast_utils.get_project_full_path() + forecast_utils.read_config('dbFile')))
+
+# Route jobs are queued for the single route job service, run from route_jobs.py beside uwsgi.
+route_pool = route_jobs.RouteJobQueue()
+
+
+def encode_route(path):
+    """ Encode a path in the format requested by the client with the format query
+        argument, after simplifying it with the tolerance query argument in metres.
+        Return None if the format or tolerance is invalid. """
+
+    route_format = request.args.get('format', 'dict')
+    tolerance = float(request.args.get('tolerance', 0))
+    if tolerance < 0:
+        return None
+
+    return route_encoding.encode_path(path, route_format, tolerance)
+
 
 @app.route('/imagery/api/v1.0/avalanche_risks/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>', methods=['GET'])
 @app.route('/imagery/api/v1.0/avalanche_risks/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>/<string:forecast_date>', methods=['GET'])
@@ -324,7 +356,10 @@ def get_recent_forecast_dates(longitude, latitude):
 @app.route('/data/api/v1.0/find_path/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>/<string:risk_weighing>', methods=['GET'])
 @app.route('/data/api/v1.0/find_path/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>/<string:risk_weighing>/<string:forecast_date>', methods=['GET'])
 def get_path(longitude_initial, latitude_initial, longitude_final, latitude_final, risk_weighing, forecast_date=None):
-    """ Return a path (series of coordinates) found by A* search based on a weighing of risk against distance. """
+    """ Return a path (series of coordinates) found by A* search based on a weighing of risk against distance.
+        If a deadline in milliseconds is set, return the best path found by then and its suboptimality bound,
+        searching with the landmark heuristic by default, as the bound is null with the diagonal heuristic.
+        The path can be simplified and encoded compactly with the tolerance and format query arguments. """
 
     not_found_message = ""
 
@@ -360,12 +395,39 @@ def get_path(longitude_initial, latitude_initial, longitude_final, latitude_fina
             not_found_message = "Request too large at API."
             abort(400)
 
-        path, message = path_reader.find_path(initial[0], initial[1], final[0], final[1], risk_weighing, custom_date)
+        # Optionally return the best path found within a deadline in milliseconds.
+        deadline = request.args.get('deadline')
+
+        # Optionally search with the landmark heuristic, the default within a deadline for a valid bound.
+        heuristic = request.args.get('heuristic', 'diagonal' if deadline is None else 'alt')
+
+        if deadline is not None:
+            path, message = path_reader.find_path_anytime(initial[0], initial[1], final[0], final[1], risk_weighing, float(deadline), custom_date, heuristic)
+        else:
+            path = False
+
+            # Optionally try a full resolution lazy search first, which is fast for easy routes.
+            if request.args.get('lazy') == '1':
+                path, message = path_reader.find_path_lazy(initial[0], initial[1], final[0], final[1], risk_weighing, custom_date)
+
+            if not path:
+                path, message = path_reader.find_path(initial[0], initial[1], final[0], final[1], risk_weighing, custom_date, heuristic)
 
         if not path:
             not_found_message = "Path finding failed, probably due to excessive data size. Module message: " + message
             abort(404)
 
+        # Optionally simplify and compactly encode the path.
+        not_found_message = "Invalid route format."
+        if deadline is not None:
+            path['path'] = encode_route(path['path'])
+            if path['path'] is None:
+                abort(400)
+        else:
+            path = encode_route(path)
+            if path is None:
+                abort(400)
+
         return jsonify(path)
 
     except Exception as e:
@@ -377,50 +439,413 @@ def get_path(longitude_initial, latitude_initial, longitude_final, latitude_fina
         return jsonify({})
 
 
+@app.route('/data/api/v1.0/route_jobs/submit/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>/<string:risk_weighing>', methods=['GET'])
+@app.route('/data/api/v1.0/route_jobs/submit/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>/<string:risk_weighing>/<string:forecast_date>', methods=['GET'])
+def submit_route_job(longitude_initial, latitude_initial, longitude_final, latitude_final, risk_weighing, forecast_date=None):
+    """ Submit a path finding job to the route job pool, return its job ID for the client
+        to poll the result with. """
+
+    not_found_message = ""
+
+    try:
+
+        if (forecast_date is not None) and forecast_utils.check_date_string(forecast_date):
+            custom_date = forecast_date
+        else:
+            custom_date = None
+
+        risk_weighing = float(risk_weighing)
+        if (risk_weighing < 0) or (risk_weighing > 1):
+            not_found_message = "Invalid risk weighing."
+            abort(400)
+
+        initial = map(float, [longitude_initial, latitude_initial])
+        final = map(float, [longitude_final, latitude_final])
+
+        # Impossible geodetic coordinates.
+        not_found_message = "Invalid input data."
+        if (initial[0] < -180.0) or (initial[0] > 180.0):
+            abort(400)
+        if (initial[1] < -90.0) or (initial[1] > 90.0):
+            abort(400)
+        if (final[0] < -180.0) or (final[0] > 180.0):
+            abort(400)
+        if (final[1] < -90.0) or (final[1] > 90.0):
+            abort(400)
+        not_found_message = ""
+
+        # Check request size.
+        if (abs(initial[0] - final[0]) + abs(initial[1] - final[1])) > 0.5:
+            not_found_message = "Request too large at API."
+            abort(400)
+
+        job_id = route_pool.submit('find_path', (initial[0], initial[1], final[0], final[1], risk_weighing, custom_date))
+
+        if job_id is None:
+            not_found_message = "Route job queue full."
+            abort(503)
+
+        return jsonify({'job_id': job_id})
+
+    except Exception as e:
+
+        if (os.path.isfile(API_LOG)) and LOG_REQUESTS:
+            with open(API_LOG, "a") as log_file:
+                log_file.write(strftime("%Y-%m-%d %H:%M:%S", gmtime()) + ": error serving client, route job not submitted. Error: " + str(e) + ". Message: " + not_found_message + "\n")
+
+        return jsonify({})
+
+
+@app.route('/data/api/v1.0/route_jobs/status/<string:job_id>', methods=['GET'])
+def get_route_job(job_id):
+    """ Return the status of a route job, with its path and message once finished. """
+
+    job = route_pool.status(job_id)
+
+    if job is None:
+        return jsonify({})
+
+    return jsonify(job)
+
+
+@app.route('/data/api/v1.0/route_jobs/cancel/<string:job_id>', methods=['GET'])
+def cancel_route_job(job_id):
+    """ Cancel a queued or running route job. """
+
+    return jsonify({'cancelled': route_pool.cancel(job_id)})
+
+
+@app.route('/data/api/v1.0/find_paths/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>/<string:risk_weighings>', methods=['GET'])
+@app.route('/data/api/v1.0/find_paths/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>/<string:risk_weighings>/<string:forecast_date>', methods=['GET'])
+def get_paths(longitude_initial, latitude_initial, longitude_final, latitude_final, risk_weighings, forecast_date=None):
+    """ Return the distinct paths found by A* search for a comma-separated list of risk weighings,
+        each annotated with its Naismith distance and accumulated risk, from a single grid load. """
+
+    not_found_message = ""
+
+    try:
+
+        if (forecast_date is not None) and forecast_utils.check_date_string(forecast_date):
+            custom_date = forecast_date
+        else:
+            custom_date = None
+
+        not_found_message = "Invalid risk weighings."
+        risk_weighings = map(float, risk_weighings.split(','))
+        if (len(risk_weighings) < 1) or (len(risk_weighings) > MAX_SWEEP_WEIGHINGS):
+            abort(400)
+        for risk_weighing in risk_weighings:
+            if (risk_weighing < 0) or (risk_weighing > 1):
+                abort(400)
+        not_found_message = ""
+
+        initial = map(float, [longitude_initial, latitude_initial])
+        final = map(float, [longitude_final, latitude_final])
+
+        # Impossible geodetic coordinates.
+        not_found_message = "Invalid input data."
+        if (initial[0] < -180.0) or (initial[0] > 180.0):
+            abort(400)
+        if (initial[1] < -90.0) or (initial[1] > 90.0):
+            abort(400)
+        if (final[0] < -180.0) or (final[0] > 180.0):
+            abort(400)
+        if (final[1] < -90.0) or (final[1] > 90.0):
+            abort(400)
+        not_found_message = ""
+
+        # Check request size.
+        if (abs(initial[0] - final[0]) + abs(initial[1] - final[1])) > 0.5:
+            not_found_message = "Request too large at API."
+            abort(400)
+
+        routes, message = path_reader.find_paths(initial[0], initial[1], final[0], final[1], risk_weighings, custom_date)
+
+        if not routes:
+            not_found_message = "Path finding failed, probably due to excessive data size. Module message: " + message
+            abort(404)
+
+        # Optionally simplify and compactly encode the paths.
+        not_found_message = "Invalid route format."
+        for route in routes:
+            route['path'] = encode_route(route['path'])
+            if route['path'] is None:
+                abort(400)
+
+        return jsonify(routes)
+
+    except Exception as e:
+
+        if (os.path.isfile(API_LOG)) and LOG_REQUESTS:
+            with open(API_LOG, "a") as log_file:
+                log_file.write(strftime("%Y-%m-%d %H:%M:%S", gmtime()) + ": error serving client, routes not returned. Error: " + str(e) + ". Message: " + not_found_message + "\n")
+
+        return jsonify({})
+
+
+@app.route('/data/api/v1.0/find_paths_to_goal/<string:starts>/<string:longitude_final>/<string:latitude_final>/<string:risk_weighing>', methods=['GET'])
+@app.route('/data/api/v1.0/find_paths_to_goal/<string:starts>/<string:longitude_final>/<string:latitude_final>/<string:risk_weighing>/<string:forecast_date>', methods=['GET'])
+def get_paths_to_goal(starts, longitude_final, latitude_final, risk_weighing, forecast_date=None):
+    """ Return the best path to a goal from each of a semicolon-separated list of starts
+        (longitude,latitude), each annotated with its cost, Naismith distance and accumulated
+        risk, from a single reverse search from the goal. """
+
+    not_found_message = ""
+
+    try:
+
+        if (forecast_date is not None) and forecast_utils.check_date_string(forecast_date):
+            custom_date = forecast_date
+        else:
+            custom_date = None
+
+        risk_weighing = float(risk_weighing)
+        if (risk_weighing < 0) or (risk_weighing > 1):
+            not_found_message = "Invalid risk weighing."
+            abort(400)
+
+        not_found_message = "Invalid input data."
+        starts = [tuple(map(float, start.split(','))) for start in starts.split(';')]
+        final = map(float, [longitude_final, latitude_final])
+        if (len(starts) < 1) or (len(starts) > path_finder.MAX_TRAILHEADS):
+            abort(400)
+
+        # Impossible geodetic coordinates.
+        for point in starts + [tuple(final)]:
+            if len(point) != 2:
+                abort(400)
+            if (point[0] < -180.0) or (point[0] > 180.0):
+                abort(400)
+            if (point[1] < -90.0) or (point[1] > 90.0):
+                abort(400)
+        not_found_message = ""
+
+        # Check request size.
+        longitudes = [start[0] for start in starts] + [final[0]]
+        latitudes = [start[1] for start in starts] + [final[1]]
+        if (max(longitudes) - min(longitudes) + max(latitudes) - min(latitudes)) > 0.5:
+            not_found_message = "Request too large at API."
+            abort(400)
+
+        routes, message = path_reader.find_paths_to_goal(starts, final[0], final[1], risk_weighing, custom_date)
+
+        if not routes:
+            not_found_message = "Path finding failed, probably due to excessive data size. Module message: " + message
+            abort(404)
+
+        # Optionally simplify and compactly encode the paths.
+        not_found_message = "Invalid route format."
+        for route in routes:
+            if route['path'] is not None:
+                route['path'] = encode_route(route['path'])
+                if route['path'] is None:
+                    abort(400)
+
+        return jsonify(routes)
+
+    except Exception as e:
+
+        if (os.path.isfile(API_LOG)) and LOG_REQUESTS:
+            with open(API_LOG, "a") as log_file:
+                log_file.write(strftime("%Y-%m-%d %H:%M:%S", gmtime()) + ": error serving client, routes not returned. Error: " + str(e) + ". Message: " + not_found_message + "\n")
+
+        return jsonify({})
+
+
+@app.route('/data/api/v1.0/reachable/<string:longitude>/<string:latitude>/<string:hours>/<string:risk_weighing>', methods=['GET'])
+@app.route('/data/api/v1.0/reachable/<string:longitude>/<string:latitude>/<string:hours>/<string:risk_weighing>/<string:forecast_date>', methods=['GET'])
+def get_reachable(longitude, latitude, hours, risk_weighing, forecast_date=None):
+    """ Return a grid of the terrain reachable within the given hours of Naismith time from a
+        coordinate, with the risk of each reachable cell and the risk accumulated on the way. """
+
+    not_found_message = ""
+
+    try:
+
+        if (forecast_date is not None) and forecast_utils.check_date_string(forecast_date):
+            custom_date = forecast_date
+        else:
+            custom_date = None
+
+        risk_weighing = float(risk_weighing)
+        if (risk_weighing < 0) or (risk_weighing > 1):
+            not_found_message = "Invalid risk weighing."
+            abort(400)
+
+        hours = float(hours)
+        if (hours <= 0) or (hours > path_finder.MAX_REACHABLE_HOURS):
+            not_found_message = "Invalid number of hours."
+            abort(400)
+
+        longitude = float(longitude)
+        latitude = float(latitude)
+
+        if longitude < -180 or longitude > 180 or latitude < -90 or latitude > 90:
+            not_found_message = "Request out of geographical bounds."
+            abort(400)
+
+        reachability, message = path_reader.find_reachable(longitude, latitude, hours, risk_weighing, custom_date)
+
+        if not reachability:
+            not_found_message = "Reachability search failed, probably due to excessive data size. Module message: " + message
+            abort(404)
+
+        return jsonify(reachability)
+
+    except Exception as e:
+
+        if (os.path.isfile(API_LOG)) and LOG_REQUESTS:
+            with open(API_LOG, "a") as log_file:
+                log_file.write(strftime("%Y-%m-%d %H:%M:%S", gmtime()) + ": error serving client, reachability not returned. Error: " + str(e) + ". Message: " + not_found_message + "\n")
+
+        return jsonify({})
+
+
+def past_avalanche_items(avalanches):
+    """ Return a list of dictionaries of past avalanche records, with their
+        datetime, locations and SAIS comments. """
+
+    # Locate avalanches stored without coordinates here, until GeoData.avalanche_locations migrates the database and fills them in.
+    unlocated = [a for a in avalanches if (len(a) < 7) or (a[6] is None)]
+    locations = dict(zip([a[0] for a in unlocated], avalanche_locator.locate_avalanches([(a[2], a[3]) for a in unlocated])))
+
+    avalanches_data = []
+    for avalanche in avalanches:
+
+        longitude, latitude, height = locations.get(avalanche[0], avalanche[6:9])
+        if longitude is None: # In case of invalid BNG values.
+            continue # Skip this.
+
+        avalanche_item = {}
+        avalanche_item['long'] = longitude
+        avalanche_item['lat'] = latitude
+        avalanche_item['time'] = avalanche[4]
+        avalanche_item['comment'] = avalanche[5]
+        # Fix the issue when SAIS labels an avalanche outside raster boundary.
+        avalanche_item['height'] = height if height is not None else 0.0
+        avalanches_data.append(avalanche_item)
+
+    return avalanches_data
+
+
+def parse_area(longitude_initial, latitude_initial, longitude_final, latitude_final):
+    """ Return a tuple (min_longitude, min_latitude, max_longitude, max_latitude)
+        of an area between two corners, or None if they are impossible geodetic
+        coordinates. """
+
+    longitudes = sorted([float(longitude_initial), float(longitude_final)])
+    latitudes = sorted([float(latitude_initial), float(latitude_final)])
+    if (longitudes[0] < -180.0) or (longitudes[1] > 180.0) or (latitudes[0] < -90.0) or (latitudes[1] > 90.0):
+        return None
+
+    return longitudes[0], latitudes[0], longitudes[1], latitudes[1]
+
+
+def unmigrated_response():
+    """ Return an error response for area queries of past avalanches if the database
+        has not been migrated to index them by position, None if it has. """
+
+    if forecast_dbm.has_past_avalanche_positions():
+        return None
+
+    if (os.path.isfile(API_LOG)) and LOG_REQUESTS:
+        with open(API_LOG, "a") as log_file:
+            log_file.write(strftime("%Y-%m-%d %H:%M:%S", gmtime()) + ": error serving client, past avalanches not returned. Message: " + MIGRATION_MESSAGE + "\n")
+
+    return jsonify({'error': MIGRATION_MESSAGE}), 503
+
+
 @app.route('/data/api/v1.0/past_avalanches/<string:start_date>/<string:end_date>', methods=['GET'])
-def get_past_avalanches(start_date, end_date):
+@app.route('/data/api/v1.0/past_avalanches/<string:start_date>/<string:end_date>/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>', methods=['GET'])
+def get_past_avalanches(start_date, end_date, longitude_initial=None, latitude_initial=None, longitude_final=None, latitude_final=None):
     """ Return a list of past avalanches between start_date and end_date, with
-        their datetime, locations and SAIS comments. """
+        their datetime, locations and SAIS comments. Optionally only those within
+        the area between two corners, found through the spatial index. """
+
+    if longitude_initial is not None:
+        error_response = unmigrated_response()
+        if error_response is not None:
+            return error_response
 
     not_found_message = ""
 
     try:
 
-        if forecast_dbm.convert_time_string(start_date) and forecast_dbm.convert_time_string(end_date):
+        if not (forecast_dbm.convert_time_string(start_date) and forecast_dbm.convert_time_string(end_date)):
+            not_found_message = "Invalid date strings."
+            abort(400)
+
+        if longitude_initial is None:
             avalanches = forecast_dbm.select_past_avalanches_by_date_range(start_date, end_date)
-            avalanches_data = []
+        else:
+            area = parse_area(longitude_initial, latitude_initial, longitude_final, latitude_final)
+            if area is None:
+                not_found_message = "Invalid input data."
+                abort(400)
+            avalanches = forecast_dbm.select_past_avalanches_by_area(start_date, end_date, *area)
 
-            for avalanche in avalanches:
+        return jsonify(past_avalanche_items(avalanches))
 
-                avalanche_item = {}
-                coordinates = utils.bng_to_longlat((avalanche[2], avalanche[3]))
+    except Exception as e:
 
-                if not coordinates: # In case of invalid BNG values.
-                    continue # Skip this.
+        if (os.path.isfile(API_LOG)) and LOG_REQUESTS:
+            with open(API_LOG, "a") as log_file:
+                log_file.write(strftime("%Y-%m-%d %H:%M:%S", gmtime()) + ": error serving client, past avalanches not returned. Error: " + str(e) + ". Message: " + not_found_message + "\n")
+
+        return jsonify({})
 
-                avalanche_item['long'] = coordinates[0]
-                avalanche_item['lat'] = coordinates[1]
-                avalanche_item['time'] = avalanche[4]
-                avalanche_item['comment'] = avalanche[5]
-                avalanche_item['height'] = height_raster.read_point(coordinates[0], coordinates[1])
 
-                # Fix the issue when SAIS labels an avalanche outside raster boundary.
-                if not avalanche_item['height']:
-                    avalanche_item['height'] = 0.0;
+@app.route('/data/api/v1.0/past_avalanche_clusters/<string:start_date>/<string:end_date>/<string:longitude_initial>/<string:latitude_initial>/<string:longitude_final>/<string:latitude_final>/<int:zoom>', methods=['GET'])
+def get_past_avalanche_clusters(start_date, end_date, longitude_initial, latitude_initial, longitude_final, latitude_final, zoom):
+    """ Return a list of clusters of past avalanches between start_date and
+        end_date within the area between two corners, grouped by cells of the
+        web map at a zoom level, with their mean location and count. Clusters of
+        one avalanche also have its datetime, height and SAIS comment. """
 
-                avalanches_data.append(avalanche_item)
+    error_response = unmigrated_response()
+    if error_response is not None:
+        return error_response
 
-        else:
+    not_found_message = ""
+
+    try:
+
+        if not (forecast_dbm.convert_time_string(start_date) and forecast_dbm.convert_time_string(end_date)):
             not_found_message = "Invalid date strings."
             abort(400)
 
-        return jsonify(avalanches_data)
+        area = parse_area(longitude_initial, latitude_initial, longitude_final, latitude_final)
+        if (area is None) or (zoom > MAX_CLUSTER_ZOOM):
+            not_found_message = "Invalid input data."
+            abort(400)
+
+        avalanches_data = past_avalanche_items(forecast_dbm.select_past_avalanches_by_area(start_date, end_date, *area))
+        clusters, longitudes, latitudes, counts = utils.cluster_points([a['long'] for a in avalanches_data], [a['lat'] for a in avalanches_data], zoom)
+
+        # The avalanche in each cluster of one.
+        single_avalanches = {}
+        for n in range(len(clusters)):
+            if counts[clusters[n]] == 1:
+                single_avalanches[clusters[n]] = avalanches_data[n]
+
+        clusters_data = []
+        for c in range(len(counts)):
+            if counts[c] == 1:
+                cluster_item = single_avalanches[c]
+            else:
+                cluster_item = {}
+                cluster_item['long'] = float(longitudes[c])
+                cluster_item['lat'] = float(latitudes[c])
+            cluster_item['count'] = int(counts[c])
+            clusters_data.append(cluster_item)
+
+        return jsonify(clusters_data)
 
     except Exception as e:
 
         if (os.path.isfile(API_LOG)) and LOG_REQUESTS:
             with open(API_LOG, "a") as log_file:
-                log_file.write(strftime("%Y-%m-%d %H:%M:%S", gmtime()) + ": error serving client, past avalanches not returned. Error: " + str(e) + ". Message: " + not_found_message + "\n")
+                log_file.write(strftime("%Y-%m-%d %H:%M:%S", gmtime()) + ": error serving client, past avalanche clusters not returned. Error: " + str(e) + ". Message: " + not_found_message + "\n")
 
         return jsonify({})
 
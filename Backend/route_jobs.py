@@ -0,0 +1,452 @@
+###############################################################
+# Route planning jobs run by a dedicated service, so that long
+# searches do not hold up the API server processes. API server
+# processes submit jobs through a RouteJobQueue as request files
+# in a shared job directory, and a single RouteJobPool process,
+# started beside uwsgi, runs them on its worker processes. The
+# queue depth and workers are therefore shared by all API server
+# processes, whichever serves a request. Job states are kept as
+# files in the same directory, so that any API server process
+# can serve them. Run from the Backend directory:
+#   python route_jobs.py [workers]
+###############################################################
+
+from __future__ import division
+
+import os
+import sys
+import json
+import uuid
+import fcntl
+import multiprocessing
+from time import time, sleep
+
+JOB_WORKERS = 2
+JOB_QUEUE_DEPTH = 8 # Jobs waiting for a worker, across all API server processes.
+JOB_TIMEOUT = 60 # Seconds a job may run before its worker is terminated.
+JOB_EXPIRY = 3600 # Seconds a finished job is kept for clients to collect.
+JOB_DIRECTORY = os.path.abspath(os.path.join(__file__, os.pardir)) + "/jobs"
+JOB_LOCK_FILE = ".lock"
+JOB_REQUEST_SUFFIX = ".request"
+SUPERVISOR_INTERVAL = 0.2
+
+JOB_FINISHED_STATES = ["done", "failed", "timeout", "cancelled"]
+
+
+def run_worker(finder_factory, connection, supervisor_connection):
+    """ Main loop of a worker process: build a path finder with its own
+        readers, then run the jobs sent by the supervisor one at a time,
+        returning results through the worker's own connection. Exits when the
+        supervisor goes away. """
+
+    # The copy of the supervisor's end inherited on forking would keep the pipe open.
+    supervisor_connection.close()
+    finder = finder_factory()
+
+    while True:
+        try:
+            job_id, method, arguments = connection.recv()
+        except EOFError:
+            return
+
+        try:
+            result, message = getattr(finder, method)(*arguments)
+        except Exception as e:
+            result, message = False, "Error in job: " + str(e)
+
+        connection.send((job_id, result, message))
+
+
+class RouteJobQueue:
+    """ Queue of route jobs in a job directory shared by the API server
+        processes and the RouteJobPool running them. Submissions and the
+        taking of jobs by the pool hold a lock on the directory, so that at
+        most queue_depth jobs wait in all. """
+
+    def __init__(self, queue_depth=JOB_QUEUE_DEPTH, job_directory=JOB_DIRECTORY):
+
+        self._queue_depth = queue_depth
+        self._job_directory = job_directory
+
+        if not os.path.isdir(self._job_directory):
+            try:
+                os.makedirs(self._job_directory)
+            except OSError:
+                pass # Made by another process.
+
+
+    def submit(self, method, arguments):
+        """ Queue a call of the path finder method with the given arguments,
+            return the job ID, or None if the queue is full. """
+
+        job_id = uuid.uuid4().hex
+
+        request = {}
+        request['method'] = method
+        request['arguments'] = list(arguments)
+        request['submitted'] = time()
+
+        with self.locked():
+            if len(self.queued_job_ids()) >= self._queue_depth:
+                return None
+
+            self.write_job(job_id, "queued")
+            self.write_file(self.request_file(job_id), request)
+
+        return job_id
+
+
+    def status(self, job_id):
+        """ Return the state of a job as a dictionary containing its status,
+            and its result and message once finished. Return None if the job
+            does not exist. """
+
+        if not self.check_job_id(job_id):
+            return None
+
+        try:
+            with open(self.job_file(job_id), "r") as job_file:
+                return json.load(job_file)
+        except (IOError, ValueError):
+            return None
+
+
+    def cancel(self, job_id):
+        """ Cancel a job, dropping it from the queue if it is waiting, or
+            leaving a marker for the pool to terminate it if running. Return
+            False if the job does not exist or has already finished. """
+
+        with self.locked():
+            job = self.status(job_id)
+            if (job is None) or (job['status'] in JOB_FINISHED_STATES):
+                return False
+
+            if os.path.isfile(self.request_file(job_id)):
+                os.remove(self.request_file(job_id))
+                self.write_job(job_id, "cancelled")
+            else:
+                open(self.job_file(job_id) + ".cancel", "w").close()
+
+        return True
+
+
+    def locked(self):
+        """ Return a context holding the lock on the job directory. """
+
+        return JobDirectoryLock(os.path.join(self._job_directory, JOB_LOCK_FILE))
+
+
+    def queued_job_ids(self):
+        """ Return the IDs of queued jobs, oldest first. Call holding the lock. """
+
+        requests = []
+        for file_name in os.listdir(self._job_directory):
+            if file_name.endswith(JOB_REQUEST_SUFFIX):
+                job_id = file_name[:-len(JOB_REQUEST_SUFFIX)]
+                try:
+                    requests.append((os.path.getmtime(self.request_file(job_id)), job_id))
+                except OSError:
+                    pass # Expired meanwhile.
+
+        return [r[1] for r in sorted(requests)]
+
+
+    def write_job(self, job_id, status, result=None, message=""):
+        """ Write the state of a job to its file. """
+
+        job = {}
+        job['status'] = status
+        job['result'] = result
+        job['message'] = message
+
+        return self.write_file(self.job_file(job_id), job)
+
+
+    @staticmethod
+    def write_file(file_path, contents):
+        """ Write contents as JSON to a file, replacing it atomically. """
+
+        temporary_file = file_path + ".tmp"
+        with open(temporary_file, "w") as json_file:
+            json.dump(contents, json_file)
+        os.rename(temporary_file, file_path)
+
+        return True
+
+
+    def is_cancelled(self, job_id):
+        """ Return True if cancellation of a running job has been requested. """
+
+        return os.path.isfile(self.job_file(job_id) + ".cancel")
+
+
+    def job_file(self, job_id):
+        """ Return the path of the file holding the state of a job. """
+
+        return os.path.join(self._job_directory, job_id + ".json")
+
+
+    def request_file(self, job_id):
+        """ Return the path of the file holding the request of a queued job. """
+
+        return os.path.join(self._job_directory, job_id + JOB_REQUEST_SUFFIX)
+
+
+    @staticmethod
+    def check_job_id(job_id):
+        """ Return True if the job ID is well formed, preventing access to
+            files outside the job directory. """
+
+        return (len(job_id) == 32) and all(c in "0123456789abcdef" for c in job_id)
+
+
+class JobDirectoryLock:
+    """ Exclusive lock on a file, shared between processes, as a context. """
+
+    def __init__(self, lock_file):
+
+        self._lock_file = lock_file
+        self._handle = None
+
+
+    def __enter__(self):
+
+        self._handle = open(self._lock_file, "a")
+        fcntl.flock(self._handle, fcntl.LOCK_EX)
+
+        return self
+
+
+    def __exit__(self, exception_type, exception, traceback):
+
+        fcntl.flock(self._handle, fcntl.LOCK_UN)
+        self._handle.close()
+        self._handle = None
+
+        return False
+
+
+class RouteJobPool(RouteJobQueue):
+    """ Pool of worker processes running the jobs of a RouteJobQueue with
+        path finders built by finder_factory, one job at a time each. Jobs
+        are terminated along with their workers after timeout seconds or
+        when cancelled. Each worker returns results through its own pipe,
+        so that terminating one leaves the others unaffected. Only one pool
+        should run on a job directory. """
+
+    def __init__(self, finder_factory, workers=JOB_WORKERS, queue_depth=JOB_QUEUE_DEPTH, timeout=JOB_TIMEOUT, job_directory=JOB_DIRECTORY):
+
+        RouteJobQueue.__init__(self, queue_depth, job_directory)
+        self._finder_factory = finder_factory
+        self._worker_count = workers
+        self._timeout = timeout
+
+        self._workers = {}
+        self._last_expiry_check = 0
+
+
+    def run(self):
+        """ Start the worker processes and supervise them until interrupted. """
+
+        for worker_index in range(self._worker_count):
+            self.start_worker(worker_index)
+
+        try:
+            while True:
+                collected = self.collect_results()
+                self.check_jobs()
+                dispatched = self.dispatch_jobs()
+                self.expire_jobs()
+                if not (collected or dispatched):
+                    sleep(SUPERVISOR_INTERVAL)
+        finally:
+            for worker_index in self._workers:
+                self._workers[worker_index]['process'].terminate()
+
+
+    def start_worker(self, worker_index):
+        """ Start a worker process, or replace a terminated one. """
+
+        parent_connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_worker, args=(self._finder_factory, child_connection, parent_connection))
+        process.daemon = True
+        process.start()
+        child_connection.close()
+
+        worker = {}
+        worker['process'] = process
+        worker['connection'] = parent_connection
+        worker['job_id'] = None
+        worker['started'] = None
+        self._workers[worker_index] = worker
+
+        return True
+
+
+    def collect_results(self):
+        """ Record the results of workers which finished their jobs, and
+            replace workers which died, whether running a job or idle.
+            Return True if any results were collected. """
+
+        collected = False
+        for worker_index in self._workers:
+            worker = self._workers[worker_index]
+            if (worker['job_id'] is not None) and worker['connection'].poll():
+                try:
+                    job_id, result, message = worker['connection'].recv()
+                except EOFError:
+                    job_id, result, message = worker['job_id'], False, "Route job worker exited."
+                    self.replace_worker(worker_index)
+            elif not worker['process'].is_alive():
+                # Died while idle, such as on failing to build its path finder.
+                job_id = worker['job_id']
+                self.replace_worker(worker_index)
+                if job_id is None:
+                    continue
+                result, message = False, "Route job worker exited."
+            else:
+                continue
+
+            if result:
+                self.write_job(job_id, "done", result, message)
+            else:
+                self.write_job(job_id, "failed", None, message)
+            self.release_worker(worker_index)
+            collected = True
+
+        return collected
+
+
+    def check_jobs(self):
+        """ Terminate running jobs which timed out or were cancelled. """
+
+        for worker_index in self._workers:
+            worker = self._workers[worker_index]
+            job_id = worker['job_id']
+            if job_id is None:
+                continue
+
+            if self.is_cancelled(job_id):
+                self.write_job(job_id, "cancelled")
+            elif time() - worker['started'] > self._timeout:
+                self.write_job(job_id, "timeout", None, "Job exceeded " + str(self._timeout) + " seconds.")
+            else:
+                continue
+
+            self.replace_worker(worker_index)
+            self.release_worker(worker_index)
+
+        return True
+
+
+    def replace_worker(self, worker_index):
+        """ Terminate a worker and start another in its place, with a new pipe,
+            keeping the job it was running for release_worker. """
+
+        worker = self._workers[worker_index]
+        worker['process'].terminate()
+        worker['process'].join()
+        worker['connection'].close()
+        job_id = worker['job_id']
+        self.start_worker(worker_index)
+        self._workers[worker_index]['job_id'] = job_id
+
+        return True
+
+
+    def dispatch_jobs(self):
+        """ Take queued jobs for idle workers. Return True if any were sent. """
+
+        idle_workers = [i for i in self._workers if self._workers[i]['job_id'] is None]
+        if not idle_workers:
+            return False
+
+        taken_jobs = []
+        with self.locked():
+            for job_id in self.queued_job_ids()[:len(idle_workers)]:
+                try:
+                    with open(self.request_file(job_id), "r") as request_file:
+                        request = json.load(request_file)
+                except (IOError, ValueError):
+                    continue
+                os.remove(self.request_file(job_id))
+                self.write_job(job_id, "running")
+                taken_jobs.append((job_id, request))
+
+        for worker_index, (job_id, request) in zip(idle_workers, taken_jobs):
+            worker = self._workers[worker_index]
+            try:
+                worker['connection'].send((job_id, request['method'], request['arguments']))
+            except (IOError, OSError, ValueError):
+                # The worker died since the last check, so the job goes back to the queue.
+                self.replace_worker(worker_index)
+                self.requeue_job(job_id, request)
+                continue
+            worker['job_id'] = job_id
+            worker['started'] = time()
+
+        return len(taken_jobs) > 0
+
+
+    def requeue_job(self, job_id, request):
+        """ Return a job taken by dispatch_jobs to its place in the queue, unless
+            it was cancelled meanwhile. """
+
+        with self.locked():
+            if self.is_cancelled(job_id):
+                self.write_job(job_id, "cancelled")
+                os.remove(self.job_file(job_id) + ".cancel")
+                return False
+
+            self.write_job(job_id, "queued")
+            self.write_file(self.request_file(job_id), request)
+            os.utime(self.request_file(job_id), (request['submitted'], request['submitted']))
+
+        return True
+
+
+    def release_worker(self, worker_index):
+        """ Mark a worker as idle, and remove the cancellation marker of its
+            job if any. """
+
+        job_id = self._workers[worker_index]['job_id']
+        self._workers[worker_index]['job_id'] = None
+        self._workers[worker_index]['started'] = None
+
+        if (job_id is not None) and self.is_cancelled(job_id):
+            try:
+                os.remove(self.job_file(job_id) + ".cancel")
+            except OSError:
+                pass
+
+        return True
+
+
+    def expire_jobs(self):
+        """ Remove job files which have not been updated for JOB_EXPIRY seconds. """
+
+        if time() - self._last_expiry_check < JOB_EXPIRY / 10:
+            return False
+        self._last_expiry_check = time()
+
+        with self.locked():
+            for file_name in os.listdir(self._job_directory):
+                if file_name == JOB_LOCK_FILE:
+                    continue
+                file_path = os.path.join(self._job_directory, file_name)
+                try:
+                    if time() - os.path.getmtime(file_path) > JOB_EXPIRY:
+                        os.remove(file_path)
+                except OSError:
+                    pass
+
+        return True
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        sys.exit("Usage: python route_jobs.py [workers]")
+
+    import api_server # Path finders are built as in the API server.
+    pool = RouteJobPool(api_server.build_path_finder, int(sys.argv[1]) if len(sys.argv) == 2 else JOB_WORKERS)
+    pool.run()
@@ -6,9 +6,12 @@ from collections import OrderedDict
 from math import copysign
 from colorsys import hls_to_rgb
 from numpy import isnan
+import numpy as np
 
 from GeoData import rasters, bng_to_lonlat
 
+CLUSTER_CELL_PIXELS = 64 # Width of the cells of avalanche clusters on screen, in 256 pixel web map tiles.
+
 # Conversion table for aspect 0-360 degrees to RGB values, represented by linear changes in six segments.
 CHANNEL_RANGE = 255
 CHANNEL_COLOURINGS = {
@@ -76,6 +79,46 @@ def match_aspect_altitude_to_forecast(forecasts, aspect, altitude):
         return 0
 
 
+def match_aspects_altitudes_to_forecast(forecasts, aspects, altitudes):
+    """ Array version of match_aspect_altitude_to_forecast, matching grids of aspects
+        and altitudes to the risk codes of one list of SAIS forecasts at once. """
+
+    aspects = np.asarray(aspects, dtype=float)
+    altitudes = np.asarray(altitudes, dtype=float)
+    risk_codes = np.full(aspects.shape, -1, dtype=int)
+
+    # If forecasts not available.
+    if len(forecasts) <= 0:
+        return risk_codes
+
+    # Directions clockwise by ArcGIS definition, as in get_facing_from_aspect.
+    with np.errstate(invalid='ignore'):
+        valid = (aspects >= 0) & (aspects <= 360)
+        facings = {"N": valid & ((aspects > 337.5) | (aspects <= 22.5))}
+        for i, direction in enumerate(["NE", "E", "SE", "S", "SW", "W", "NW"]):
+            facings[direction] = valid & (aspects > 22.5 + 45 * i) & (aspects <= 67.5 + 45 * i)
+
+        for direction in facings:
+            forecast_search = [i for i in forecasts if str(i[3]) == direction]
+            if len(forecast_search) < 1:
+                continue
+            forecast = forecast_search[0]
+
+            lower_boundary = int(forecast[4])
+            middle_boundary = int(forecast[5])
+            upper_boundary = int(forecast[6])
+            lower_colour = max(int(forecast[7]), int(forecast[8]))
+            upper_colour = max(int(forecast[9]), int(forecast[10]))
+
+            # Outside the forecast altitudes there is no altitude-related risk.
+            facing = facings[direction]
+            risk_codes[facing] = 0
+            risk_codes[facing & (altitudes >= lower_boundary) & (altitudes < middle_boundary)] = lower_colour
+            risk_codes[facing & (altitudes >= middle_boundary) & (altitudes <= upper_boundary)] = upper_colour
+
+    return risk_codes
+
+
 def risk_code_to_colour(risk_code, static_risk, show_static_risk):
     """ Return an RGB 3-tuple for the colour represented by the risk_code
         and static risk (represented by capacity). """
@@ -163,3 +206,27 @@ def bng_to_longlat(bng):
 
     except ValueError:
         return False
+
+
+def cluster_points(longitudes, latitudes, zoom):
+    """ Group WGS84 points by the square cells of CLUSTER_CELL_PIXELS on a web
+        mercator map at a zoom level they fall in. Return a tuple (clusters,
+        longitudes, latitudes, counts): the cluster of each point, and the mean
+        coordinates and number of points of each cluster. """
+
+    longitudes = np.asarray(longitudes, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+    if len(longitudes) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0), np.zeros(0), np.zeros(0, dtype=int)
+
+    # Positions on the map, from 0 to 1 across the world.
+    map_x = (longitudes + 180) / 360
+    map_y = (1 - np.log(np.tan(np.radians(latitudes)) + 1 / np.cos(np.radians(latitudes))) / np.pi) / 2
+
+    cells_across = 2 ** zoom * 256 // CLUSTER_CELL_PIXELS
+    cells = np.floor(map_y * cells_across).astype(np.int64) * cells_across + np.floor(map_x * cells_across).astype(np.int64)
+    cells, clusters = np.unique(cells, return_inverse=True)
+
+    counts = np.bincount(clusters)
+
+    return clusters, np.bincount(clusters, longitudes) / counts, np.bincount(clusters, latitudes) / counts, counts
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# Rewrite the rasters in rasters.py as tiled, compressed cloud-optimised GeoTIFFs
+# with internal overviews, for several block sizes and codecs, and benchmark
+# random window reads on each variant against the source file.
+# Usage: python -m Scripts.benchmark_raster_layouts OUTPUT_DIRECTORY [RESULTS_FILE]
+from __future__ import division, print_function
+import os
+import sys
+import json
+import numpy as np
+from time import time
+from osgeo import gdal
+
+from Backend.GeoData import raster_reader, rasters
+
+RASTERS = [rasters.HEIGHT_RASTER, rasters.ASPECT_RASTER, rasters.CONTOUR_RASTER, rasters.RISK_RASTER]
+BLOCK_SIZES = [256, 512]
+CODECS = ['NONE', 'LZW', 'DEFLATE', 'ZSTD']
+OVERVIEW_LEVELS = [2, 4, 8, 16, 32]
+WINDOW_SIZES = [64, 256, 1024] # Points square, covering lazy search blocks up to full search grids.
+RESAMPLED_WINDOW = 8192 # Points square of coarse reads, resampled to RESAMPLED_SIZE.
+RESAMPLED_SIZE = 400
+READS_PER_SIZE = 200
+GDAL_CACHE_MB = 16 # Small block cache, so that repeated reads still reach the file.
+SEED = 0
+
+
+def describe_layout(file_name):
+    """ Return a dictionary describing the storage layout of a raster file. """
+
+    dataset = gdal.Open(file_name)
+    band = dataset.GetRasterBand(1)
+    structure = dataset.GetMetadata("IMAGE_STRUCTURE")
+
+    layout = {}
+    layout['size'] = [dataset.RasterXSize, dataset.RasterYSize]
+    layout['data_type'] = gdal.GetDataTypeName(band.DataType)
+    layout['block_size'] = band.GetBlockSize()
+    layout['compression'] = structure.get("COMPRESSION", "NONE")
+    layout['interleave'] = structure.get("INTERLEAVE")
+    layout['overviews'] = band.GetOverviewCount()
+    layout['file_mb'] = os.path.getsize(file_name) / 1024 / 1024
+
+    return layout
+
+
+def convert_raster(source_file, output_file, block_size, codec):
+    """ Rewrite a raster as a tiled cloud-optimised GeoTIFF with internal overviews,
+        using the COG driver if available (GDAL 3.1 and later), or a tiled GeoTIFF
+        with the overviews copied in from the source otherwise. Return False if the
+        conversion failed, for example with a codec GDAL was built without. """
+
+    source = gdal.Open(source_file)
+    floating = gdal.GetDataTypeName(source.GetRasterBand(1).DataType).startswith("Float")
+
+    if gdal.GetDriverByName("COG") is not None:
+        options = ["BLOCKSIZE=" + str(block_size), "COMPRESS=" + codec, "OVERVIEWS=AUTO", "BIGTIFF=IF_SAFER", "NUM_THREADS=ALL_CPUS"]
+        if codec != 'NONE':
+            options.append("PREDICTOR=YES")
+        return gdal.Translate(output_file, source, format="COG", creationOptions=options) is not None
+
+    # Older GDAL: build overviews on a temporary tiled copy, then copy them in at the end of the file.
+    temporary_file = output_file + ".tmp.tif"
+    gdal.Translate(temporary_file, source, format="GTiff", creationOptions=["TILED=YES", "BIGTIFF=IF_SAFER"])
+    temporary = gdal.Open(temporary_file, gdal.GA_Update)
+    temporary.BuildOverviews("NEAREST" if not floating else "AVERAGE", OVERVIEW_LEVELS)
+    temporary = None
+
+    options = ["TILED=YES", "BLOCKXSIZE=" + str(block_size), "BLOCKYSIZE=" + str(block_size), "COMPRESS=" + codec, "COPY_SRC_OVERVIEWS=YES", "BIGTIFF=IF_SAFER"]
+    if codec != 'NONE':
+        options.append("PREDICTOR=" + ("3" if floating else "2"))
+    converted = gdal.Translate(output_file, temporary_file, format="GTiff", creationOptions=options)
+    os.remove(temporary_file)
+
+    return converted is not None
+
+
+def time_reads(file_name):
+    """ Time random window reads through RasterReader, at full resolution for each
+        window size and resampled for large windows. Return a dictionary of read
+        statistics in milliseconds by read type. """
+
+    reader = raster_reader.RasterReader(file_name)
+    size_x, size_y = reader.get_size()
+    generator = np.random.RandomState(SEED)
+
+    read_types = [(str(w), w, None) for w in WINDOW_SIZES] + [("resampled_" + str(RESAMPLED_WINDOW), RESAMPLED_WINDOW, RESAMPLED_SIZE)]
+    timings = {}
+    for name, window, resampled_size in read_types:
+        window = min(window, size_x, size_y)
+        times = []
+        for r in range(READS_PER_SIZE):
+            index_x = generator.randint(0, size_x - window + 1)
+            index_y = generator.randint(0, size_y - window + 1)
+
+            start_time = time()
+            if resampled_size is None:
+                reader.read_window(index_x, index_y, window, window)
+            else:
+                initial = reader.index_to_coordinate(index_x, index_y)
+                final = reader.index_to_coordinate(index_x + window - 1, index_y + window - 1)
+                reader.read_points_resampled(initial[0], initial[1], final[0], final[1], resampled_size, resampled_size)
+            times.append((time() - start_time) * 1000)
+
+        timings[name] = {'mean_ms': float(np.mean(times)), 'median_ms': float(np.median(times)), 'p95_ms': float(np.percentile(times, 95))}
+
+    return timings
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [2, 3]:
+        sys.exit("Usage: python -m Scripts.benchmark_raster_layouts OUTPUT_DIRECTORY [RESULTS_FILE]")
+
+    output_directory = sys.argv[1]
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    gdal.SetCacheMax(GDAL_CACHE_MB * 1024 * 1024)
+
+    results = []
+    for source_file in RASTERS:
+        variants = [("source", None, None, source_file)]
+        for block_size in BLOCK_SIZES:
+            for codec in CODECS:
+                output_file = os.path.join(output_directory, os.path.splitext(os.path.basename(source_file))[0] + "_" + str(block_size) + "_" + codec.lower() + ".tif")
+                if not os.path.isfile(output_file):
+                    print("Converting " + source_file + " to " + output_file + "...")
+                    if not convert_raster(source_file, output_file, block_size, codec):
+                        print("Conversion failed, skipping " + codec + ".")
+                        continue
+                variants.append(("cog", block_size, codec, output_file))
+
+        for variant, block_size, codec, file_name in variants:
+            result = {}
+            result['raster'] = source_file
+            result['variant'] = variant
+            result['block_size'] = block_size
+            result['codec'] = codec
+            result['file'] = file_name
+            result['layout'] = describe_layout(file_name)
+            result['reads'] = time_reads(file_name)
+            results.append(result)
+
+            print(os.path.basename(file_name) + ": " + str(result['layout']))
+            for read_type in sorted(result['reads']):
+                print("    " + read_type + ": " + "%.2f" % result['reads'][read_type]['median_ms'] + "ms median, " + "%.2f" % result['reads'][read_type]['p95_ms'] + "ms p95")
+
+    if len(sys.argv) == 3:
+        with open(sys.argv[2], "w") as results_file:
+            json.dump(results, results_file, indent=2)
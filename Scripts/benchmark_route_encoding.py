@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# Benchmark the payload size and serialisation time of route encodings,
+# on synthetic routes in the format returned by the path finder.
+from __future__ import division, print_function
+import sys
+import json
+import random
+from time import time
+
+from Backend.GeoData import route_encoding
+
+ROUTE_LENGTHS = [100, 1000, 10000]
+TOLERANCES = [0, 2, 5, 10]
+REPEATS = 10
+CELL_DEGREES = 0.00005 # About 5 metres, the raster resolution.
+
+
+def synthetic_path(length, seed=0):
+    """ Build a path dictionary of a random walk across grid cells, drifting
+        towards the south east as routes between two points would. """
+
+    generator = random.Random(seed)
+    longitude = -5.0
+    latitude = 56.8
+    height = 500.0
+
+    path = {}
+    for p in range(length):
+        way_point = {}
+        way_point['long'] = str(longitude)
+        way_point['lat'] = str(latitude)
+        way_point['height'] = str(height)
+        way_point['risk'] = str(generator.random())
+        path[p] = way_point
+
+        longitude += generator.choice([-1, 0, 1, 1]) * CELL_DEGREES
+        latitude -= generator.choice([-1, 0, 1, 1]) * CELL_DEGREES
+        height += generator.uniform(-2, 2)
+
+    return path
+
+
+def time_call(function, *arguments):
+    """ Return the result of a function and its mean run time in milliseconds over REPEATS. """
+
+    start_time = time()
+    for r in range(REPEATS):
+        result = function(*arguments)
+
+    return result, (time() - start_time) / REPEATS * 1000
+
+
+def check_polyline(path):
+    """ Return the largest coordinate error in degrees of a polyline round trip. """
+
+    longitudes, latitudes, heights, risks = route_encoding.path_to_lists(path)
+    decoded_longitudes, decoded_latitudes = route_encoding.decode_polyline(route_encoding.encode_polyline(longitudes, latitudes))
+
+    return max(max(abs(a - b) for a, b in zip(longitudes, decoded_longitudes)), max(abs(a - b) for a, b in zip(latitudes, decoded_latitudes)))
+
+
+if __name__ == '__main__':
+    print("length,format,tolerance,vertices,bytes,encode_ms,serialise_ms,parse_ms")
+
+    for length in ROUTE_LENGTHS:
+        path = synthetic_path(length)
+
+        for route_format in route_encoding.ROUTE_FORMATS:
+            for tolerance in TOLERANCES:
+                encoded, encode_time = time_call(route_encoding.encode_path, path, route_format, tolerance)
+                payload, serialise_time = time_call(json.dumps, encoded)
+                parsed, parse_time = time_call(json.loads, payload)
+
+                if route_format == 'dict':
+                    vertices = len(encoded)
+                else:
+                    vertices = encoded['count']
+
+                print(",".join(map(str, [length, route_format, tolerance, vertices, len(payload), round(encode_time, 3), round(serialise_time, 3), round(parse_time, 3)])))
+
+        print("Polyline round trip error for " + str(length) + " points: " + str(check_polyline(path)) + " degrees.", file=sys.stderr)
@@ -3,15 +3,15 @@
 from __future__ import division
 import os
 import sys
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import OrderedDict
 
 from Backend.SAISCrawler.script import db_manager, utils
-from Backend.GeoData import raster_reader, rasters, bng_to_lonlat
+from Backend.GeoData import raster_reader, raster_statistics, rasters, bng_to_lonlat
 
 THRESHOLD_PERCENTILES_TABLE = [70, 80, 90, 95, 99.5, 99.9]
-THRESHOLD_VALUES_TABLE = [4.662734e-04, 9.898760e-04, 2.906299e-03, 8.608662e-03, 0.1230, 0.3411]
 THRESHOLD_PERCENTILES = [
     70, 71, 72, 73, 74,
     75, 76, 77, 78, 79,
@@ -20,14 +20,6 @@ THRESHOLD_PERCENTILES = [
     90, 91, 92, 93, 94,
     95, 96, 97, 98, 99,
     99.5, 99.9]
-THRESHOLD_VALUES = [
-    4.662734e-04, 4.999712e-04, 5.365540e-04, 5.762908e-04, 6.196216e-04,
-    6.668069e-04, 7.184984e-04, 7.757625e-04, 8.394114e-04, 9.103318e-04,
-    9.898760e-04, 1.079330e-03, 1.180318e-03, 1.295451e-03, 1.427700e-03,
-    1.580646e-03, 1.759083e-03, 1.969195e-03, 2.220621e-03, 2.526284e-03,
-    2.906299e-03, 3.391978e-03, 4.037947e-03, 4.945721e-03, 6.317833e-03,
-    8.608662e-03, 1.295777e-02, 2.262644e-02, 4.515500e-02, 8.902361e-02,
-    0.1230, 0.3411]
 
 HIST_Y_MAX = 1000000
 HIST_X_CUT_OFF = 0.006
@@ -37,115 +29,181 @@ ANNOTATE_THRESHOLDS = [95, 98, 99, 99.5, 99.9]
 DISTANCES = [5, 10, 25, 50, 100]
 DISTANCE_COLOURS = ['r', 'b', 'g', 'k', 'm']
 RASTER_RESOLUTION = 5
+CHUNKS_PER_PROCESS = 4 # Avalanches are split into this many chunks for each process, to balance the load.
 
-dbFile = './SAISCrawler/data/forecast.db'
-avalanche_dbm = db_manager.CrawlerDB(dbFile)
-static_risk = raster_reader.RasterReader(rasters.RISK_RASTER)
+worker_static_risk = None # Reader of each evaluation process.
 
-all_past_avalanches = avalanche_dbm.select_all_past_avalanches()
-accuracy_data = OrderedDict({})
 
-print("==========================================================")
-for distance in DISTANCES:
-    accuracy_data[distance*RASTER_RESOLUTION] = []
+def initialise_worker():
+    """ Open the static risk raster in each evaluation process. """
+
+    global worker_static_risk
+    worker_static_risk = raster_reader.RasterReader(rasters.RISK_RASTER)
+
+
+def evaluate_avalanches(coordinates):
+    """ Return a tuple (tested, maxima) of arrays with a row for each search
+        distance and a column for each avalanche's WGS84 coordinates (x, y):
+        whether its box at the distance lies within the raster, and the maximum
+        static risk in the box. The box at the largest distance is read once,
+        smaller boxes being slices of it. """
+
+    reader = worker_static_risk
+    largest = max(DISTANCES)
+    tested = np.zeros((len(DISTANCES), len(coordinates)), dtype=bool)
+    maxima = np.full((len(DISTANCES), len(coordinates)), -np.inf)
+
+    for a in range(len(coordinates)):
+
+        x, y = coordinates[a]
+        index_x, index_y = reader.coordinate_to_index(x, y)
+
+        # Read the largest box, clipped to the raster.
+        origin_x = max(index_x - largest, 0)
+        origin_y = max(index_y - largest, 0)
+        window = reader.read_window(origin_x, origin_y, index_x + largest + 1 - origin_x, index_y + largest + 1 - origin_y)
+        if isinstance(window, bool):
+            continue
+
+        for d in range(len(DISTANCES)):
+            distance = DISTANCES[d]
+
+            # Boxes outside the raster boundary are discarded, checking their corners as read_points does.
+            box_initial = reader.index_to_coordinate(index_x - distance, index_y - distance)
+            box_final = reader.index_to_coordinate(index_x + distance, index_y + distance)
+            if (not reader.check_access_window(box_initial[0], box_initial[1])) or (not reader.check_access_window(box_final[0], box_final[1])):
+                continue
+
+            tested[d, a] = True
+
+            # Boxes one point past the far edges pass the corner check but fail to read, counting as misses.
+            if (index_x + distance >= reader.get_size()[0]) or (index_y + distance >= reader.get_size()[1]):
+                continue
+            maxima[d, a] = np.amax(window[index_y - distance - origin_y:index_y + distance + 1 - origin_y, index_x - distance - origin_x:index_x + distance + 1 - origin_x])
+
+    return tested, maxima
+
+
+if __name__ == '__main__':
+    dbFile = './SAISCrawler/data/forecast.db'
+    avalanche_dbm = db_manager.CrawlerDB(dbFile)
+    static_risk = raster_reader.RasterReader(rasters.RISK_RASTER)
+
+    # Threshold values at each percentile, computed once for each version of the raster.
+    THRESHOLD_VALUES = raster_statistics.load_percentiles(rasters.RISK_RASTER, THRESHOLD_PERCENTILES)
+    if THRESHOLD_VALUES is None:
+        sys.exit("The static risk raster has no valid values.")
+
+    # The thresholds come from sketched percentiles of the raster, so show the values used.
+    print("Threshold values at each percentile:")
     for t in range(len(THRESHOLD_PERCENTILES)):
-        current_threshold_hits = 0
-        total_tested = 0
-        for avalanche in all_past_avalanches:
-
-            # Convert BNG locations to coordinates.
-            x, y = bng_to_lonlat.OSGB36toWGS84(avalanche[2], avalanche[3])
-
-            # Calculate the coordinates of the initial and final points of our bounding box.
-            # First four params can refer to the same coordinate due to how the function works.
-            index_x, index_y = static_risk.coordinate_to_index(x, y)
-            box_initial = static_risk.index_to_coordinate(index_x - distance, index_y - distance)
-            box_final = static_risk.index_to_coordinate(index_x + distance, index_y + distance)
-
-            # Read the static risk in the bounding box.
-            risk_points = static_risk.read_points(box_initial[0], box_initial[1], box_final[0], box_final[1])
-            if isinstance(risk_points, bool):
-                if not risk_points:
-                    # Box outside raster boundary, discard.
-                    continue
-
-            # Now count the total and check whether it's a hit.
-            total_tested += 1
-            max_risk = np.amax(risk_points)
-
-            if max_risk >= THRESHOLD_VALUES[t]:
-                current_threshold_hits += 1
-
-        accuracy_data[distance*RASTER_RESOLUTION].append((THRESHOLD_PERCENTILES[t], current_threshold_hits/total_tested)) # (percentile, accuracy)
-        print("{}m at {}pct: accuracy {}%".format(distance * RASTER_RESOLUTION, THRESHOLD_PERCENTILES[t], current_threshold_hits/total_tested * 100))
-print("==========================================================")
-
-# Print TeX table.
-print("Data Table for LaTeX:")
-print("\\centering \\begin{tabular}{ " + '| c' * (len(accuracy_data) + 2) + "| }")
-print("\\hline")
-header = "Threshold\\% & \\% of test area &"
-for d in accuracy_data:
-    header += " Search {}m &".format(d)
-print(header[:-1] + "\\\\ \\hline")
-
-for t in THRESHOLD_PERCENTILES_TABLE[:-1]:
-    line = "{}\\% & {}\\% &".format(t, 100-t)
-    for d in accuracy_data[:-1]:
-        accuracy = [i[1] for i in accuracy_data[d] if i[0] == t][0]
-        line += " %.2f" % (accuracy*100) + "\\% &"
-    print(line[:-1] + "\\\\ \\hline")
-print("\\end{tabular}")
-sys.exit(0)
-
-# Make plots.
-plt.figure(1)
-plt.axis([70, 100, 0, 100])
-plt.title('Accuracy of Static Risk Model in Recalling Recorded Avalanches')
-plt.xlabel("Risk Threshold (percentile)")
-plt.ylabel("Recall Accuracy (%)")
-plt.grid(True)
-colour_count = 0
-text_y = 2
-for d in accuracy_data:
-    plt.plot([i[0] for i in accuracy_data[d]], [i[1] * 100 for i in accuracy_data[d]], DISTANCE_COLOURS[colour_count] + '-')
-    plt.text(71, text_y, "--: searching within " + str(d) + 'm', color=DISTANCE_COLOURS[colour_count])
-    colour_count += 1
-    text_y += 3.5
-plt.show()
-
-# Make Histogram.
-plt.figure(2)
-print("==========================================================")
-print("Reading full raster...")
-full_raster = static_risk.read_full_raster().flatten()
-print("Full raster read. Running hist...")
-hist_arr, bins, patches = plt.hist(full_raster, 5000)
-plt.xlabel('Statick Risk Value')
-plt.ylabel('Number of Points')
-plt.title('Distribution of Static Risk Values in Calculated Data')
-plt.axis([0, THRESHOLD_VALUES[-1] * 2, 0, HIST_Y_MAX])
-plt.grid(True)
-plt.annotate('capped (max > 8e8)', xy=(HIST_X_CUT_OFF, HIST_Y_MAX), xytext=(HIST_X_CUT_OFF + 0.2, HIST_Y_MAX * 0.95),
-            arrowprops=dict(facecolor='red', shrink=0.05),
-            )
-
-pos_y = 0.3
-for thres in range(len(ANNOTATE_THRESHOLDS)):
-    thres_x = THRESHOLD_VALUES[THRESHOLD_PERCENTILES.index(ANNOTATE_THRESHOLDS[thres])]
-    plt.text(THRESHOLD_VALUES[-1] * 2 - 0.25, HIST_Y_MAX * pos_y, "| : " + str(ANNOTATE_THRESHOLDS[thres]) + 'th percentile', color=ANNOTATE_COLOURS[thres])
-    plt.plot((thres_x, thres_x), (0, HIST_Y_MAX), ANNOTATE_COLOURS[thres] + '-')
-    pos_y += 0.05
-plt.show()
-
-# Make extra histogram for full view.
-print("==========================================================")
-print("Making a full view histogram...")
-plt.figure(3)
-hist_arr, bins, patches = plt.hist(full_raster, 5000)
-plt.xlabel('Statick Risk Value')
-plt.ylabel('Number of Points')
-plt.title('Distribution of Static Risk Values in Calculated Data (Full)')
-plt.axis([0, THRESHOLD_VALUES[-1] * 2, 0, HIST_Y_MAX * 1000])
-plt.grid(True)
-plt.show()
+        print("{}pct: {}".format(THRESHOLD_PERCENTILES[t], THRESHOLD_VALUES[t]))
+
+    all_past_avalanches = avalanche_dbm.select_all_past_avalanches()
+
+    # Convert BNG locations to coordinates all at once.
+    longitudes, latitudes = bng_to_lonlat.OSGB36toWGS84_array([avalanche[2] for avalanche in all_past_avalanches], [avalanche[3] for avalanche in all_past_avalanches])
+    coordinates = list(zip(longitudes, latitudes))
+
+    # Evaluate chunks of avalanches in parallel.
+    processes = multiprocessing.cpu_count()
+    chunk_size = max(len(coordinates) // (processes * CHUNKS_PER_PROCESS), 1)
+    chunks = [coordinates[i:i + chunk_size] for i in range(0, len(coordinates), chunk_size)]
+    pool = multiprocessing.Pool(processes, initialise_worker)
+    results = pool.map(evaluate_avalanches, chunks)
+    pool.close()
+    pool.join()
+    tested = np.concatenate([r[0] for r in results], axis=1)
+    maxima = np.concatenate([r[1] for r in results], axis=1)
+
+    # A maximum hits every threshold up to it, thresholds rising with their percentiles.
+    thresholds = np.array(THRESHOLD_VALUES)
+    accuracy_data = OrderedDict({})
+
+    print("==========================================================")
+    for d in range(len(DISTANCES)):
+        distance = DISTANCES[d]
+        accuracy_data[distance*RASTER_RESOLUTION] = []
+
+        # Maxima of NaN, from points without data, hit no threshold.
+        tested_maxima = maxima[d][tested[d]]
+        tested_maxima[np.isnan(tested_maxima)] = -np.inf
+        thresholds_hit = np.searchsorted(thresholds, tested_maxima, side='right')
+        hits = np.cumsum(np.bincount(thresholds_hit, minlength=len(thresholds) + 1)[::-1])[::-1][1:]
+        total_tested = int(np.sum(tested[d]))
+
+        for t in range(len(THRESHOLD_PERCENTILES)):
+            current_threshold_hits = int(hits[t])
+            accuracy_data[distance*RASTER_RESOLUTION].append((THRESHOLD_PERCENTILES[t], current_threshold_hits/total_tested)) # (percentile, accuracy)
+            print("{}m at {}pct: accuracy {}%".format(distance * RASTER_RESOLUTION, THRESHOLD_PERCENTILES[t], current_threshold_hits/total_tested * 100))
+    print("==========================================================")
+
+    # Print TeX table.
+    print("Data Table for LaTeX:")
+    print("\\centering \\begin{tabular}{ " + '| c' * (len(accuracy_data) + 2) + "| }")
+    print("\\hline")
+    header = "Threshold\\% & \\% of test area &"
+    for d in accuracy_data:
+        header += " Search {}m &".format(d)
+    print(header[:-1] + "\\\\ \\hline")
+
+    for t in THRESHOLD_PERCENTILES_TABLE[:-1]:
+        line = "{}\\% & {}\\% &".format(t, 100-t)
+        for d in list(accuracy_data)[:-1]:
+            accuracy = [i[1] for i in accuracy_data[d] if i[0] == t][0]
+            line += " %.2f" % (accuracy*100) + "\\% &"
+        print(line[:-1] + "\\\\ \\hline")
+    print("\\end{tabular}")
+    sys.exit(0)
+
+    # Make plots.
+    plt.figure(1)
+    plt.axis([70, 100, 0, 100])
+    plt.title('Accuracy of Static Risk Model in Recalling Recorded Avalanches')
+    plt.xlabel("Risk Threshold (percentile)")
+    plt.ylabel("Recall Accuracy (%)")
+    plt.grid(True)
+    colour_count = 0
+    text_y = 2
+    for d in accuracy_data:
+        plt.plot([i[0] for i in accuracy_data[d]], [i[1] * 100 for i in accuracy_data[d]], DISTANCE_COLOURS[colour_count] + '-')
+        plt.text(71, text_y, "--: searching within " + str(d) + 'm', color=DISTANCE_COLOURS[colour_count])
+        colour_count += 1
+        text_y += 3.5
+    plt.show()
+
+    # Make Histogram.
+    plt.figure(2)
+    print("==========================================================")
+    print("Streaming raster histogram...")
+    hist_counts, hist_bins = raster_statistics.raster_histogram(static_risk, 5000)
+    print("Histogram built. Plotting...")
+    hist_arr, bins, patches = plt.hist(hist_bins[:-1], hist_bins, weights=hist_counts)
+    plt.xlabel('Statick Risk Value')
+    plt.ylabel('Number of Points')
+    plt.title('Distribution of Static Risk Values in Calculated Data')
+    plt.axis([0, THRESHOLD_VALUES[-1] * 2, 0, HIST_Y_MAX])
+    plt.grid(True)
+    plt.annotate('capped (max > 8e8)', xy=(HIST_X_CUT_OFF, HIST_Y_MAX), xytext=(HIST_X_CUT_OFF + 0.2, HIST_Y_MAX * 0.95),
+                arrowprops=dict(facecolor='red', shrink=0.05),
+                )
+
+    pos_y = 0.3
+    for thres in range(len(ANNOTATE_THRESHOLDS)):
+        thres_x = THRESHOLD_VALUES[THRESHOLD_PERCENTILES.index(ANNOTATE_THRESHOLDS[thres])]
+        plt.text(THRESHOLD_VALUES[-1] * 2 - 0.25, HIST_Y_MAX * pos_y, "| : " + str(ANNOTATE_THRESHOLDS[thres]) + 'th percentile', color=ANNOTATE_COLOURS[thres])
+        plt.plot((thres_x, thres_x), (0, HIST_Y_MAX), ANNOTATE_COLOURS[thres] + '-')
+        pos_y += 0.05
+    plt.show()
+
+    # Make extra histogram for full view.
+    print("==========================================================")
+    print("Making a full view histogram...")
+    plt.figure(3)
+    hist_arr, bins, patches = plt.hist(hist_bins[:-1], hist_bins, weights=hist_counts)
+    plt.xlabel('Statick Risk Value')
+    plt.ylabel('Number of Points')
+    plt.title('Distribution of Static Risk Values in Calculated Data (Full)')
+    plt.axis([0, THRESHOLD_VALUES[-1] * 2, 0, HIST_Y_MAX * 1000])
+    plt.grid(True)
+    plt.show()